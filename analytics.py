@@ -0,0 +1,496 @@
+#!/usr/bin/env python3
+"""
+Snapshot analytics dạng cột (Parquet / Arrow IPC) của metadata email và báo cáo trên snapshot
+
+Báo cáo (lưu lượng theo domain / sender / giờ, file đính kèm, độ trễ từ `timestamp` của Mailgun
+tới lúc ingest) chạy bằng pyarrow / pandas trên file snapshot, không truy vấn database production.
+
+export đọc webhook mới sau checkpoint qua change feed (theo _id, chỉ các field cần cho snapshot)
+và ghi mỗi batch thành một file cho mỗi ngày của `timestamp` (giờ local, giống archive của retention):
+
+    <ANALYTICS_DIR>/date=YYYY-MM-DD/part-<_id đầu tiên>.parquet     (hoặc .arrow với --format ipc)
+
+Checkpoint (_id cuối cùng đã export) ở <ANALYTICS_DIR>/_checkpoint.json chỉ được cập nhật sau khi
+file đã ghi xong, nên dừng giữa chừng không mất dòng; batch ghi dở được export lại và báo cáo bỏ
+dòng trùng id. `compact` gộp các file nhỏ của những ngày đã qua thành một file.
+
+Cách chạy (cần `pip install pyarrow pandas`):
+    python analytics.py export                       # cron, hoặc --interval 300 để chạy liên tục
+    python analytics.py compact
+    python analytics.py volume --by domain --since 2024-01-01
+    python analytics.py volume --by hour --type inbound_email
+    python analytics.py attachments --by domain
+    python analytics.py latency --by domain --csv
+"""
+
+import argparse
+import glob
+import json
+import logging
+import os
+import time
+from collections import defaultdict
+from datetime import date, datetime
+from email.utils import parseaddr
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.ipc
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow là tùy chọn, chỉ cần cho analytics
+    pa = None
+
+try:
+    import pandas as pd
+except ImportError:  # pandas là tùy chọn, chỉ cần cho báo cáo
+    pd = None
+
+from changes import ChangeFeed
+from processors import EmailEventProcessor
+from storage import extract_email_fields, extract_recipient_addresses
+from tenants import address_domain
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_FILE = '_checkpoint.json'
+FORMATS = {'parquet': '.parquet', 'ipc': '.arrow'}
+
+# Field đọc từ database cho một dòng snapshot (không đọc body / header / file đính kèm)
+SNAPSHOT_FIELDS = [
+    'timestamp', 'webhook_type', 'tenant', 'recipient_addresses', 'subject_categories', 'otp.code',
+    'request_form_data.sender', 'request_form_data.from', 'request_form_data.From',
+    'request_form_data.To', 'request_form_data.to', 'request_form_data.recipient',
+    'request_form_data.domain', 'request_form_data.timestamp', 'request_form_data.event-data',
+    'request_json.event-data',
+    'processed_data.email_data.attachment_count', 'processed_data.email_data.attachments',
+]
+
+# Cột dùng được cho --by (hour / day / category được tính khi truy vấn)
+GROUP_COLUMNS = {
+    'domain': 'domain',
+    'sender': 'sender',
+    'sender-domain': 'sender_domain',
+    'recipient': 'recipient',
+    'tenant': 'tenant',
+    'type': 'webhook_type',
+    'event': 'event',
+}
+GROUP_CHOICES = [*GROUP_COLUMNS, 'hour', 'day', 'category']
+
+
+def require(*modules):
+    """Raise RuntimeError nếu thiếu pyarrow / pandas"""
+    missing = [name for name, module in (('pyarrow', pa), ('pandas', pd)) if name in modules and module is None]
+    if missing:
+        raise RuntimeError(f"Cần cài {' và '.join(missing)} cho analytics: pip install pyarrow pandas")
+
+
+def snapshot_schema():
+    return pa.schema([
+        ('id', pa.string()),
+        ('received_at', pa.timestamp('ms')),
+        ('mailgun_at', pa.timestamp('ms')),
+        ('webhook_type', pa.string()),
+        ('event', pa.string()),
+        ('tenant', pa.string()),
+        ('domain', pa.string()),
+        ('recipient', pa.string()),
+        ('recipient_count', pa.int32()),
+        ('sender', pa.string()),
+        ('sender_domain', pa.string()),
+        ('subject_categories', pa.list_(pa.string())),
+        ('has_otp', pa.bool_()),
+        ('attachment_count', pa.int32()),
+        ('attachment_bytes', pa.int64()),
+    ])
+
+
+def epoch_to_datetime(value):
+    """timestamp của Mailgun (epoch giây, số hoặc chuỗi) -> datetime local như `timestamp` khi ingest"""
+    try:
+        return datetime.fromtimestamp(float(value))
+    except (TypeError, ValueError, OverflowError, OSError):
+        return None
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def snapshot_row(document):
+    """Một dòng snapshot (metadata gọn) từ webhook document"""
+    form_data = document.get('request_form_data') or {}
+    webhook_type = document.get('webhook_type') or 'unknown'
+    row = {
+        'id': str(document['_id']),
+        'received_at': document['timestamp'],
+        'webhook_type': webhook_type,
+        'event': None,
+        'tenant': document.get('tenant'),
+        'subject_categories': document.get('subject_categories') or [],
+        'has_otp': bool(document.get('otp')),
+        'attachment_count': None,
+        'attachment_bytes': None,
+    }
+
+    event = EmailEventProcessor.event_data(document) if webhook_type == 'email_event' else None
+    if event is not None:
+        row['event'] = event.get('event')
+        sender = (event.get('envelope') or {}).get('sender') or ''
+        recipients = [(event.get('recipient') or '').lower()] if event.get('recipient') else []
+        domain = event.get('domain')
+        mailgun_timestamp = event.get('timestamp')
+    else:
+        sender = extract_email_fields(document)['sender']
+        recipients = document.get('recipient_addresses') or extract_recipient_addresses(document)
+        domain = form_data.get('domain')
+        mailgun_timestamp = form_data.get('timestamp')
+        if webhook_type == 'inbound_email':
+            email_data = (document.get('processed_data') or {}).get('email_data') or {}
+            attachments = email_data.get('attachments') or []
+            row['attachment_count'] = _int(email_data.get('attachment_count')) or len(attachments)
+            row['attachment_bytes'] = sum(_int(attachment.get('size')) for attachment in attachments)
+
+    sender = parseaddr(sender or '')[1].strip().lower()
+    row.update({
+        'mailgun_at': epoch_to_datetime(mailgun_timestamp),
+        'domain': (domain if isinstance(domain, str) else '').lower()
+                  or (address_domain(recipients[0]) if recipients else None),
+        'recipient': recipients[0] if recipients else None,
+        'recipient_count': len(recipients),
+        'sender': sender or None,
+        'sender_domain': address_domain(sender) or None,
+    })
+    return row
+
+
+def _replace_atomically(path, write):
+    """Ghi qua file tạm (tên bắt đầu bằng '.', dataset bỏ qua) rồi đổi tên"""
+    directory, name = os.path.split(path)
+    tmp_path = os.path.join(directory, f'.{name}.tmp')
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def write_table(table, path, fmt):
+    """Ghi bảng ra Parquet / Arrow IPC (nén zstd)"""
+    def write(tmp_path):
+        if fmt == 'ipc':
+            options = pa.ipc.IpcWriteOptions(compression='zstd')
+            with pa.OSFile(tmp_path, 'wb') as sink, pa.ipc.new_file(sink, table.schema, options=options) as writer:
+                writer.write_table(table)
+        else:
+            pq.write_table(table, tmp_path, compression='zstd')
+    _replace_atomically(path, write)
+
+
+class SnapshotExporter:
+    """Export incremental webhook -> file snapshot theo ngày, tiếp tục từ checkpoint"""
+
+    def __init__(self, storage, directory, fmt='parquet', batch_size=5000, settle_seconds=2.0):
+        if fmt not in FORMATS:
+            raise ValueError(f"Format không hợp lệ: {fmt} ({' | '.join(FORMATS)})")
+        self.feed = ChangeFeed(storage, settle_seconds=settle_seconds)
+        self.directory = directory
+        self.fmt = fmt
+        self.batch_size = batch_size
+        self.checkpoint_path = os.path.join(directory, CHECKPOINT_FILE)
+
+    def load_checkpoint(self):
+        try:
+            with open(self.checkpoint_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {'last_id': None, 'exported': 0}
+
+    def save_checkpoint(self, checkpoint):
+        def write(tmp_path):
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(checkpoint, f)
+                f.flush()
+                os.fsync(f.fileno())
+        _replace_atomically(self.checkpoint_path, write)
+
+    def write_batch(self, documents):
+        """Ghi một batch, mỗi ngày một file; trả về số byte đã ghi"""
+        days = defaultdict(list)
+        for document in documents:
+            days[document['timestamp'].strftime('%Y-%m-%d')].append(snapshot_row(document))
+
+        schema = snapshot_schema()
+        written = 0
+        for day, rows in days.items():
+            directory = os.path.join(self.directory, f'date={day}')
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f"part-{rows[0]['id']}{FORMATS[self.fmt]}")
+            write_table(pa.Table.from_pylist(rows, schema=schema), path, self.fmt)
+            written += os.path.getsize(path)
+        return written
+
+    def export(self):
+        """Export tới hiện tại (trừ `settle_seconds` cuối của change feed); trả về (số webhook, số byte)"""
+        require('pyarrow')
+        os.makedirs(self.directory, exist_ok=True)
+        checkpoint = self.load_checkpoint()
+        exported = written = 0
+        has_more = True
+        while has_more:
+            documents, last_id, has_more = self.feed.read(
+                after_id=checkpoint['last_id'], limit=self.batch_size, fields=SNAPSHOT_FIELDS
+            )
+            if not documents:
+                break
+            written += self.write_batch(documents)
+            exported += len(documents)
+            checkpoint = {
+                'last_id': last_id,
+                'exported': checkpoint.get('exported', 0) + len(documents),
+                'updated_at': datetime.now().isoformat(),
+            }
+            self.save_checkpoint(checkpoint)
+            logger.info(f"[STATS] Analytics snapshot +{len(documents)} webhooks, checkpoint {last_id}")
+        return exported, written
+
+
+def day_directories(directory):
+    return sorted(path for path in glob.glob(os.path.join(directory, 'date=*')) if os.path.isdir(path))
+
+
+def compact(directory, fmt='parquet', before=None):
+    """
+    Gộp các file của mỗi ngày trước `before` (mặc định hôm nay) thành một file, bỏ dòng trùng id.
+    Trả về số ngày đã gộp.
+    """
+    require('pyarrow')
+    before = (before or date.today()).isoformat()
+    compacted = 0
+    for day_dir in day_directories(directory):
+        day = os.path.basename(day_dir).split('=', 1)[1]
+        files = [path for extension in FORMATS.values() for path in glob.glob(os.path.join(day_dir, f'part-*{extension}'))]
+        if day >= before or len(files) < 2:
+            continue
+        table = open_dataset(day_dir, partitioned=False).to_table()
+        first_rows = {}
+        for index, webhook_id in enumerate(table.column('id').to_pylist()):
+            first_rows.setdefault(webhook_id, index)
+        table = table.take(sorted(first_rows.values())).sort_by('id')
+        path = os.path.join(day_dir, f"part-{table.column('id')[0].as_py()}{FORMATS[fmt]}")
+        write_table(table, path, fmt)
+        for old_path in files:
+            if old_path != path:
+                os.remove(old_path)
+        compacted += 1
+        logger.info(f"[SUCCESS] Compacted {day}: {len(files)} files -> 1 ({table.num_rows} rows)")
+    return compacted
+
+
+def open_dataset(directory, partitioned=True):
+    """Dataset pyarrow trên mọi file snapshot (Parquet và Arrow IPC), cột `date` lấy từ tên thư mục"""
+    require('pyarrow')
+    schema = snapshot_schema()
+    partitioning = None
+    if partitioned:
+        partitioning = ds.partitioning(pa.schema([('date', pa.string())]), flavor='hive')
+        schema = schema.append(pa.field('date', pa.string()))
+    pattern = os.path.join('date=*', 'part-*') if partitioned else 'part-*'
+    children = []
+    for fmt, extension in FORMATS.items():
+        files = sorted(glob.glob(os.path.join(directory, pattern + extension)))
+        if files:
+            children.append(ds.dataset(files, schema=schema, format=fmt,
+                                       partitioning=partitioning, partition_base_dir=directory))
+    if not children:
+        raise FileNotFoundError(f'Chưa có snapshot trong {directory} (chạy `python analytics.py export` trước)')
+    return children[0] if len(children) == 1 else ds.dataset(children)
+
+
+def load_frame(directory, columns, since=None, until=None, webhook_type=None, tenant=None):
+    """
+    DataFrame chỉ gồm `columns` (và id) của các ngày since..until (YYYY-MM-DD, tính cả hai đầu);
+    lọc ngày bỏ qua nguyên thư mục, lọc type / tenant chạy trong pyarrow
+    """
+    require('pyarrow', 'pandas')
+    conditions = []
+    if since:
+        conditions.append(ds.field('date') >= since)
+    if until:
+        conditions.append(ds.field('date') <= until)
+    if webhook_type:
+        conditions.append(ds.field('webhook_type') == webhook_type)
+    if tenant:
+        conditions.append(ds.field('tenant') == tenant)
+    expression = None
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+
+    table = open_dataset(directory).to_table(columns=['id', *columns], filter=expression)
+    return table.to_pandas().drop_duplicates('id')
+
+
+def group_keys(frame, by):
+    """(frame, Series khóa nhóm) cho --by; category tách mỗi category thành một dòng"""
+    if by == 'hour':
+        return frame, frame['received_at'].dt.floor('h')
+    if by == 'day':
+        return frame, frame['received_at'].dt.floor('D')
+    if by == 'category':
+        frame = frame.explode('subject_categories')
+        return frame, frame['subject_categories'].fillna('(none)')
+    return frame, frame[GROUP_COLUMNS[by]].fillna('(none)')
+
+
+def group_columns(by):
+    if by in ('hour', 'day'):
+        return ['received_at']
+    if by == 'category':
+        return ['subject_categories']
+    return [GROUP_COLUMNS[by]] if by else []
+
+
+def _sorted(result, by, sort_column, top):
+    if by in ('hour', 'day'):
+        return result.sort_index()
+    return result.sort_values(sort_column, ascending=False).head(top)
+
+
+def volume_report(frame, by, top=20):
+    """Số webhook theo nhóm (và phần trăm trên tổng số webhook)"""
+    total = len(frame)
+    frame, keys = group_keys(frame, by)
+    result = frame.groupby(keys.rename(by)).size().to_frame('webhooks')
+    result['percent'] = (result['webhooks'] * 100 / total).round(2)
+    return _sorted(result, by, 'webhooks', top)
+
+
+def attachments_report(frame, by=None, top=20):
+    """Thống kê file đính kèm của inbound email (tổng hoặc theo nhóm)"""
+    frame = frame[frame['webhook_type'] == 'inbound_email'].assign(
+        attachment_count=lambda f: f['attachment_count'].fillna(0).astype('int64'),
+        attachment_bytes=lambda f: f['attachment_bytes'].fillna(0).astype('int64'),
+    )
+    frame = frame.assign(has_attachments=frame['attachment_count'] > 0)
+    frame, keys = group_keys(frame, by) if by else (frame, pd.Series('(all)', index=frame.index))
+    grouped = frame.groupby(keys.rename(by or 'all'))
+    result = grouped.agg(
+        emails=('id', 'size'),
+        with_attachments=('has_attachments', 'sum'),
+        attachments=('attachment_count', 'sum'),
+        total_mb=('attachment_bytes', 'sum'),
+        max_mb=('attachment_bytes', 'max'),
+    )
+    result['with_attachments_pct'] = (result['with_attachments'] * 100 / result['emails']).round(2)
+    result['avg_kb'] = (result['total_mb'] / result['with_attachments'].where(result['with_attachments'] > 0) / 1024).round(1)
+    result['total_mb'] = (result['total_mb'] / (1024 * 1024)).round(2)
+    result['max_mb'] = (result['max_mb'] / (1024 * 1024)).round(2)
+    return _sorted(result, by, 'emails', top)
+
+
+def latency_report(frame, by=None, top=20):
+    """Độ trễ (giây) từ `timestamp` của Mailgun tới lúc ingest: p50 / p95 / p99 / max"""
+    frame = frame.assign(latency_s=(frame['received_at'] - frame['mailgun_at']).dt.total_seconds())
+    frame = frame[frame['latency_s'].notna()]
+    if frame.empty:
+        # Không webhook nào có `timestamp` của Mailgun (chỉ email_event có): báo cáo rỗng
+        return pd.DataFrame(
+            columns=['webhooks', 'p50_s', 'p95_s', 'p99_s', 'max_s'], index=pd.Index([], name=by or 'all')
+        )
+    frame, keys = group_keys(frame, by) if by else (frame, pd.Series('(all)', index=frame.index))
+    grouped = frame.groupby(keys.rename(by or 'all'))['latency_s']
+    result = grouped.quantile([0.5, 0.95, 0.99]).unstack()
+    result.columns = ['p50_s', 'p95_s', 'p99_s']
+    result.insert(0, 'webhooks', grouped.size())
+    result['max_s'] = grouped.max()
+    return _sorted(result.round(3), by, 'webhooks', top)
+
+
+REPORTS = {
+    'volume': (volume_report, []),
+    'attachments': (attachments_report, ['webhook_type', 'attachment_count', 'attachment_bytes']),
+    'latency': (latency_report, ['received_at', 'mailgun_at']),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Snapshot analytics dạng cột và báo cáo trên snapshot')
+    parser.add_argument('--dir', help='Thư mục snapshot (mặc định ANALYTICS_DIR)')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = subparsers.add_parser('export', help='Export webhook mới kể từ checkpoint')
+    export_parser.add_argument('--format', choices=list(FORMATS), help='Mặc định ANALYTICS_FORMAT')
+    export_parser.add_argument('--batch-size', type=int, help='Mặc định ANALYTICS_BATCH_SIZE')
+    export_parser.add_argument('--interval', type=int, default=0, help='Chạy lại mỗi N giây (0 = một lần)')
+
+    compact_parser = subparsers.add_parser('compact', help='Gộp file của các ngày đã qua')
+    compact_parser.add_argument('--format', choices=list(FORMATS), help='Mặc định ANALYTICS_FORMAT')
+
+    for name in REPORTS:
+        report_parser = subparsers.add_parser(name, help=f'Báo cáo {name}')
+        report_parser.add_argument('--by', choices=GROUP_CHOICES, default='domain' if name == 'volume' else None)
+        report_parser.add_argument('--since', type=date.fromisoformat, help='YYYY-MM-DD')
+        report_parser.add_argument('--until', type=date.fromisoformat, help='YYYY-MM-DD')
+        report_parser.add_argument('--type', dest='webhook_type', help='Chỉ một webhook_type')
+        report_parser.add_argument('--tenant')
+        report_parser.add_argument('--top', type=int, default=20)
+        report_parser.add_argument('--csv', action='store_true', help='In CSV thay vì bảng')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    from settings import Settings
+
+    settings = Settings.from_env()
+    directory = args.dir or settings.analytics_dir
+    try:
+        if args.command == 'export':
+            from services import open_storage
+
+            storage = open_storage(settings)
+            if storage is None:
+                print("[ERROR] Không thể kết nối database")
+                return
+            exporter = SnapshotExporter(
+                storage, directory, fmt=args.format or settings.analytics_format,
+                batch_size=args.batch_size or settings.analytics_batch_size,
+                settle_seconds=settings.changes_settle_seconds,
+            )
+            while True:
+                exported, written = exporter.export()
+                print(f"[SUCCESS] Đã export {exported} webhooks ({written / 1024:.1f} KB) vào {directory}")
+                if not args.interval:
+                    break
+                time.sleep(args.interval)
+        elif args.command == 'compact':
+            compacted = compact(directory, fmt=args.format or settings.analytics_format)
+            print(f"[SUCCESS] Đã gộp file của {compacted} ngày trong {directory}")
+        else:
+            report, columns = REPORTS[args.command]
+            frame = load_frame(
+                directory, sorted({*columns, *group_columns(args.by)}),
+                since=args.since and args.since.isoformat(), until=args.until and args.until.isoformat(),
+                webhook_type=args.webhook_type, tenant=args.tenant,
+            )
+            if frame.empty:
+                print("[WARNING] Không có webhook nào trong snapshot khớp điều kiện")
+                return
+            result = report(frame, args.by, top=args.top)
+            if result.empty:
+                print(f"[WARNING] {len(frame)} webhooks khớp điều kiện nhưng không có dữ liệu cho báo cáo {args.command}"
+                      f"{' (cần timestamp của Mailgun)' if args.command == 'latency' else ''}")
+                return
+            if args.csv:
+                print(result.to_csv(), end='')
+            else:
+                print(f"[STATS] {args.command} theo {args.by or 'tổng'}: {len(frame)} webhooks")
+                print(result.to_string())
+    except (RuntimeError, FileNotFoundError, ValueError) as e:
+        print(f"[ERROR] {e}")
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
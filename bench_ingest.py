@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Benchmark throughput của hàng đợi ingest khi tăng số worker process từ 1 tới N
+
+Mỗi lần chạy dùng spool và database SQLite tạm mới: khởi động K worker, đưa toàn bộ payload
+(form inbound email như Mailgun gửi) vào spool theo hash người nhận rồi đo thời gian tới khi
+mọi webhook đã được ghi.
+
+Cách chạy:
+    python bench_ingest.py --workers 4 --webhooks 20000
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+from collections import defaultdict
+from urllib.parse import urlencode
+
+from werkzeug.test import EnvironBuilder
+from werkzeug.wrappers import Request
+
+from ingest import capture_request, partition_for, partition_key
+from ingest_queue import PartitionedSpool
+from ingest_worker import start_workers
+from storage import SQLiteWebhookStorage
+
+
+def make_payloads(count, recipients):
+    """Payload thô giống request Mailgun Routes gửi tới /webhook/mailgun"""
+    random.seed(42)
+    payloads = []
+    for i in range(count):
+        code = f'{random.randint(0, 999999):06d}'
+        form = {
+            'sender': 'noreply@service.example',
+            'from': 'Service <noreply@service.example>',
+            'recipient': recipients[i % len(recipients)],
+            'To': recipients[i % len(recipients)],
+            'Subject': f'Your verification code {code}',
+            'body-plain': f'Your code is {code}',
+            'body-html': f'<html><body><p>Your code is <b>{code}</b></p>{"<p>filler</p>" * 50}</body></html>',
+            'stripped-text': f'Your code is {code}',
+        }
+        builder = EnvironBuilder(
+            path='/webhook/mailgun', method='POST', data=urlencode(form),
+            content_type='application/x-www-form-urlencoded'
+        )
+        req = Request(builder.get_environ())
+        payloads.append((partition_key(req), capture_request(req)))
+        builder.close()
+    return payloads
+
+
+def run(workers, payloads, batch_size, warmup):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db_path = os.path.join(tmpdir, 'bench.db')
+        os.environ['STORAGE_BACKEND'] = 'sqlite'
+        os.environ['SQLITE_PATH'] = db_path
+        storage = SQLiteWebhookStorage(db_path)
+        spool_dir = os.path.join(tmpdir, 'spool')
+        spool = PartitionedSpool(spool_dir, workers)
+
+        processes, stop = start_workers(workers, spool_dir, batch_size)
+        time.sleep(warmup)  # Không tính thời gian spawn + import của worker
+
+        start = time.perf_counter()
+        grouped = defaultdict(list)
+        for key, payload in payloads:
+            grouped[partition_for(key, workers)].append(payload)
+        for index, items in grouped.items():
+            spool.queues[index].put_many(items)
+        while storage.stats()['total'] < len(payloads):
+            time.sleep(0.05)
+        elapsed = time.perf_counter() - start
+
+        stop.set()
+        for process in processes:
+            process.join(timeout=30)
+        return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark ingest workers')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 4, help='Số worker tối đa')
+    parser.add_argument('--webhooks', type=int, default=20000)
+    parser.add_argument('--recipients', type=int, default=500)
+    parser.add_argument('--batch-size', type=int, default=200)
+    parser.add_argument('--warmup', type=float, default=3.0)
+    args = parser.parse_args()
+
+    recipients = [f'user{i}@example.com' for i in range(args.recipients)]
+    payloads = make_payloads(args.webhooks, recipients)
+    print(f"🚀 Workload: {args.webhooks} webhooks, {args.recipients} recipients, batch {args.batch_size}")
+    print("[WARNING] SQLite chỉ có một writer: phần parse / trích xuất scale theo worker, phần ghi thì không")
+
+    print(f"\n{'Workers':>8}{'Thời gian (s)':>16}{'webhooks/s':>14}{'Speedup':>10}")
+    baseline = None
+    # 1, 2, 4, ... và luôn có args.workers
+    for workers in sorted({min(2 ** i, args.workers) for i in range(args.workers.bit_length() + 1)}):
+        elapsed = run(workers, payloads, args.batch_size, args.warmup)
+        rate = args.webhooks / elapsed
+        baseline = baseline or rate
+        print(f"{workers:>8}{elapsed:>16.2f}{rate:>14.0f}{rate / baseline:>9.2f}x")
+
+
+if __name__ == '__main__':
+    main()
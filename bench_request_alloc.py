@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Benchmark bộ nhớ cấp phát cho mỗi request webhook (tracemalloc): cách dựng document cũ
+(decode body nhiều lần, to_dict / dict(headers) lặp lại, len(str(document))) so với ParsedRequest
+
+Cách chạy:
+    python bench_request_alloc.py --html-kb 200 --requests 50
+    python bench_request_alloc.py --urlencoded      # form x-www-form-urlencoded thay vì multipart
+"""
+
+import argparse
+import io
+import time
+import tracemalloc
+from datetime import datetime
+
+from werkzeug.test import EnvironBuilder
+from werkzeug.wrappers import Request
+
+from ingest import build_webhook_document, parse_request
+
+
+def make_environ(html_kb, urlencoded=False):
+    """Environ WSGI của một inbound email lớn (body-html ~html_kb KB), multipart như Mailgun Routes gửi"""
+    html = '<html><body>' + '<p>Xin chào, đây là nội dung email mẫu.</p>' * (html_kb * 1024 // 50) + '</body></html>'
+    form = {
+        'sender': 'noreply@service.example',
+        'from': 'Service <noreply@service.example>',
+        'To': 'user@example.com',
+        'recipient': 'user@example.com',
+        'Subject': 'Your verification code 123456',
+        'body-html': html,
+        'stripped-html': html,
+        'body-plain': 'Your code is 123456',
+        'stripped-text': 'Your code is 123456',
+    }
+    builder = EnvironBuilder(
+        path='/webhook/mailgun', method='POST', data=form,
+        content_type='application/x-www-form-urlencoded' if urlencoded else 'multipart/form-data'
+    )
+    environ = builder.get_environ()
+    body = environ['wsgi.input'].read()
+    builder.close()
+    return environ, body
+
+
+def legacy_ingest(req):
+    """Các bước của handler trước khi tối ưu (kể cả chuỗi log được format)"""
+    # log_request
+    raw_data = req.get_data(as_text=True)
+    logs = [f"Headers: {dict(req.headers)}", f"Form Data: {req.form.to_dict()}", f"Raw Data: {raw_data[:500]}..."]
+    # mailgun_webhook
+    logs.append(f"Headers: {dict(req.headers)}")
+    logs.append(f"Form Data: {req.form.to_dict()}")
+    logs.append(f"Raw Data Length: {len(req.get_data(as_text=True))}")
+    document = {
+        'timestamp': datetime.now(),
+        'request_headers': dict(req.headers),
+        'request_form_data': req.form.to_dict(),
+        'request_raw_data': req.get_data(as_text=True),
+        'request_args': dict(req.args),
+    }
+    logs.append(f"Request object size: {len(str(document))} characters")
+    return document
+
+
+def current_ingest(req):
+    """Đường ingest hiện tại: body đọc / parse một lần qua ParsedRequest"""
+    parsed = parse_request(req)
+    logs = [f"Headers: {dict(req.headers)}", f"Form Fields: {list(parsed.form)}",
+            f"Raw Data ({parsed.size} bytes): {parsed.preview()}..."]
+    logs.append(f"Raw Data Length: {parsed.size}")
+    document = build_webhook_document(req)
+    logs.append(f"Request body size: {parsed.size} bytes")
+    return document
+
+
+def new_request(environ, body):
+    environ = dict(environ)
+    environ['wsgi.input'] = io.BytesIO(body)
+    return Request(environ)
+
+
+def measure(func, environ, body, requests):
+    """(peak KB, giữ lại KB, µs) trung bình mỗi request"""
+    tracemalloc.start()
+    peaks, retained = [], []
+    for _ in range(requests):
+        req = new_request(environ, body)
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        document = func(req)
+        current, peak = tracemalloc.get_traced_memory()
+        peaks.append(peak - before)
+        retained.append(current - before)
+        del document, req
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    for _ in range(requests):
+        func(new_request(environ, body))
+    elapsed = (time.perf_counter() - start) / requests
+    return sum(peaks) / len(peaks) / 1024, sum(retained) / len(retained) / 1024, elapsed * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark cấp phát bộ nhớ mỗi request webhook')
+    parser.add_argument('--html-kb', type=int, default=200)
+    parser.add_argument('--requests', type=int, default=50)
+    parser.add_argument('--urlencoded', action='store_true')
+    args = parser.parse_args()
+
+    environ, body = make_environ(args.html_kb, urlencoded=args.urlencoded)
+    print(f"🚀 Body: {len(body) / 1024:.0f} KB ({environ['CONTENT_TYPE'].split(';')[0]}), {args.requests} requests")
+    print(f"\n{'Cách xử lý':<14}{'Peak (KB)':>12}{'Giữ lại (KB)':>15}{'µs/request':>12}")
+    results = {}
+    for name, func in (('trước', legacy_ingest), ('hiện tại', current_ingest)):
+        results[name] = measure(func, environ, body, args.requests)
+        peak, retained, micros = results[name]
+        print(f"{name:<14}{peak:>12.0f}{retained:>15.0f}{micros:>12.0f}")
+    before, after = results['trước'], results['hiện tại']
+    print(f"\n[STATS] Peak giảm {before[0] / after[0]:.1f}x, bộ nhớ giữ lại giảm {before[1] / after[1]:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Benchmark thời gian khởi động của API: import app.py (create_app) và request đầu tiên
+(khởi tạo storage / dispatcher trong process), mỗi lần đo trong một interpreter mới
+
+Kịch bản:
+- sqlite: database SQLite tạm
+- mongo-down: MONGODB_URI trỏ tới cổng không có server; import không được phép chờ kết nối,
+  chỉ request đầu tiên chờ tối đa MONGODB_TIMEOUT_MS rồi trả về 503
+- mongo: MongoDB thật khi truyền --mongodb-uri
+- preload: import một lần rồi fork N worker như `gunicorn --preload`, đo tới khi mọi worker
+  trả lời request đầu tiên (mỗi worker tự tạo kết nối sau fork)
+
+Cách chạy:
+    python bench_startup.py --runs 10
+    python bench_startup.py --mongodb-uri mongodb://localhost:27017 --workers 4
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Chạy trong interpreter mới: in JSON các mốc thời gian (giây)
+PROBE = '''
+import json, os, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+client = app.app.test_client()
+status = client.get('/health').status_code
+first = time.perf_counter()
+client.get('/health')
+second = time.perf_counter()
+print(json.dumps({'import': imported - start, 'first_request': first - imported,
+                  'second_request': second - first, 'status': status}))
+'''
+
+# Import một lần rồi fork các worker, mỗi worker phục vụ request đầu tiên
+PRELOAD_PROBE = '''
+import json, os, sys, time
+workers = int(sys.argv[1])
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+pids = []
+for _ in range(workers):
+    pid = os.fork()
+    if pid == 0:
+        status = app.app.test_client().get('/health').status_code
+        os._exit(0 if status == 200 else 1)
+    pids.append(pid)
+failed = sum(os.waitpid(pid, 0)[1] != 0 for pid in pids)
+print(json.dumps({'import': imported - start, 'all_workers_ready': time.perf_counter() - start,
+                  'failed_workers': failed}))
+'''
+
+
+def run_probe(env, code, *args):
+    result = subprocess.run(
+        [sys.executable, '-c', code, *args], cwd=env['BENCH_CWD'], env=env,
+        capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def scenario_env(workdir, storage_backend, mongodb_uri=None, timeout_ms=2000):
+    env = dict(os.environ)
+    env.update({
+        'PYTHONPATH': ROOT,
+        'BENCH_CWD': workdir,
+        'STORAGE_BACKEND': storage_backend,
+        'SQLITE_PATH': os.path.join(workdir, 'bench.db'),
+        'MONGODB_TIMEOUT_MS': str(timeout_ms),
+        'LOG_FILE': '',
+        'LOG_LEVEL': 'WARNING',
+        'RETENTION_INTERVAL': '0',
+    })
+    if mongodb_uri:
+        env['MONGODB_URI'] = mongodb_uri
+    return env
+
+
+def summarize(samples, key):
+    values = [sample[key] * 1000 for sample in samples]
+    return statistics.median(values), min(values), max(values)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark thời gian khởi động app')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--workers', type=int, default=4, help='Số worker fork trong kịch bản preload')
+    parser.add_argument('--mongodb-uri', default=None, help='MongoDB thật (bỏ qua kịch bản mongo nếu không có)')
+    parser.add_argument('--timeout-ms', type=int, default=2000, help='MONGODB_TIMEOUT_MS cho kịch bản mongo-down')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        scenarios = [
+            ('sqlite', scenario_env(workdir, 'sqlite')),
+            ('mongo-down', scenario_env(workdir, 'mongo', 'mongodb://127.0.0.1:1', args.timeout_ms)),
+        ]
+        if args.mongodb_uri:
+            scenarios.append(('mongo', scenario_env(workdir, 'mongo', args.mongodb_uri)))
+
+        print(f"🚀 {args.runs} lần chạy mỗi kịch bản, đơn vị ms (median / min / max)")
+        print(f"\n{'Kịch bản':<12}{'Import app':>24}{'Request đầu':>24}{'Request sau':>22}{'Status':>8}")
+        for name, env in scenarios:
+            samples = [run_probe(env, PROBE) for _ in range(args.runs)]
+            columns = [
+                '{:.0f} / {:.0f} / {:.0f}'.format(*summarize(samples, key))
+                for key in ('import', 'first_request', 'second_request')
+            ]
+            print(f"{name:<12}{columns[0]:>24}{columns[1]:>24}{columns[2]:>22}{samples[-1]['status']:>8}")
+
+        if hasattr(os, 'fork'):
+            name, env = scenarios[-1] if args.mongodb_uri else scenarios[0]
+            samples = [run_probe(env, PRELOAD_PROBE, str(args.workers)) for _ in range(args.runs)]
+            ready = '{:.0f} / {:.0f} / {:.0f}'.format(*summarize(samples, 'all_workers_ready'))
+            failed = sum(sample['failed_workers'] for sample in samples)
+            print(f"\n[STATS] preload ({name}, {args.workers} workers): mọi worker sẵn sàng sau {ready} ms, "
+                  f"{failed} worker lỗi")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Benchmark so sánh các storage backend (SQLite nhúng và MongoDB) trên cùng workload
+
+Cách chạy:
+    python bench_storage.py                      # chỉ SQLite
+    BENCH_MONGODB_URI=mongodb://localhost:27017 python bench_storage.py
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from storage import MongoWebhookStorage, SQLiteWebhookStorage, subject_category_fields
+
+
+def make_document(i, recipients, base_time):
+    """Tạo một webhook inbound email giả lập"""
+    recipient = recipients[i % len(recipients)]
+    subject = 'Your verification code' if i % 3 else 'Weekly newsletter'
+    # Category như InboundEmailProcessor gắn với bộ category mặc định
+    categories = ['verification-code', 'otp'] if i % 3 else []
+    code = f'{random.randint(0, 999999):06d}'
+    return {
+        'timestamp': base_time + timedelta(milliseconds=i),
+        'request_metadata': {'url': 'http://localhost/webhook/mailgun', 'method': 'POST'},
+        'request_headers': {'Content-Type': 'application/x-www-form-urlencoded'},
+        'request_form_data': {
+            'sender': 'noreply@service.example',
+            'from': 'Service <noreply@service.example>',
+            'To': recipient,
+            'Subject': f'{subject} {code}',
+            'body-html': f'<html><body><p>Your code is <b>{code}</b></p>{"<p>filler</p>" * 50}</body></html>',
+            'stripped-text': f'Your code is {code}',
+        },
+        'request_raw_data': '',
+        'request_json': None,
+        'request_args': {},
+        'request_files': {},
+        'webhook_type': 'inbound_email',
+        'processed_data': {},
+        'recipient_addresses': [recipient],
+        **subject_category_fields(categories, [recipient]),
+    }
+
+
+def timed(label, func, operations, results):
+    """Đo thời gian một thao tác và lưu kết quả (ops/s)"""
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    results.append((label, operations, elapsed))
+
+
+def run_workload(storage, documents, recipients, lookups, batch_size):
+    """Chạy cùng một workload trên một backend"""
+    results = []
+    half = len(documents) // 2
+    single, batched = documents[:half], documents[half:]
+
+    def insert_single():
+        for document in single:
+            storage.insert(document)
+
+    def insert_batched():
+        for start in range(0, len(batched), batch_size):
+            storage.insert_many(batched[start:start + batch_size])
+
+    ids = []
+
+    def find_by_id():
+        for webhook_id in ids:
+            storage.find_by_id(webhook_id)
+
+    def inbox_lookup():
+        for _ in range(lookups):
+            storage.find_inbox(random.choice(recipients), 'verification code', limit=10)
+
+    def inbox_category_lookup():
+        for _ in range(lookups):
+            storage.find_inbox(random.choice(recipients), limit=10, category='verification-code')
+
+    def list_pages():
+        for page in range(lookups // 10 or 1):
+            storage.list_webhooks(limit=50, skip=page * 50)
+
+    timed('insert (từng document)', insert_single, len(single), results)
+    timed(f'insert_many (batch {batch_size})', insert_batched, len(batched), results)
+    ids = [str(document['_id']) for document in random.sample(documents, min(lookups, len(documents)))]
+    timed('find_by_id', find_by_id, len(ids), results)
+    timed('find_inbox (recipient + subject)', inbox_lookup, lookups, results)
+    timed('find_inbox (recipient + category)', inbox_category_lookup, lookups, results)
+    timed('list_webhooks (50/trang)', list_pages, lookups // 10 or 1, results)
+    timed('stats', storage.stats, 1, results)
+    return results
+
+
+def print_results(name, results):
+    print(f"\n[STATS] Backend: {name}")
+    print("-" * 64)
+    print(f"{'Thao tác':<36}{'Số lần':>8}{'Thời gian (s)':>14}{'ops/s':>10}")
+    for label, operations, elapsed in results:
+        rate = operations / elapsed if elapsed else float('inf')
+        print(f"{label:<36}{operations:>8}{elapsed:>14.3f}{rate:>10.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark storage backends')
+    parser.add_argument('--documents', type=int, default=20000)
+    parser.add_argument('--recipients', type=int, default=500)
+    parser.add_argument('--lookups', type=int, default=1000)
+    parser.add_argument('--batch-size', type=int, default=500)
+    args = parser.parse_args()
+
+    recipients = [f'user{i}@example.com' for i in range(args.recipients)]
+    base_time = datetime.now()
+
+    def fresh_documents():
+        random.seed(42)
+        return [make_document(i, recipients, base_time) for i in range(args.documents)]
+
+    print(f"🚀 Workload: {args.documents} documents, {args.recipients} recipients, {args.lookups} lookups")
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        sqlite_storage = SQLiteWebhookStorage(os.path.join(tmpdir, 'bench.db'))
+        print_results('sqlite', run_workload(
+            sqlite_storage, fresh_documents(), recipients, args.lookups, args.batch_size
+        ))
+
+    mongodb_uri = os.getenv('BENCH_MONGODB_URI')
+    if mongodb_uri:
+        from pymongo import MongoClient
+        client = MongoClient(mongodb_uri)
+        db_name = 'mailgun_webhooks_bench'
+        client.drop_database(db_name)
+        mongo_storage = MongoWebhookStorage(client, db_name=db_name)
+        mongo_storage.ensure_indexes()
+        try:
+            print_results('mongo', run_workload(
+                mongo_storage, fresh_documents(), recipients, args.lookups, args.batch_size
+            ))
+        finally:
+            client.drop_database(db_name)
+    else:
+        print("\n[WARNING] Bỏ qua MongoDB: đặt BENCH_MONGODB_URI để benchmark backend mongo")
+
+
+if __name__ == '__main__':
+    main()
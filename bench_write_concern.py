@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Benchmark độ trễ ghi theo profile độ bền (fast | majority | spool) và độ trễ đọc theo read preference
+
+Spool (file SQLite cục bộ) luôn được đo; MongoDB chỉ khi đặt BENCH_MONGODB_URI. Số đo chỉ có ý nghĩa
+trên replica set thật (Atlas hoặc 3 node): với MongoDB standalone, majority gần như bằng w=1 và
+không có secondary để đọc.
+
+Cách chạy:
+    python bench_write_concern.py
+    BENCH_MONGODB_URI="mongodb+srv://..." python bench_write_concern.py --inserts 500 --reads 200
+"""
+
+import argparse
+import os
+import statistics
+import tempfile
+import time
+from datetime import datetime
+
+from bench_storage import make_document
+from durability import read_preference
+from ingest_queue import SpoolQueue
+from storage import MongoWebhookStorage
+
+READ_PREFERENCES = ('primary', 'secondaryPreferred', 'nearest')
+
+
+def latency(func, operations):
+    """Độ trễ từng lần gọi (ms)"""
+    samples = []
+    for i in range(operations):
+        start = time.perf_counter()
+        func(i)
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def print_row(label, samples):
+    samples = sorted(samples)
+    p95 = samples[int(len(samples) * 0.95) - 1] if len(samples) >= 20 else samples[-1]
+    p99 = samples[int(len(samples) * 0.99) - 1] if len(samples) >= 100 else samples[-1]
+    print(f"{label:<34}{statistics.median(samples):>9.2f}{p95:>9.2f}{p99:>9.2f}"
+          f"{statistics.mean(samples):>9.2f}{1000 / statistics.mean(samples):>10.0f}")
+
+
+def print_header(title):
+    print(f"\n[STATS] {title}")
+    print("-" * 80)
+    print(f"{'Profile':<34}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'mean ms':>9}{'ops/s':>10}")
+
+
+def bench_spool(payloads):
+    print_header('Spool cục bộ (profile spool: độ trễ tới khi trả 202)')
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for fsync in (False, True):
+            spool = SpoolQueue(os.path.join(tmpdir, f'spool-{fsync}.db'), fsync=fsync)
+            label = 'spool (SPOOL_FSYNC=1)' if fsync else 'spool (SPOOL_FSYNC=0)'
+            print_row(label, latency(lambda i: spool.put(payloads[i]), len(payloads)))
+
+
+def bench_mongo(mongodb_uri, documents, reads):
+    from pymongo import MongoClient
+    client = MongoClient(mongodb_uri)
+    db_name = 'mailgun_webhooks_bench_durability'
+    client.drop_database(db_name)
+    try:
+        topology = client.topology_description
+        secondaries = sum(1 for server in topology.server_descriptions().values()
+                          if server.server_type_name == 'RSSecondary')
+        print(f"\nMongoDB: {topology.topology_type_name}, {secondaries} secondary")
+
+        print_header('Ghi một webhook (insert_one)')
+        storage = MongoWebhookStorage(client, db_name=db_name)
+        storage.ensure_indexes()
+        for durability in ('fast', 'majority'):
+            batch = [dict(document) for document in documents]
+            print_row(durability, latency(lambda i: storage.insert(batch[i], durability=durability), len(batch)))
+
+        print_header('Đọc danh sách (list_webhooks, 50/trang)')
+        for name in READ_PREFERENCES:
+            reader = MongoWebhookStorage(client, db_name=db_name, read_preference=read_preference(name))
+            reader.list_webhooks(limit=50)  # Mở connection tới server được chọn trước khi đo
+            print_row(name, latency(lambda i: reader.list_webhooks(limit=50, skip=(i % 10) * 50), reads))
+    finally:
+        client.drop_database(db_name)
+        client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark write concern / read preference')
+    parser.add_argument('--inserts', type=int, default=500)
+    parser.add_argument('--reads', type=int, default=200)
+    args = parser.parse_args()
+
+    recipients = [f'user{i}@example.com' for i in range(100)]
+    base_time = datetime.now()
+    documents = [make_document(i, recipients, base_time) for i in range(args.inserts)]
+    payloads = [repr(document).encode('utf-8') for document in documents]
+    print(f"🚀 {args.inserts} inserts, {args.reads} reads, "
+          f"~{sum(map(len, payloads)) // len(payloads)} bytes/webhook")
+
+    bench_spool(payloads)
+
+    mongodb_uri = os.getenv('BENCH_MONGODB_URI')
+    if mongodb_uri:
+        bench_mongo(mongodb_uri, documents, args.reads)
+    else:
+        print("\n[WARNING] Bỏ qua MongoDB: đặt BENCH_MONGODB_URI để đo profile fast / majority và read preference")
+
+
+if __name__ == '__main__':
+    main()
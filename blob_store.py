@@ -0,0 +1,108 @@
+"""
+Lưu nội dung lớn (field vượt MAX_FIELD_BYTES, file đính kèm) ra ngoài document webhook
+
+Blob được định danh theo hash nội dung (cùng nội dung chỉ lưu một lần) và ghi theo kiểu
+ghi file tạm rồi rename, nên đọc đồng thời không bao giờ thấy file dở dang.
+"""
+
+import hashlib
+import os
+import re
+import tempfile
+import time
+
+BLOB_KEY = re.compile(r'^[0-9a-f]{64}$')
+COPY_CHUNK = 1024 * 1024
+
+
+def extract_blob_keys(document):
+    """Key các blob (file đính kèm, field bị cắt) mà webhook document tham chiếu"""
+    keys = []
+    for field in ('request_files', 'request_blobs'):
+        for info in (document.get(field) or {}).values():
+            key = info.get('blob') if isinstance(info, dict) else None
+            if key and key not in keys:
+                keys.append(key)
+    return keys
+
+
+class LocalBlobStore:
+    """Blob trên filesystem: <root>/<2 ký tự đầu của key>/<key>"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, key):
+        if not BLOB_KEY.match(key or ''):
+            raise ValueError('Blob key không hợp lệ')
+        return os.path.join(self.root, key[:2], key)
+
+    def put(self, fileobj):
+        """Ghi nội dung của fileobj (đọc từ vị trí hiện tại tới hết), trả về (key, size)"""
+        os.makedirs(self.root, exist_ok=True)
+        digest = hashlib.blake2b(digest_size=32)
+        size = 0
+        fd, temp_path = tempfile.mkstemp(dir=self.root, prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                for chunk in iter(lambda: fileobj.read(COPY_CHUNK), b''):
+                    digest.update(chunk)
+                    out.write(chunk)
+                    size += len(chunk)
+            key = digest.hexdigest()
+            path = self.path(key)
+            try:
+                # Blob đã có: làm mới mtime để sweep không xóa blob mà webhook sắp ghi sẽ tham chiếu
+                os.utime(path)
+                os.remove(temp_path)
+            except FileNotFoundError:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(temp_path, path)
+            return key, size
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def open(self, key):
+        """File object (binary) của blob, FileNotFoundError nếu không có"""
+        return open(self.path(key), 'rb')
+
+    def exists(self, key):
+        try:
+            return os.path.exists(self.path(key))
+        except ValueError:
+            return False
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def sweep(self, live_keys, min_age=86400):
+        """
+        Xóa blob không có trong live_keys và file tạm `.upload-` bỏ dở, chỉ những file không được
+        ghi / dùng lại trong `min_age` giây (blob của webhook còn trong spool chưa có trong live_keys).
+        Trả về (số file đã xóa, số byte).
+        """
+        if not os.path.isdir(self.root):
+            return 0, 0
+        cutoff = time.time() - min_age
+        removed = freed = 0
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                if name in live_keys or not (BLOB_KEY.match(name) or name.startswith('.upload-')):
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                    if stat.st_mtime >= cutoff:
+                        continue
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+                removed += 1
+                freed += stat.st_size
+        return removed, freed
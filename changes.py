@@ -0,0 +1,61 @@
+"""
+Change feed cho mirror / client đồng bộ: webhooks được lưu sau một token, theo thứ tự _id
+"""
+
+import time
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId
+from bson.errors import InvalidId
+
+
+def decode_token(token):
+    """Token là _id (ObjectId hex) của webhook cuối cùng client đã nhận; rỗng = từ đầu"""
+    if not token:
+        return None
+    try:
+        return str(ObjectId(token))
+    except (InvalidId, TypeError):
+        raise ValueError('Token không hợp lệ')
+
+
+class ChangeFeed:
+    """
+    Đọc webhooks có _id lớn hơn token theo thứ tự tăng dần.
+
+    ObjectId do nhiều worker sinh ra không tăng đúng thứ tự ghi trong cùng một giây (phần
+    random khác nhau giữa các process), nên feed chỉ trả về webhook có _id sinh trước
+    `settle_seconds` giây: webhook ghi muộn hơn với _id nhỏ hơn token sẽ không bị bỏ sót.
+    """
+
+    def __init__(self, storage, settle_seconds=2.0, poll_interval=0.5):
+        self.storage = storage
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+
+    def _upper_bound(self):
+        return str(ObjectId.from_datetime(datetime.now(timezone.utc) - timedelta(seconds=self.settle_seconds)))
+
+    def current_token(self):
+        """Token tại thời điểm hiện tại (client chỉ muốn các webhook mới từ bây giờ)"""
+        newest = self.storage.newest_id()
+        bound = self._upper_bound()
+        return min(newest, bound) if newest else bound
+
+    def read(self, after_id=None, limit=100, wait=0, fields=None, tenant=None):
+        """
+        Tối đa `limit` webhook sau after_id (chỉ `fields` nếu có, chỉ của `tenant` nếu có); nếu chưa có gì
+        mới thì chờ tối đa `wait` giây.
+        Trả về (changes, next_token, has_more).
+        """
+        deadline = time.monotonic() + wait
+        while True:
+            changes = self.storage.list_changes(after_id=after_id, before_id=self._upper_bound(), limit=limit + 1,
+                                                  fields=fields, tenant=tenant)
+            if changes or time.monotonic() >= deadline:
+                break
+            time.sleep(min(self.poll_interval, max(deadline - time.monotonic(), 0)))
+        has_more = len(changes) > limit
+        changes = changes[:limit]
+        next_token = str(changes[-1]['_id']) if changes else after_id
+        return changes, next_token, has_more
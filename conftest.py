@@ -0,0 +1,65 @@
+"""
+Fixture chung cho pytest: app Flask chạy trên SQLite trong thư mục tạm (không cần MongoDB)
+"""
+
+import json
+import os
+
+# app.py tạo `app` từ biến môi trường khi import: không ghi app.log khi chạy test
+os.environ.setdefault('LOG_FILE', '')
+
+import pytest
+
+from app import create_app
+from settings import Settings
+from storage import SQLiteWebhookStorage
+
+
+@pytest.fixture
+def sqlite_storage(tmp_path):
+    storage = SQLiteWebhookStorage(str(tmp_path / 'webhooks.db'))
+    storage.ensure_indexes()
+    return storage
+
+
+@pytest.fixture
+def make_app(tmp_path):
+    """make_app(tenants=None, **settings): app SQLite mới, tenants là nội dung TENANTS_FILE"""
+    apps = []
+
+    def factory(tenants=None, **overrides):
+        if tenants is not None:
+            tenants_file = tmp_path / 'tenants.json'
+            tenants_file.write_text(json.dumps({'tenants': tenants}))
+            overrides['tenants_file'] = str(tenants_file)
+        settings = Settings(
+            storage_backend='sqlite',
+            sqlite_path=str(tmp_path / 'webhooks.db'),
+            blob_dir=str(tmp_path / 'blobs'),
+            log_file='',
+            **overrides,
+        )
+        app = create_app(settings)
+        app.config['TESTING'] = True
+        apps.append(app)
+        return app
+
+    yield factory
+    for app in apps:
+        app.extensions['webhook_services'].shutdown()
+
+
+def inbound_form(recipient, subject='Hello', sender='sender@example.net', **fields):
+    """Form của một inbound email Mailgun"""
+    form = {
+        'recipient': recipient,
+        'sender': sender,
+        'from': f'Sender <{sender}>',
+        'To': recipient,
+        'Subject': subject,
+        'body-plain': fields.pop('text', f'{subject} body'),
+        'body-html': fields.pop('html', f'<p>{subject}</p>'),
+        'domain': recipient.rsplit('@', 1)[-1],
+    }
+    form.update(fields)
+    return form
@@ -0,0 +1,158 @@
+"""
+Tổng hợp event giao nhận theo message-id (timeline trạng thái) và bộ đếm theo domain người nhận
+"""
+
+import logging
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+# Thứ hạng của event trong vòng đời email: trạng thái hiện tại là event có hạng cao nhất
+# đã nhận, nên thứ tự webhook đến không ảnh hưởng kết quả
+EVENT_RANKS = {
+    'accepted': 10,
+    'stored': 10,
+    'failed_temporary': 20,
+    'delivered': 30,
+    'failed': 30,
+    'rejected': 30,
+    'opened': 40,
+    'clicked': 50,
+    'unsubscribed': 60,
+    'complained': 60,
+}
+
+# Độ dài bucket của bộ đếm theo domain
+BUCKET_SIZE = timedelta(hours=1)
+
+# Số event tối đa giữ trong timeline của một message
+TIMELINE_LIMIT = 50
+
+
+def normalize_message_id(message_id):
+    """Message-Id không có dấu <> và khoảng trắng để dùng làm key"""
+    return (message_id or '').strip().strip('<>').strip()
+
+
+def event_name(event, severity=None):
+    """Tên event dùng trong state: failed tạm thời (Mailgun sẽ gửi lại) tách riêng"""
+    # Tên event được dùng làm key trong document MongoDB nên không chứa '.' hoặc '$'
+    event = (event or 'unknown').lower().replace('.', '_').replace('$', '_')
+    if event == 'failed' and (severity or '').lower() == 'temporary':
+        return 'failed_temporary'
+    return event
+
+
+def bucket_start(timestamp):
+    """Đầu bucket chứa timestamp"""
+    seconds = int(BUCKET_SIZE.total_seconds())
+    epoch = datetime(1970, 1, 1)
+    offset = int((timestamp - epoch).total_seconds()) // seconds * seconds
+    return epoch + timedelta(seconds=offset)
+
+
+def current_status(events):
+    """Trạng thái hiện tại từ map {event: thời điểm đầu tiên}"""
+    if not events:
+        return None
+    return max(events, key=lambda name: (EVENT_RANKS.get(name, 0), events[name]))
+
+
+def delivery_rates(counts):
+    """Tỉ lệ giao / mở / click / bounce từ số message duy nhất theo event"""
+    delivered = counts.get('delivered', 0)
+    sent = delivered + counts.get('failed', 0) + counts.get('rejected', 0)
+
+    def ratio(numerator, denominator):
+        return round(numerator / denominator, 4) if denominator else None
+
+    return {
+        'delivery_rate': ratio(delivered, sent),
+        'bounce_rate': ratio(counts.get('failed', 0) + counts.get('rejected', 0), sent),
+        'open_rate': ratio(counts.get('opened', 0), delivered),
+        'click_rate': ratio(counts.get('clicked', 0), delivered),
+    }
+
+
+class DeliveryAggregator:
+    """
+    Cập nhật tăng dần khi event webhook đến:
+
+    - một state document cho mỗi message-id (upsert, tra cứu theo khóa chính)
+    - bộ đếm theo domain người nhận và bucket thời gian của event
+
+    Event đến không theo thứ tự vẫn cho kết quả đúng: thời điểm event lấy từ payload,
+    timeline được sắp xếp theo thời điểm event, trạng thái suy ra từ thứ hạng. Bộ đếm domain
+    chỉ tăng lần đầu một message có event đó, nên Mailgun gửi lại webhook không làm sai tỉ lệ.
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+
+    @staticmethod
+    def normalize(document):
+        """Chuyển document email_event đã xử lý thành event gọn để tổng hợp"""
+        processed = document.get('processed_data') or {}
+        event_data = processed.get('event_data') or {}
+        event_timestamp = processed.get('event_timestamp')
+        try:
+            timestamp = datetime.fromtimestamp(float(event_timestamp))
+        except (TypeError, ValueError):
+            timestamp = document.get('timestamp') or datetime.now()
+        recipient = processed.get('recipient') or ''
+        domain = (event_data.get('recipient-domain') or recipient.rpartition('@')[2] or 'unknown').lower()
+        return {
+            'message_id': normalize_message_id(processed.get('message_id')),
+            'event': event_name(processed.get('event_type'), event_data.get('severity')),
+            'timestamp': timestamp,
+            'recipient': recipient,
+            'domain': domain,
+            'severity': event_data.get('severity'),
+            'reason': event_data.get('reason'),
+            'webhook_id': str(document.get('_id', '')),
+            'tenant': document.get('tenant') or '',
+        }
+
+    def apply(self, document):
+        """Áp dụng một email_event đã lưu vào state của message và bộ đếm domain"""
+        event = self.normalize(document)
+        first_time = True
+        if event['message_id']:
+            first_time = self.storage.upsert_message_event(event, timeline_limit=TIMELINE_LIMIT)
+        if first_time:
+            self.storage.increment_domain_counter(
+                event['domain'], bucket_start(event['timestamp']), event['event'], tenant=event['tenant']
+            )
+        return event
+
+    def message(self, message_id, tenant=None):
+        """State của một message (của `tenant` nếu có) kèm trạng thái hiện tại, None nếu chưa có event"""
+        state = self.storage.find_message_state(normalize_message_id(message_id), tenant=tenant)
+        if state is None:
+            return None
+        state['status'] = current_status(state.get('events'))
+        return state
+
+    def domain_stats(self, since, domain=None, include_buckets=False, tenant=None):
+        """
+        Tổng hợp bộ đếm các bucket từ since (chỉ của `tenant` nếu có), mỗi domain một phần tử
+        (nhiều message nhất trước)
+        """
+        domains = {}
+        for row in self.storage.domain_counters(since, domain=domain, tenant=tenant):
+            entry = domains.setdefault(row['domain'], {'domain': row['domain'], 'counts': {}, 'buckets': {}})
+            # Cùng domain / bucket có thể có một bộ đếm cho mỗi tenant
+            bucket = entry['buckets'].setdefault(row['bucket'], {'bucket': row['bucket'], 'counts': {}})
+            for name, count in row['counts'].items():
+                entry['counts'][name] = entry['counts'].get(name, 0) + count
+                bucket['counts'][name] = bucket['counts'].get(name, 0) + count
+        result = []
+        for entry in domains.values():
+            entry.update(delivery_rates(entry['counts']))
+            if include_buckets:
+                entry['buckets'] = sorted(entry['buckets'].values(), key=lambda item: item['bucket'])
+            else:
+                del entry['buckets']
+            result.append(entry)
+        result.sort(key=lambda item: sum(item['counts'].values()), reverse=True)
+        return result
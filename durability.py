@@ -0,0 +1,79 @@
+"""
+Profile độ bền khi ghi webhook và read preference cho các API đọc danh sách / tìm kiếm
+
+Profile ghi (DURABILITY_PROFILES, theo loại webhook):
+- fast: w=1, primary xác nhận là trả về (mất được nếu primary chết trước khi replicate)
+- majority: đợi đa số node replica set ghi nhận (mặc định, như retryWrites=true&w=majority của URI)
+- spool: ghi vào spool cục bộ trên đĩa rồi trả 202, ingest_worker.py ghi vào database sau (majority)
+
+Khóa `otp` áp dụng cho inbound email có mã xác minh (thường chỉ dùng một lần), được ưu tiên
+hơn khóa theo loại webhook; loại không khai báo dùng DEFAULT_DURABILITY.
+"""
+
+from pymongo import WriteConcern
+from pymongo.read_preferences import Nearest, Primary, PrimaryPreferred, Secondary, SecondaryPreferred
+
+WRITE_CONCERNS = {
+    'fast': WriteConcern(w=1),
+    'majority': WriteConcern(w='majority'),
+}
+DURABILITY_PROFILES = ('fast', 'majority', 'spool')
+# Webhook nhận qua spool được worker ghi với profile này
+SPOOL_FLUSH_PROFILE = 'majority'
+
+READ_PREFERENCES = {
+    'primary': Primary,
+    'primaryPreferred': PrimaryPreferred,
+    'secondary': Secondary,
+    'secondaryPreferred': SecondaryPreferred,
+    'nearest': Nearest,
+}
+
+
+def write_concern(profile):
+    """WriteConcern của profile, None = dùng write concern của client (URI)"""
+    return WRITE_CONCERNS.get(profile)
+
+
+def read_preference(name, max_staleness_seconds=-1):
+    """Read preference theo tên; max_staleness_seconds (>= 90) loại secondary trễ quá xa"""
+    if name not in READ_PREFERENCES:
+        raise ValueError(f'READ_PREFERENCE không hợp lệ: {name} ({", ".join(READ_PREFERENCES)})')
+    if name == 'primary':
+        return Primary()
+    return READ_PREFERENCES[name](max_staleness=max_staleness_seconds)
+
+
+class DurabilityPolicy:
+    """Chọn profile ghi cho một document theo `otp` / webhook_type"""
+
+    def __init__(self, profiles=None, default='majority'):
+        for key, profile in list((profiles or {}).items()) + [('default', default)]:
+            if profile not in DURABILITY_PROFILES:
+                raise ValueError(f'Profile độ bền không hợp lệ cho {key}: {profile} ({", ".join(DURABILITY_PROFILES)})')
+        self.profiles = dict(profiles or {})
+        self.default = default
+
+    @classmethod
+    def parse(cls, spec, default='majority'):
+        """Từ chuỗi `inbound_email=majority,otp=fast,email_event=fast`"""
+        profiles = {}
+        for item in (spec or '').split(','):
+            if item.strip():
+                key, _, profile = item.partition('=')
+                profiles[key.strip()] = profile.strip().lower()
+        return cls(profiles, default=default)
+
+    @property
+    def uses_spool(self):
+        return 'spool' in self.profiles.values() or self.default == 'spool'
+
+    def profile_for(self, document):
+        if document.get('otp') and 'otp' in self.profiles:
+            return self.profiles['otp']
+        return self.profiles.get(document.get('webhook_type'), self.default)
+
+    def flush_profile(self, document):
+        """Profile khi ghi vào database (webhook đi qua spool được ghi với SPOOL_FLUSH_PROFILE)"""
+        profile = self.profile_for(document)
+        return SPOOL_FLUSH_PROFILE if profile == 'spool' else profile
@@ -0,0 +1,352 @@
+"""
+Fan-out: đẩy webhook mới lưu tới các subscriber (HTTP endpoint hoặc queue trong process)
+theo batch, giới hạn concurrency mỗi subscriber, retry backoff và dead-letter
+"""
+
+import hashlib
+import hmac
+import json
+import logging
+import queue
+import random
+import threading
+import time
+from datetime import datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from storage import json_default
+
+logger = logging.getLogger(__name__)
+
+DEAD_LETTER_COLLECTION = 'dead_letters'
+
+# Giá trị mặc định của một subscription
+SUBSCRIPTION_DEFAULTS = {
+    'webhook_types': ['inbound_email'],
+    'recipients': [],
+    'batch_size': 20,
+    'max_concurrency': 2,
+    'max_retries': 5,
+}
+
+# Các field của document gửi cho subscriber (không gửi raw body / headers của request gốc)
+PAYLOAD_FIELDS = ('_id', 'timestamp', 'webhook_type', 'recipient_addresses', 'otp',
+                  'processed_data', 'request_form_data', 'request_json')
+
+
+class DeliveryError(Exception):
+    """Lỗi khi gửi batch; retryable=False thì chuyển thẳng vào dead-letter"""
+
+    def __init__(self, message, retryable=True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+def _string_field(data, key):
+    """Field chuỗi (đã strip, '' nếu không có), raise ValueError nếu không phải chuỗi"""
+    value = data.get(key)
+    if value is None:
+        return ''
+    if not isinstance(value, str):
+        raise ValueError(f'"{key}" phải là chuỗi')
+    return value.strip()
+
+
+def build_subscription(data, tenant=None):
+    """
+    Kiểm tra và chuẩn hóa subscription từ JSON của request, raise ValueError nếu không hợp lệ.
+    `tenant`: tenant của API key tạo subscription, subscription chỉ nhận webhook của tenant đó.
+    """
+    if not isinstance(data, dict):
+        raise ValueError('Body phải là JSON object')
+    url = _string_field(data, 'url')
+    queue_name = _string_field(data, 'queue')
+    if bool(url) == bool(queue_name):
+        raise ValueError('Cần đúng một trong hai tham số "url" hoặc "queue"')
+    if url and not url.startswith(('http://', 'https://')):
+        raise ValueError('URL phải bắt đầu bằng http:// hoặc https://')
+    subscription = {
+        'name': _string_field(data, 'name') or url or queue_name,
+        'url': url or None,
+        'queue': queue_name or None,
+        'secret': _string_field(data, 'secret') or None,
+        'tenant': tenant,
+        'created_at': datetime.now(),
+    }
+    for key, default in SUBSCRIPTION_DEFAULTS.items():
+        subscription[key] = data.get(key, default)
+    for key in ('webhook_types', 'recipients'):
+        if isinstance(subscription[key], str):
+            subscription[key] = [subscription[key]]
+        if not isinstance(subscription[key], list) or not all(isinstance(value, str) for value in subscription[key]):
+            raise ValueError(f'"{key}" phải là chuỗi hoặc danh sách chuỗi')
+    subscription['recipients'] = [value.strip().lower() for value in subscription['recipients'] if value.strip()]
+    for key in ('batch_size', 'max_concurrency', 'max_retries'):
+        try:
+            subscription[key] = int(subscription[key])
+        except (TypeError, ValueError):
+            raise ValueError(f'"{key}" phải là số nguyên') from None
+        if subscription[key] < (0 if key == 'max_retries' else 1):
+            raise ValueError(f'Giá trị "{key}" không hợp lệ')
+    return subscription
+
+
+def public_subscription(subscription):
+    """Subscription trả về cho API (ẩn secret)"""
+    result = {key: value for key, value in subscription.items() if key != 'secret'}
+    result['has_secret'] = bool(subscription.get('secret'))
+    return result
+
+
+def matches(subscription, document):
+    """Document có thuộc subscription không (theo tenant, loại webhook và người nhận)"""
+    if subscription.get('tenant') is not None and document.get('tenant') != subscription['tenant']:
+        return False
+    if document.get('webhook_type') not in subscription['webhook_types']:
+        return False
+    if not subscription['recipients']:
+        return True
+    addresses = document.get('recipient_addresses') or []
+    if not addresses and document.get('recipient'):
+        addresses = [document['recipient']]
+    for address in addresses:
+        for pattern in subscription['recipients']:
+            # '@example.com' khớp cả domain, còn lại khớp chính xác địa chỉ
+            if address == pattern or (pattern.startswith('@') and address.endswith(pattern)):
+                return True
+    return False
+
+
+def build_payload(document):
+    return {key: document[key] for key in PAYLOAD_FIELDS if key in document}
+
+
+class SubscriberChannel:
+    """
+    Queue có giới hạn và `max_concurrency` thread gửi cho một subscriber.
+    Mỗi thread gom tối đa `batch_size` webhook (chờ tối đa batch_wait giây) rồi gửi một request.
+    """
+
+    def __init__(self, dispatcher, subscription):
+        self.dispatcher = dispatcher
+        self.subscription = subscription
+        self.queue = queue.Queue(maxsize=dispatcher.queue_size)
+        self._closing = threading.Event()
+        self._stop = threading.Event()
+        self.threads = []
+        for index in range(subscription['max_concurrency']):
+            thread = threading.Thread(
+                target=self._run, name=f"fanout-{subscription['_id']}-{index}", daemon=True
+            )
+            thread.start()
+            self.threads.append(thread)
+
+    def offer(self, payload):
+        """Đưa webhook vào queue, không chặn request path; queue đầy thì ghi dead-letter"""
+        try:
+            self.queue.put_nowait(payload)
+        except queue.Full:
+            self.dispatcher.dead_letter(self.subscription, [payload], 'Queue của subscriber đã đầy', 0)
+
+    def _next_batch(self):
+        try:
+            first = self.queue.get(timeout=0.5)
+        except queue.Empty:
+            return []
+        batch = [first]
+        deadline = time.monotonic() + self.dispatcher.batch_wait
+        while len(batch) < self.subscription['batch_size']:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                if self._closing.is_set():
+                    return
+                continue
+            self._deliver(batch)
+
+    def _deliver(self, batch):
+        max_retries = self.subscription['max_retries']
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                self.dispatcher.send(self.subscription, batch)
+                return
+            except DeliveryError as e:
+                error, retryable = str(e), e.retryable
+            except Exception as e:
+                error, retryable = str(e), True
+            if not retryable or attempt > max_retries or self._stop.is_set():
+                break
+            # Exponential backoff với full jitter
+            delay = random.uniform(0, min(self.dispatcher.retry_max, self.dispatcher.retry_base * 2 ** (attempt - 1)))
+            logger.warning(f"[WARNING] Fan-out to {self.subscription['name']} failed (attempt {attempt}): {error}; retry in {delay:.1f}s")
+            if self._stop.wait(delay):
+                break
+        self.dispatcher.dead_letter(self.subscription, batch, error, attempt)
+
+    def close(self, timeout=None):
+        """Gửi nốt các webhook còn trong queue rồi dừng; hết timeout thì dừng retry"""
+        self._closing.set()
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        for thread in self.threads:
+            thread.join(None if deadline is None else max(deadline - time.monotonic(), 0))
+        self._stop.set()
+
+
+class OutboundDispatcher:
+    """
+    Registry subscription và các channel gửi. Subscription lưu trong storage nên mọi worker
+    dùng chung; mỗi worker chỉ đẩy các webhook chính nó đã nhận.
+    """
+
+    REFRESH_INTERVAL = 30
+
+    def __init__(self, storage, queue_size=10000, batch_wait=0.5, timeout=10, pool_size=20,
+                 retry_base=1.0, retry_max=60.0):
+        self.storage = storage
+        self.queue_size = queue_size
+        self.batch_wait = batch_wait
+        self.timeout = timeout
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        # Một session dùng chung để tái sử dụng kết nối keep-alive tới các subscriber
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.local_queues = {}
+        self._channels = {}
+        self._refreshed_at = 0
+        self._lock = threading.Lock()
+
+    # --- Registry ---
+
+    def register_queue(self, name, target):
+        """Đăng ký queue trong process (queue.Queue) làm đích cho subscription có "queue": name"""
+        self.local_queues[name] = target
+
+    def refresh(self, force=False):
+        """Đồng bộ channel với danh sách subscription trong storage (cache REFRESH_INTERVAL giây)"""
+        if self.storage is None:
+            return
+        if not force and time.monotonic() - self._refreshed_at < self.REFRESH_INTERVAL:
+            return
+        subscriptions = {str(item['_id']): item for item in self.storage.list_subscriptions()}
+        with self._lock:
+            for subscription_id in list(self._channels):
+                if subscription_id not in subscriptions:
+                    self._channels.pop(subscription_id).close(timeout=0)
+            for subscription_id, subscription in subscriptions.items():
+                if subscription_id not in self._channels:
+                    subscription['_id'] = subscription_id
+                    self._channels[subscription_id] = SubscriberChannel(self, subscription)
+            self._refreshed_at = time.monotonic()
+
+    def subscribe(self, subscription):
+        subscription_id = self.storage.save_subscription(subscription)
+        self.refresh(force=True)
+        return subscription_id
+
+    def find_subscription(self, subscription_id, tenant=None):
+        """Subscription theo ID (chỉ của `tenant` nếu có), None nếu không có"""
+        for subscription in self.storage.list_subscriptions():
+            if str(subscription['_id']) == subscription_id and (tenant is None or subscription.get('tenant') == tenant):
+                return subscription
+        return None
+
+    def unsubscribe(self, subscription_id):
+        deleted = self.storage.delete_subscription(subscription_id)
+        self.refresh(force=True)
+        return deleted
+
+    # --- Gửi ---
+
+    def publish(self, document):
+        """Listener của WebhookDispatcher: đưa webhook vừa lưu vào channel của các subscriber khớp"""
+        self.refresh()
+        payload = None
+        # Snapshot dưới lock: refresh() / shutdown() ở thread khác có thể đổi dict
+        with self._lock:
+            channels = list(self._channels.values())
+        for channel in channels:
+            if matches(channel.subscription, document):
+                payload = payload or build_payload(document)
+                channel.offer(payload)
+
+    def send(self, subscription, batch):
+        """Gửi một batch tới subscriber, raise DeliveryError nếu thất bại"""
+        if subscription.get('queue'):
+            target = self.local_queues.get(subscription['queue'])
+            if target is None:
+                raise DeliveryError(f"Queue '{subscription['queue']}' chưa được đăng ký", retryable=False)
+            target.put(batch)
+            return
+
+        body = json.dumps({'subscription': subscription['name'], 'webhooks': batch},
+                          ensure_ascii=False, default=json_default).encode('utf-8')
+        headers = {'Content-Type': 'application/json'}
+        if subscription.get('secret'):
+            headers['X-Webhook-Signature'] = hmac.new(
+                subscription['secret'].encode('utf-8'), body, hashlib.sha256
+            ).hexdigest()
+        try:
+            response = self.session.post(subscription['url'], data=body, headers=headers, timeout=self.timeout)
+        except requests.RequestException as e:
+            raise DeliveryError(str(e))
+        if response.status_code >= 300:
+            # 429 và 5xx có thể thành công khi thử lại, các lỗi 4xx khác thì không
+            retryable = response.status_code == 429 or response.status_code >= 500
+            raise DeliveryError(f'HTTP {response.status_code}', retryable=retryable)
+        logger.info(f"[SUCCESS] Fan-out {len(batch)} webhooks to {subscription['name']}")
+
+    def dead_letter(self, subscription, batch, error, attempts):
+        """Lưu các webhook gửi thất bại để kiểm tra / gửi lại thủ công"""
+        logger.error(f"[ERROR] Fan-out to {subscription['name']} gave up after {attempts} attempts: {error}")
+        now = datetime.now()
+        records = [{
+            'subscription_id': subscription['_id'],
+            'webhook_id': str(payload.get('_id', '')),
+            'timestamp': now,
+            'error': error,
+            'attempts': attempts,
+            'payload': payload,
+        } for payload in batch]
+        try:
+            self.storage.insert_records(DEAD_LETTER_COLLECTION, records, key_field='subscription_id')
+        except Exception as e:
+            logger.error(f"[ERROR] Cannot store dead letters for {subscription['name']}: {e}")
+
+    def dead_letters(self, subscription_id, limit=50):
+        return self.storage.find_records(DEAD_LETTER_COLLECTION, 'subscription_id', subscription_id, limit=limit)
+
+    def shutdown(self, timeout=None):
+        """Gửi nốt các webhook đang chờ rồi dừng mọi channel"""
+        with self._lock:
+            channels, self._channels = list(self._channels.values()), {}
+        for channel in channels:
+            channel.close(timeout=timeout)
+        self.session.close()
+
+
+def create_outbound_dispatcher(storage, settings):
+    """Tạo dispatcher fan-out theo settings"""
+    return OutboundDispatcher(
+        storage,
+        queue_size=settings.fanout_queue_size,
+        batch_wait=settings.fanout_batch_wait,
+        timeout=settings.fanout_timeout,
+        pool_size=settings.fanout_pool_size,
+        retry_base=settings.fanout_retry_base,
+        retry_max=settings.fanout_retry_max,
+    )
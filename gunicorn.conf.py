@@ -0,0 +1,75 @@
+"""
+Cấu hình gunicorn cho production, gunicorn tự đọc file này khi chạy từ thư mục dự án:
+
+    gunicorn app:app
+
+Tham số lấy từ Settings (biến môi trường / .env): WEB_CONCURRENCY worker, mỗi worker WEB_THREADS
+thread (gthread, long-poll /changes không chiếm cả worker). Worker được thay sau MAX_REQUESTS
+(± MAX_REQUESTS_JITTER để không restart cùng lúc) request, hoặc khi RSS vượt WORKER_MAX_RSS_MB.
+
+SIGTERM (deploy): /ready trả 503 ngay, worker vẫn phục vụ thêm DRAIN_DELAY giây rồi mới ngừng nhận
+kết nối, chờ request đang xử lý và dừng dispatcher / fan-out trong GRACEFUL_TIMEOUT (xem lifecycle.py).
+"""
+
+import signal
+import threading
+import time
+
+from lifecycle import LIFECYCLE_KEY, MemoryWatchdog, flush_logs, shutdown_app
+from settings import Settings
+
+settings = Settings.from_env()
+
+bind = f'0.0.0.0:{settings.port}'
+workers = settings.web_workers
+worker_class = 'gthread'
+threads = settings.web_threads
+# Import app một lần ở master; Services được tạo sau fork trong từng worker
+preload_app = True
+max_requests = settings.max_requests
+max_requests_jitter = settings.max_requests_jitter
+timeout = settings.worker_timeout
+graceful_timeout = settings.graceful_timeout
+keepalive = 5
+
+
+def _lifecycle(worker):
+    extensions = getattr(worker.wsgi, 'extensions', None) or {}
+    return extensions.get(LIFECYCLE_KEY)
+
+
+def post_worker_init(worker):
+    lifecycle = _lifecycle(worker)
+    if lifecycle is None:
+        return
+
+    def stop_accepting():
+        worker.alive = False
+
+    def handle_term(signum, frame):
+        # Đổi readiness trước, đóng socket sau DRAIN_DELAY giây khi load balancer đã ngừng route tới
+        if lifecycle.begin_drain('SIGTERM'):
+            timer = threading.Timer(settings.drain_delay, stop_accepting)
+            timer.daemon = True
+            timer.start()
+
+    signal.signal(signal.SIGTERM, handle_term)
+    signal.siginterrupt(signal.SIGTERM, False)
+
+    def recycle(rss):
+        # Không đổi readiness: chỉ worker này được thay, các worker khác vẫn phục vụ
+        worker.alive = False
+
+    MemoryWatchdog(
+        settings.worker_max_rss_mb * 1024 * 1024, recycle, interval=settings.memory_check_interval
+    ).start()
+
+
+def worker_exit(server, worker):
+    lifecycle = _lifecycle(worker)
+    if lifecycle is None:
+        flush_logs()
+        return
+    # Phần còn lại của GRACEFUL_TIMEOUT (master kill worker khi hết)
+    elapsed = time.time() - lifecycle.drain_started if lifecycle.drain_started else 0
+    shutdown_app(worker.wsgi, timeout=max(settings.graceful_timeout - elapsed - 1, 1))
@@ -0,0 +1,248 @@
+"""
+Render nội dung HTML của email thành các variant dùng để hiển thị:
+
+- safe: HTML đã sanitize (allowlist tag / attribute, bỏ script, event handler, tracking pixel
+  và tham số tracking trong link; ảnh không được tải, thay bằng alt text)
+- text: văn bản thuần giữ xuống dòng theo block
+- preview: đoạn đầu của text để hiển thị trong danh sách
+
+Kết quả được cache theo hash nội dung nên mỗi email chỉ parse một lần cho mỗi variant.
+"""
+
+import hashlib
+import html
+import re
+import threading
+from collections import OrderedDict
+from html.parser import HTMLParser
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+# Tăng khi thay đổi cách render để cache / ETag cũ không còn dùng được
+RENDER_VERSION = 2
+
+VARIANTS = ('safe', 'text', 'preview')
+
+PREVIEW_LENGTH = 200
+
+ALLOWED_TAGS = {
+    'a', 'abbr', 'b', 'blockquote', 'br', 'caption', 'center', 'code', 'div', 'em', 'font',
+    'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr', 'i', 'img', 'li', 'ol', 'p', 'pre', 's', 'small',
+    'span', 'strong', 'sub', 'sup', 'table', 'tbody', 'td', 'tfoot', 'th', 'thead', 'tr', 'u', 'ul',
+}
+# Tag bị bỏ cả nội dung bên trong
+DROP_CONTENT_TAGS = {
+    'script', 'style', 'head', 'title', 'iframe', 'object', 'embed', 'noscript', 'template',
+    'svg', 'math', 'select', 'textarea', 'button',
+}
+VOID_TAGS = {'br', 'hr', 'img'}
+BLOCK_TAGS = {
+    'p', 'div', 'br', 'tr', 'li', 'ul', 'ol', 'table', 'blockquote', 'hr', 'pre', 'center',
+    'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+}
+
+ALLOWED_ATTRIBUTES = {
+    'align', 'alt', 'bgcolor', 'border', 'cellpadding', 'cellspacing', 'color', 'colspan', 'dir',
+    'face', 'height', 'rowspan', 'size', 'style', 'title', 'valign', 'width',
+}
+URL_ATTRIBUTES = {'a': 'href'}
+ALLOWED_SCHEMES = {'a': {'http', 'https', 'mailto'}}
+# CSS có thể tải tài nguyên hoặc chạy script
+UNSAFE_STYLE = re.compile(r'url\s*\(|expression|javascript:|@import|behavior|-moz-binding', re.IGNORECASE)
+# Tham số theo dõi bị bỏ khỏi link
+TRACKING_PARAMS = {'fbclid', 'gclid', 'mc_cid', 'mc_eid', '_hsenc', '_hsmi', 'mkt_tok'}
+
+
+def content_hash(value):
+    """Hash nội dung (kèm RENDER_VERSION) làm khóa cache và ETag"""
+    return hashlib.blake2b(f'{RENDER_VERSION}:{value}'.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def render_etag(value, variant):
+    """ETag của một variant, tính được mà không cần render"""
+    return f'{content_hash(value)}-{variant}'
+
+
+def clean_url(url, tag):
+    """URL an toàn của href / src (bỏ tham số tracking), None nếu scheme không được phép"""
+    url = url.strip()
+    parts = urlsplit(url)
+    if parts.scheme.lower() not in ALLOWED_SCHEMES[tag]:
+        return None
+    if parts.query:
+        query = [(key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+                 if not key.lower().startswith('utm_') and key.lower() not in TRACKING_PARAMS]
+        url = urlunsplit(parts._replace(query=urlencode(query)))
+    return url
+
+
+def _is_tracking_pixel(attrs):
+    def size(name):
+        match = re.match(r'\s*(\d+)', attrs.get(name) or '')
+        return int(match.group(1)) if match else None
+    width, height = size('width'), size('height')
+    hidden = 'display:none' in (attrs.get('style') or '').replace(' ', '').lower()
+    return hidden or (width is not None and height is not None and width <= 1 and height <= 1)
+
+
+class _Sanitizer(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.out = []
+        self.open_tags = []
+        self.skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in DROP_CONTENT_TAGS:
+            self.skip_depth += 1
+            return
+        if self.skip_depth or tag not in ALLOWED_TAGS:
+            return
+        attrs = {name.lower(): value for name, value in attrs if value is not None}
+        if tag == 'img':
+            if _is_tracking_pixel(attrs):
+                return
+            # Ảnh từ xa báo cho người gửi email đã được mở (và lộ IP người xem), ảnh nhúng (cid:)
+            # không có dữ liệu để hiển thị: không giữ src nào, thay bằng alt text
+            alt = attrs.get('alt') or 'image'
+            self.out.append(f'[{html.escape(alt)}]')
+            return
+        kept = []
+        for name, value in attrs.items():
+            if name in ALLOWED_ATTRIBUTES:
+                if name == 'style' and UNSAFE_STYLE.search(value):
+                    continue
+                kept.append((name, value))
+            elif URL_ATTRIBUTES.get(tag) == name:
+                url = clean_url(value, tag)
+                if url is not None:
+                    kept.append((name, url))
+        if tag == 'a':
+            kept += [('target', '_blank'), ('rel', 'noopener noreferrer nofollow')]
+        rendered = ''.join(f' {name}="{html.escape(value, quote=True)}"' for name, value in kept)
+        self.out.append(f'<{tag}{rendered}>')
+        if tag not in VOID_TAGS:
+            self.open_tags.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in DROP_CONTENT_TAGS:
+            return
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_TAGS and self.open_tags and self.open_tags[-1] == tag:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag in DROP_CONTENT_TAGS:
+            self.skip_depth = max(self.skip_depth - 1, 0)
+            return
+        if self.skip_depth or tag not in self.open_tags:
+            return
+        # Đóng cả các tag con chưa đóng để output luôn cân bằng
+        while self.open_tags:
+            open_tag = self.open_tags.pop()
+            self.out.append(f'</{open_tag}>')
+            if open_tag == tag:
+                break
+
+    def handle_data(self, data):
+        if not self.skip_depth:
+            self.out.append(html.escape(data, quote=False))
+
+    def result(self):
+        self.close()
+        return ''.join(self.out) + ''.join(f'</{tag}>' for tag in reversed(self.open_tags))
+
+
+class _TextExtractor(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.out = []
+        self.skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in DROP_CONTENT_TAGS:
+            self.skip_depth += 1
+        elif tag in BLOCK_TAGS:
+            self.out.append('\n- ' if tag == 'li' else '\n')
+        elif tag in ('td', 'th'):
+            self.out.append(' ')
+
+    def handle_endtag(self, tag):
+        if tag in DROP_CONTENT_TAGS:
+            self.skip_depth = max(self.skip_depth - 1, 0)
+        elif tag in BLOCK_TAGS and tag not in ('li', 'br'):
+            self.out.append('\n')
+
+    def handle_startendtag(self, tag, attrs):
+        if tag not in DROP_CONTENT_TAGS:
+            self.handle_starttag(tag, attrs)
+
+    def handle_data(self, data):
+        if not self.skip_depth:
+            self.out.append(data)
+
+    def result(self):
+        self.close()
+        lines = (' '.join(line.split()) for line in ''.join(self.out).splitlines())
+        return re.sub(r'\n{3,}', '\n\n', '\n'.join(lines)).strip()
+
+
+def sanitize_html(value):
+    parser = _Sanitizer()
+    parser.feed(value)
+    return parser.result()
+
+
+def html_to_text(value):
+    parser = _TextExtractor()
+    parser.feed(value)
+    return parser.result()
+
+
+def make_preview(text, length=PREVIEW_LENGTH):
+    text = ' '.join(text.split())
+    return text if len(text) <= length else text[:length].rsplit(' ', 1)[0] + '…'
+
+
+def render(value, variant):
+    """Render một variant (không cache)"""
+    if variant == 'safe':
+        return sanitize_html(value)
+    if variant == 'text':
+        return html_to_text(value)
+    if variant == 'preview':
+        return make_preview(html_to_text(value))
+    raise ValueError(f'Variant không hợp lệ: {variant} (safe|text|preview)')
+
+
+class RenderCache:
+    """
+    Cache LRU các variant đã render, khóa theo (hash nội dung, variant), giới hạn tổng số ký tự.
+    Email giống nhau (cùng template) dùng chung một entry.
+    """
+
+    def __init__(self, max_chars=32_000_000):
+        self.max_chars = max_chars
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, value, variant):
+        """Trả về (nội dung đã render, etag)"""
+        if variant not in VARIANTS:
+            raise ValueError(f'Variant không hợp lệ: {variant} (safe|text|preview)')
+        digest = content_hash(value)
+        key = (digest, variant)
+        with self._lock:
+            rendered = self._entries.get(key)
+            if rendered is not None:
+                self._entries.move_to_end(key)
+                return rendered, f'{digest}-{variant}'
+        rendered = render(value, variant)
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = rendered
+                self._size += len(rendered)
+                while self._size > self.max_chars and self._entries:
+                    _, evicted = self._entries.popitem(last=False)
+                    self._size -= len(evicted)
+        return rendered, f'{digest}-{variant}'
@@ -0,0 +1,96 @@
+"""
+Validator (ETag / Last-Modified) cho các endpoint polling inbox theo người nhận
+"""
+
+import hashlib
+import logging
+import threading
+import time
+from datetime import timezone
+
+from flask import request
+from werkzeug.http import http_date
+
+from storage import is_plain_address
+
+logger = logging.getLogger(__name__)
+
+
+class InboxValidatorCache:
+    """
+    Cache validator {count, newest_id, newest} của inbox theo (tenant, địa chỉ người nhận);
+    tenant None là inbox không giới hạn tenant (request không có API key).
+
+    Ingest trong process hiện tại cập nhật cache ngay lập tức. Vì các worker khác
+    cũng có thể ghi, mỗi entry chỉ được tin cậy trong `ttl` giây, sau đó được tính
+    lại từ storage bằng một truy vấn có index.
+    """
+
+    def __init__(self, storage, ttl=2.0, max_entries=100_000):
+        self.storage = storage
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, recipient, tenant=None):
+        """Validator của một địa chỉ (chỉ email của `tenant` nếu có), None nếu recipient không phải địa chỉ đầy đủ"""
+        recipient = recipient.strip().lower()
+        if self.storage is None or not is_plain_address(recipient):
+            return None
+        key = (tenant, recipient)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry['expires_at'] > now:
+                return entry
+        entry = dict(self.storage.inbox_validator(recipient, tenant=tenant))
+        entry['expires_at'] = now + self.ttl
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                self._entries.clear()
+            self._entries[key] = entry
+        return entry
+
+    def record(self, addresses, webhook_id, timestamp, tenant=None):
+        """Cập nhật validator khi có email mới (thuộc `tenant`) được lưu trong process này"""
+        with self._lock:
+            for address in addresses:
+                for key in ((None, address), (tenant, address)) if tenant is not None else ((None, address),):
+                    entry = self._entries.get(key)
+                    if entry is None:
+                        continue
+                    entry['count'] += 1
+                    entry['newest_id'] = str(webhook_id)
+                    entry['newest'] = timestamp
+
+
+def make_etag(recipient, validator):
+    """ETag yếu từ validator của inbox và toàn bộ tham số của request (path + query)"""
+    key = '|'.join([
+        request.path,
+        recipient.strip().lower(),
+        '&'.join(f'{k}={v}' for k, v in sorted(request.args.items(multi=True))),
+        str(validator['count']),
+        validator['newest_id'] or '',
+    ])
+    return hashlib.blake2b(key.encode('utf-8'), digest_size=12).hexdigest()
+
+
+def is_not_modified(etag, validator):
+    """Kiểm tra If-None-Match / If-Modified-Since của request"""
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since and validator['newest']:
+        newest = validator['newest'].replace(microsecond=0).astimezone(timezone.utc)
+        return newest <= request.if_modified_since
+    return False
+
+
+def set_validator_headers(response, etag, validator):
+    """Gắn ETag / Last-Modified vào response"""
+    response.set_etag(etag, weak=True)
+    if validator['newest']:
+        response.headers['Last-Modified'] = http_date(validator['newest'].astimezone(timezone.utc))
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
@@ -0,0 +1,359 @@
+"""
+Parse request webhook (giới hạn kích thước, field lớn tách ra blob store), dựng document
+và đóng gói request đã parse để xử lý ở worker process
+"""
+
+import hashlib
+import io
+import itertools
+import json
+import logging
+import pickle
+import tempfile
+from datetime import datetime
+from urllib.parse import urlsplit
+
+from bson import ObjectId
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
+from werkzeug.test import EnvironBuilder
+from werkzeug.wrappers import Request
+
+from blob_store import extract_blob_keys
+
+logger = logging.getLogger(__name__)
+
+# Key trong WSGI environ lưu ParsedRequest của request hiện tại
+PARSED_REQUEST_KEY = 'mailgun_webhook.parsed_request'
+# Key trong WSGI environ lưu PayloadLimits áp dụng cho request (app đặt trước khi parse)
+PAYLOAD_LIMITS_KEY = 'mailgun_webhook.payload_limits'
+
+READ_CHUNK = 64 * 1024
+
+
+class PayloadLimits:
+    """
+    Giới hạn kích thước khi parse và lưu webhook (tổng body do MAX_CONTENT_LENGTH của app giới hạn):
+
+    - max_field_bytes: field lớn hơn chỉ giữ phần đầu trong document, bản đầy đủ vào blob_store
+    - max_raw_body_bytes: số byte đầu của body thô được giữ trong request_raw_data
+    - max_document_bytes: document ước lượng vượt ngưỡng (BSON tối đa 16 MB) được cắt thêm trước khi lưu
+    - blob_store: nơi lưu field lớn / file đính kèm; None thì chỉ cắt
+    """
+
+    def __init__(self, max_field_bytes=2 * 1024 * 1024, max_raw_body_bytes=256 * 1024,
+                 max_document_bytes=15 * 1024 * 1024, max_parts=1000, blob_store=None):
+        self.max_field_bytes = max_field_bytes
+        self.max_raw_body_bytes = max_raw_body_bytes
+        self.max_document_bytes = max_document_bytes
+        self.max_parts = max_parts
+        self.blob_store = blob_store
+
+
+DEFAULT_LIMITS = PayloadLimits()
+
+
+class ParsedRequest:
+    """
+    Body của request được đọc và parse đúng một lần rồi dùng chung cho log, ingest và queue.
+
+    multipart/form-data được parse dạng stream: mỗi part nằm trong bộ nhớ tối đa `max_field_bytes`,
+    phần vượt được ghi ra file tạm, nên bộ nhớ không tăng theo kích thước email. Field vượt giới hạn
+    chỉ giữ phần đầu trong `form` (thông tin bản đầy đủ trong `blobs`), file đính kèm được đưa vào
+    blob store (`files`). `raw` chỉ giữ `max_raw_body_bytes` đầu tiên của body thô, `size` là kích
+    thước thật. Các body khác (urlencoded, JSON) được parse trong bộ nhớ như trước.
+    """
+
+    __slots__ = ('raw', 'size', 'form', 'files', 'blobs', 'headers', 'json')
+
+    def __init__(self, req, limits=DEFAULT_LIMITS):
+        self.headers = dict(req.headers)
+        self.form = {}
+        self.files = {}
+        self.blobs = {}
+        self.json = None
+        boundary = req.mimetype_params.get('boundary')
+        if req.mimetype == 'multipart/form-data' and boundary:
+            self._parse_multipart(req.stream, boundary.encode('latin-1'), limits)
+            return
+
+        # Đọc body trước khi parse form: form parser tiêu thụ stream, sau đó get_data() sẽ rỗng
+        raw = req.get_data()
+        self.size = len(raw)
+        self.raw = raw[:limits.max_raw_body_bytes]
+        # Tổng body đã được MAX_CONTENT_LENGTH giới hạn; field lớn được tách ra bên dưới thay vì 413
+        req.max_form_memory_size = None
+        for name, value in req.form.to_dict().items():
+            encoded = value.encode('utf-8')
+            if len(encoded) > limits.max_field_bytes:
+                self._externalize(name, io.BytesIO(encoded), len(encoded), 'utf-8', limits)
+            else:
+                self.form[name] = value
+        # Thử parse JSON nếu có
+        try:
+            if req.is_json:
+                self.json = req.get_json()
+        except Exception:
+            pass
+
+    def _parse_multipart(self, stream, boundary, limits):
+        decoder = MultipartDecoder(boundary, max_parts=limits.max_parts)
+        prefix = bytearray()
+        self.size = 0
+        part = buffer = None
+        try:
+            # None cuối cùng báo hết body cho decoder (như werkzeug.formparser)
+            for chunk in itertools.chain(iter(lambda: stream.read(READ_CHUNK), b''), [None]):
+                if chunk:
+                    self.size += len(chunk)
+                    if len(prefix) < limits.max_raw_body_bytes:
+                        prefix += chunk[:limits.max_raw_body_bytes - len(prefix)]
+                decoder.receive_data(chunk)
+                event = decoder.next_event()
+                while not isinstance(event, (Epilogue, NeedData)):
+                    if isinstance(event, (Field, File)):
+                        part = event
+                        buffer = tempfile.SpooledTemporaryFile(max_size=limits.max_field_bytes)
+                    elif isinstance(event, Data):
+                        buffer.write(event.data)
+                        if not event.more_data:
+                            self._finish_part(part, buffer, limits)
+                            buffer.close()
+                            buffer = None
+                    event = decoder.next_event()
+        except ValueError as e:
+            # Giống werkzeug (silent): body hỏng thì giữ các field đã parse được
+            logger.warning(f"[WARNING] Invalid multipart body: {e}")
+        finally:
+            if buffer is not None:
+                buffer.close()
+        self.raw = bytes(prefix)
+
+    def _finish_part(self, part, buffer, limits):
+        size = buffer.tell()
+        buffer.seek(0)
+        if isinstance(part, File):
+            blob = limits.blob_store.put(buffer)[0] if limits.blob_store is not None else None
+            self.files.setdefault(part.name, {
+                'filename': part.filename,
+                'content_type': part.headers.get('Content-Type', ''),
+                'size': size,
+                'blob': blob,
+            })
+            return
+        if part.name in self.form:
+            return  # Giữ giá trị đầu tiên như MultiDict.to_dict()
+        charset = parse_options_header(part.headers.get('Content-Type', ''))[1].get('charset', 'utf-8')
+        if size > limits.max_field_bytes:
+            self._externalize(part.name, buffer, size, charset, limits)
+        else:
+            self.form[part.name] = buffer.read().decode(charset, 'replace')
+
+    def _externalize(self, name, fileobj, size, charset, limits):
+        """Field quá lớn: phần đầu ở lại form, bản đầy đủ vào blob store (nếu có)"""
+        blob = limits.blob_store.put(fileobj)[0] if limits.blob_store is not None else None
+        fileobj.seek(0)
+        # Ký tự nhiều byte bị cắt ở cuối thành U+FFFD, bỏ đi
+        self.form[name] = fileobj.read(limits.max_field_bytes).decode(charset, 'replace').rstrip('\ufffd')
+        self.blobs[name] = {'blob': blob, 'size': size, 'kept_bytes': limits.max_field_bytes}
+        logger.warning(f"[WARNING] Field '{name}' ({size} bytes) truncated to {limits.max_field_bytes} bytes"
+                       f"{', full content in blob ' + blob if blob else ''}")
+
+    @classmethod
+    def restore(cls, state):
+        """Dựng lại từ state đã đóng gói (capture_request) mà không parse lại"""
+        parsed = cls.__new__(cls)
+        for slot in cls.__slots__:
+            setattr(parsed, slot, state[slot])
+        return parsed
+
+    def state(self):
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+    @property
+    def truncated(self):
+        return self.size > len(self.raw)
+
+    def preview(self, limit=500):
+        """Đoạn đầu của body để log, chỉ decode tối đa `limit` byte"""
+        return self.raw[:limit].decode('utf-8', errors='replace')
+
+
+def parse_request(req):
+    """ParsedRequest của request, tạo một lần và cache trong environ"""
+    parsed = req.environ.get(PARSED_REQUEST_KEY)
+    if parsed is None:
+        limits = req.environ.get(PAYLOAD_LIMITS_KEY, DEFAULT_LIMITS)
+        parsed = req.environ[PARSED_REQUEST_KEY] = ParsedRequest(req, limits)
+    return parsed
+
+
+def value_size(value):
+    """Kích thước ước lượng khi lưu (BSON), rẻ hơn bson.encode toàn bộ document"""
+    if isinstance(value, str):
+        return len(value) if value.isascii() else len(value.encode('utf-8'))
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(len(key) + 2 + value_size(item) for key, item in value.items()) + 5
+    if isinstance(value, (list, tuple)):
+        return sum(value_size(item) + 4 for item in value) + 5
+    return 16
+
+
+def fit_document(document, max_bytes):
+    """
+    Cắt document tới khi kích thước ước lượng không vượt max_bytes (thay vì insert lỗi):
+    bỏ body thô trước, sau đó cắt dần các field chuỗi lớn nhất của form / email_data.
+    Trả về danh sách field đã cắt (cũng được ghi vào document['truncated_fields']).
+    """
+    size = value_size(document)
+    if size <= max_bytes:
+        return []
+    truncated = []
+    if document.get('request_raw_data'):
+        size -= len(document['request_raw_data'])
+        document['request_raw_data'] = b''
+        truncated.append('request_raw_data')
+    containers = [
+        ('request_form_data', document.get('request_form_data') or {}),
+        ('processed_data.email_data', (document.get('processed_data') or {}).get('email_data') or {}),
+    ]
+    while size > max_bytes:
+        candidates = [
+            (value_size(value), path, container, key)
+            for path, container in containers
+            for key, value in container.items() if isinstance(value, str)
+        ]
+        if not candidates:
+            break
+        field_size, path, container, key = max(candidates, key=lambda candidate: candidate[0])
+        if field_size <= 1024:
+            break
+        keep = max(field_size - (size - max_bytes), field_size // 2)
+        container[key] = container[key][:keep]
+        size -= field_size - value_size(container[key])
+        truncated.append(f'{path}.{key}')
+    document['truncated_fields'] = sorted(set(truncated))
+    logger.warning(f"[WARNING] Document truncated to fit {max_bytes} bytes: {document['truncated_fields']}")
+    return document['truncated_fields']
+
+
+def build_webhook_document(req, received_at=None, ingest_id=None):
+    """
+    Tạo document hoàn chỉnh (metadata, headers, form, raw body, JSON) từ một werkzeug Request;
+    ingest_id (gán lúc đưa vào spool) là khóa idempotency khi worker ghi lại cùng payload
+    """
+    parsed = parse_request(req)
+    document = {
+        'timestamp': received_at or datetime.now(),
+        'request_metadata': {
+            'url': req.url,
+            'method': req.method,
+            'remote_addr': req.remote_addr,
+            'user_agent': req.headers.get('User-Agent', ''),
+            'content_type': req.headers.get('Content-Type', ''),
+            'content_length': req.headers.get('Content-Length', ''),
+            'body_size': parsed.size,
+            'raw_truncated': parsed.truncated,
+            'host': req.headers.get('Host', ''),
+            'referer': req.headers.get('Referer', ''),
+            'accept': req.headers.get('Accept', ''),
+            'accept_encoding': req.headers.get('Accept-Encoding', ''),
+            'accept_language': req.headers.get('Accept-Language', ''),
+            'connection': req.headers.get('Connection', ''),
+            'x_forwarded_for': req.headers.get('X-Forwarded-For', ''),
+            'x_real_ip': req.headers.get('X-Real-IP', ''),
+            'x_forwarded_proto': req.headers.get('X-Forwarded-Proto', ''),
+        },
+        'request_headers': parsed.headers,
+        'request_form_data': parsed.form,
+        # Giữ nguyên bytes: MongoDB lưu dạng binary, API / SQLite decode khi serialize
+        'request_raw_data': parsed.raw,
+        'request_json': parsed.json,
+        'request_args': dict(req.args),
+        'request_files': parsed.files,
+        'webhook_type': 'unknown',
+        'processed_data': {}
+    }
+    if parsed.blobs:
+        # Field bị cắt: kích thước thật và blob chứa bản đầy đủ
+        document['request_blobs'] = parsed.blobs
+    blob_keys = extract_blob_keys(document)
+    if blob_keys:
+        # Mảng có index: tra tenant sở hữu blob (/blobs/<key>) và blob còn được tham chiếu
+        document['blob_keys'] = blob_keys
+    if ingest_id is not None:
+        # _id vẫn được gán lúc ghi (change feed đọc theo thứ tự _id), ingest_id chỉ để bỏ qua bản ghi lại
+        document['ingest_id'] = ingest_id
+    return document
+
+
+def capture_request(req):
+    """Đóng gói request đã parse để front end đưa vào queue mà không dựng document"""
+    return pickle.dumps({
+        # Khóa idempotency gán ngay khi nhận: worker thử lại batch không tạo bản trùng
+        'ingest_id': ObjectId(),
+        'received_at': datetime.now(),
+        'method': req.method,
+        'url': req.url,
+        'remote_addr': req.remote_addr,
+        'headers': list(req.headers.items()),
+        'parsed': parse_request(req).state(),
+    }, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def restore_request(payload):
+    """Dựng lại werkzeug Request từ payload của capture_request, trả về (request, received_at, ingest_id)"""
+    raw = pickle.loads(payload)
+    ingest_id = raw.get('ingest_id')
+    if ingest_id is None:
+        # Payload cũ chưa có ingest_id: dựng từ thời điểm nhận + hash payload để lần thử lại cho cùng giá trị
+        digest = hashlib.blake2b(payload, digest_size=8).digest()
+        ingest_id = ObjectId(int(raw['received_at'].timestamp()).to_bytes(4, 'big') + digest)
+    url = urlsplit(raw['url'])
+    headers = [(key, value) for key, value in raw['headers'] if key.lower() != 'content-length']
+    builder = EnvironBuilder(
+        path=url.path,
+        base_url=f'{url.scheme}://{url.netloc}',
+        query_string=url.query,
+        method=raw['method'],
+        headers=headers,
+        # Payload cũ (trước khi parse ở front end) mang body thô
+        data=raw.get('body', b''),
+        environ_base={'REMOTE_ADDR': raw['remote_addr'] or ''},
+    )
+    try:
+        environ = builder.get_environ()
+    finally:
+        builder.close()
+    if 'parsed' in raw:
+        environ[PARSED_REQUEST_KEY] = ParsedRequest.restore(raw['parsed'])
+    return Request(environ), raw['received_at'], ingest_id
+
+
+def partition_key(req):
+    """
+    Khóa phân vùng của webhook: địa chỉ người nhận (chữ thường) để mọi webhook của
+    một người nhận đi vào cùng một worker theo đúng thứ tự nhận
+    """
+    parsed = parse_request(req)
+    recipient = parsed.form.get('recipient') or parsed.form.get('To') or parsed.form.get('to') or ''
+    if not recipient:
+        event_data = parsed.form.get('event-data')
+        if event_data is None and isinstance(parsed.json, dict):
+            event_data = parsed.json.get('event-data')
+        if isinstance(event_data, str):
+            try:
+                event_data = json.loads(event_data)
+            except ValueError:
+                event_data = None
+        if isinstance(event_data, dict):
+            recipient = event_data.get('recipient') or ''
+    return recipient.strip().lower()
+
+
+def partition_for(key, partitions):
+    """Số partition ổn định (không phụ thuộc PYTHONHASHSEED) cho một khóa"""
+    digest = hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % partitions
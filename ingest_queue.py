@@ -0,0 +1,82 @@
+"""
+Hàng đợi ingest cục bộ không cần broker: mỗi partition là một file SQLite (spool) trên đĩa,
+front end ghi vào, đúng một worker process đọc theo thứ tự
+"""
+
+import os
+import sqlite3
+import threading
+
+from ingest import partition_for
+
+
+class SpoolQueue:
+    """
+    Queue FIFO bền vững trên một file SQLite (WAL), an toàn giữa nhiều process.
+    fsync=True: mỗi put chỉ trả về sau khi WAL đã fsync (synchronous=FULL), không mất khi mất điện;
+    mặc định (NORMAL) chỉ an toàn khi process crash.
+    """
+
+    def __init__(self, path, fsync=False):
+        self.path = path
+        self.fsync = fsync
+        self._local = threading.local()
+        self._connect().execute(
+            'CREATE TABLE IF NOT EXISTS spool (id INTEGER PRIMARY KEY AUTOINCREMENT, payload BLOB NOT NULL)'
+        )
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(f"PRAGMA synchronous={'FULL' if self.fsync else 'NORMAL'}")
+            self._local.conn = conn
+        return conn
+
+    def put(self, payload):
+        self._connect().execute('INSERT INTO spool (payload) VALUES (?)', (payload,))
+
+    def put_many(self, payloads):
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany('INSERT INTO spool (payload) VALUES (?)', [(payload,) for payload in payloads])
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def get_batch(self, limit):
+        """Tối đa `limit` phần tử cũ nhất [(id, payload)], chưa xóa cho tới khi ack"""
+        return self._connect().execute(
+            'SELECT id, payload FROM spool ORDER BY id LIMIT ?', (limit,)
+        ).fetchall()
+
+    def ack(self, last_id):
+        """Xóa các phần tử đã xử lý (id <= last_id)"""
+        self._connect().execute('DELETE FROM spool WHERE id <= ?', (last_id,))
+
+    def size(self):
+        return self._connect().execute('SELECT COUNT(*) FROM spool').fetchone()[0]
+
+
+class PartitionedSpool:
+    """Tập `partitions` SpoolQueue trong một thư mục: spool-0.db ... spool-(N-1).db"""
+
+    def __init__(self, directory, partitions, fsync=False):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.partitions = partitions
+        self.queues = [
+            SpoolQueue(os.path.join(directory, f'spool-{index}.db'), fsync=fsync) for index in range(partitions)
+        ]
+
+    def put(self, key, payload):
+        """Đưa payload vào partition theo hash của key, trả về số partition"""
+        index = partition_for(key, self.partitions)
+        self.queues[index].put(payload)
+        return index
+
+    def sizes(self):
+        return [spool.size() for spool in self.queues]
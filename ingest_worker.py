@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Worker process xử lý webhook từ hàng đợi ingest (INGEST_MODE=queue)
+
+Front end (app.py) chỉ parse request và ghi payload đã parse vào spool theo hash người nhận;
+mỗi worker sở hữu một partition, dựng document, phân loại, trích xuất và ghi theo batch.
+
+Cách chạy:
+    INGEST_MODE=queue INGEST_PARTITIONS=4 gunicorn -w 4 -b 0.0.0.0:5000 app:app
+    INGEST_PARTITIONS=4 python ingest_worker.py
+"""
+
+import argparse
+import itertools
+import logging
+import multiprocessing
+import os
+import signal
+import time
+
+from dotenv import load_dotenv
+
+from delivery import DeliveryAggregator
+from durability import DurabilityPolicy
+from fanout import create_outbound_dispatcher
+from ingest import build_webhook_document, fit_document, restore_request
+from ingest_queue import SpoolQueue
+from lifecycle import flush_logs
+from otp_extractor import OTPExtractor
+from processors import create_dispatcher
+from services import open_storage
+from settings import Settings
+from subject_categories import SubjectCategorizer
+from tenants import TenantRegistry
+
+logger = logging.getLogger(__name__)
+
+
+class IngestWorker:
+    """Xử lý tuần tự một partition của spool: đọc batch, dựng document, insert_many, ack theo từng đoạn đã ghi"""
+
+    def __init__(self, spool, storage, dispatcher, batch_size=200, poll_interval=0.05, outbound_dispatcher=None,
+                 max_document_bytes=15 * 1024 * 1024, durability=None, tenants=None):
+        self.spool = spool
+        self.storage = storage
+        self.dispatcher = dispatcher
+        self.outbound_dispatcher = outbound_dispatcher
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_document_bytes = max_document_bytes
+        self.durability = durability or DurabilityPolicy()
+        self.tenants = tenants or TenantRegistry()
+
+    def process_batch(self):
+        """Xử lý một batch, trả về số webhook đã ghi (0 nếu queue rỗng)"""
+        items = self.spool.get_batch(self.batch_size)
+        if not items:
+            return 0
+        processed = []
+        for item_id, payload in items:
+            try:
+                req, received_at, ingest_id = restore_request(payload)
+                document = build_webhook_document(req, received_at=received_at, ingest_id=ingest_id)
+                processor = self.dispatcher.classify(document)
+                document['webhook_type'] = processor.webhook_type
+                processor.enrich(document)
+                document['tenant'] = self.tenants.tenant_for_document(document)
+                fit_document(document, self.max_document_bytes)
+            except Exception as e:
+                # Payload lỗi không được chặn cả partition
+                logger.error(f"[ERROR] Cannot process spool item {item_id}: {e}")
+                continue
+            processed.append((item_id, document, processor))
+        # Ghi theo từng đoạn liên tiếp cùng profile độ bền để giữ thứ tự nhận trong partition;
+        # ack ngay sau mỗi đoạn nên lỗi ở đoạn sau chỉ thử lại từ đoạn đó. Webhook đã ghi ở lần trước
+        # (cùng ingest_id) bị bỏ qua, nên không fan-out / cộng bộ đếm giao nhận lần nữa
+        for durability, group in itertools.groupby(processed, key=lambda entry: self.durability.flush_profile(entry[1])):
+            group = list(group)
+            inserted = set(self.storage.insert_many([document for _, document, _ in group], durability=durability))
+            for _, document, processor in group:
+                if str(document['_id']) in inserted:
+                    self.dispatcher.after_store(processor, document)
+            self.spool.ack(group[-1][0])
+        if not processed or processed[-1][0] != items[-1][0]:
+            self.spool.ack(items[-1][0])
+        return len(processed)
+
+    def run(self, stop):
+        """Vòng lặp tới khi stop được set; lỗi ghi database thì chờ rồi thử lại batch đó"""
+        backoff = self.poll_interval
+        while not stop.is_set():
+            try:
+                processed = self.process_batch()
+                backoff = self.poll_interval
+            except Exception as e:
+                logger.error(f"[ERROR] Ingest worker error: {e}")
+                backoff = min(backoff * 2, 5)
+                stop.wait(backoff)
+                continue
+            if not processed:
+                stop.wait(self.poll_interval)
+
+    def shutdown(self):
+        self.dispatcher.shutdown()
+        if self.outbound_dispatcher is not None:
+            self.outbound_dispatcher.shutdown(timeout=10)
+
+
+def build_worker(index, spool_dir, batch_size):
+    """Tạo storage, dispatcher và spool riêng cho một worker process (không chia sẻ gì với process khác)"""
+    settings = Settings.from_env(load_env=False)
+    storage = open_storage(settings)
+    if storage is None:
+        raise RuntimeError('Không thể kết nối database')
+    # Cùng pipeline sau khi lưu như chế độ inline của app.py
+    dispatcher = create_dispatcher(
+        storage, otp_extractor=OTPExtractor.from_settings(settings), subject_categorizer=SubjectCategorizer.from_settings(settings)
+    )
+    dispatcher.add_listener('email_event', DeliveryAggregator(storage).apply)
+    outbound_dispatcher = create_outbound_dispatcher(storage, settings)
+    dispatcher.add_listener('*', outbound_dispatcher.publish)
+    spool = SpoolQueue(os.path.join(spool_dir, f'spool-{index}.db'))
+    return IngestWorker(
+        spool, storage, dispatcher, batch_size=batch_size, outbound_dispatcher=outbound_dispatcher,
+        max_document_bytes=settings.max_document_bytes, durability=settings.durability_policy(),
+        tenants=TenantRegistry.from_settings(settings),
+    )
+
+
+def _worker_main(index, spool_dir, batch_size, stop):
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format=f'%(asctime)s - worker-{index} - %(levelname)s - %(message)s')
+    # Process cha xử lý Ctrl+C / SIGTERM và set stop; worker ghi xong batch đang xử lý rồi mới thoát
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    worker = build_worker(index, spool_dir, batch_size)
+    logger.info(f"Ingest worker {index} started ({spool_dir}/spool-{index}.db)")
+    worker.run(stop)
+    worker.shutdown()
+    logger.info(f"Ingest worker {index} stopped")
+    flush_logs()
+
+
+def start_workers(partitions, spool_dir, batch_size=200):
+    """Khởi động một process cho mỗi partition, trả về (processes, stop_event)"""
+    context = multiprocessing.get_context('spawn')
+    stop = context.Event()
+    processes = []
+    for index in range(partitions):
+        process = context.Process(
+            target=_worker_main, args=(index, spool_dir, batch_size, stop), name=f'ingest-worker-{index}'
+        )
+        process.start()
+        processes.append(process)
+    return processes, stop
+
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def main():
+    settings = Settings.from_env()
+    parser = argparse.ArgumentParser(description='Worker process cho hàng đợi ingest')
+    parser.add_argument('--partitions', type=int, default=settings.ingest_partitions,
+                        help='Số partition / worker process (phải bằng INGEST_PARTITIONS của front end)')
+    parser.add_argument('--spool-dir', default=settings.ingest_spool_dir)
+    parser.add_argument('--batch-size', type=int, default=settings.ingest_batch_size)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    # SIGTERM (systemd, docker stop) dừng giống Ctrl+C
+    signal.signal(signal.SIGTERM, _interrupt)
+
+    processes, stop = start_workers(args.partitions, args.spool_dir, args.batch_size)
+    print(f"[SUCCESS] Đã khởi động {len(processes)} ingest worker ({args.spool_dir})")
+    try:
+        while all(process.is_alive() for process in processes):
+            time.sleep(1)
+        print("[ERROR] Một worker đã dừng bất thường, dừng toàn bộ")
+    except KeyboardInterrupt:
+        print("[WARNING] Đang dừng các worker...")
+    finally:
+        stop.set()
+        for process in processes:
+            process.join(timeout=30)
+
+
+if __name__ == '__main__':
+    main()
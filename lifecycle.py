@@ -0,0 +1,143 @@
+"""
+Vòng đời worker: readiness, drain khi tắt và giới hạn bộ nhớ
+
+Tắt worker (SIGTERM khi deploy, xem gunicorn.conf.py):
+1. GET /ready trả 503 ngay lập tức nhưng worker vẫn nhận request thêm DRAIN_DELAY giây,
+   để load balancer kịp ngừng route tới trước khi socket đóng
+2. Ngừng nhận kết nối mới, chờ request đang xử lý xong (tối đa GRACEFUL_TIMEOUT của gunicorn)
+3. Dừng dispatcher / fan-out sau khi gửi nốt job trong hàng đợi, rồi flush log
+
+MemoryWatchdog đo RSS của worker; vượt WORKER_MAX_RSS_MB thì worker được thay thế sau khi xử lý
+xong request hiện tại (không đổi readiness: các worker khác vẫn phục vụ).
+"""
+
+import logging
+import os
+import resource
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+LIFECYCLE_KEY = 'lifecycle'
+
+
+def rss_bytes():
+    """RSS hiện tại của process (Linux: /proc/self/statm), ngược lại RSS lớn nhất từng dùng"""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def flush_logs():
+    """Flush mọi handler của root logger (file log không mất dòng cuối khi process thoát)"""
+    for handler in logging.getLogger().handlers:
+        try:
+            handler.flush()
+        except Exception:
+            pass
+
+
+class Lifecycle:
+    """Trạng thái drain và số request đang xử lý của một worker process"""
+
+    def __init__(self):
+        self._draining = threading.Event()
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self.reason = None
+        self.drain_started = None
+
+    @property
+    def draining(self):
+        return self._draining.is_set()
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    def begin_drain(self, reason='shutdown'):
+        """Đánh dấu worker đang tắt (/ready trả 503); True nếu đây là lần gọi đầu tiên"""
+        with self._lock:
+            if self._draining.is_set():
+                return False
+            self.reason, self.drain_started = reason, time.time()
+            self._draining.set()
+        logger.warning(f"[WARNING] Worker {os.getpid()} draining ({reason}), {self._in_flight} requests in flight")
+        return True
+
+    def request_started(self):
+        with self._lock:
+            self._in_flight += 1
+
+    def request_finished(self):
+        with self._lock:
+            self._in_flight = max(self._in_flight - 1, 0)
+
+    def wait_idle(self, timeout):
+        """Chờ tới khi không còn request đang xử lý; False nếu hết timeout"""
+        deadline = time.monotonic() + timeout
+        while self._in_flight and time.monotonic() < deadline:
+            time.sleep(0.05)
+        return not self._in_flight
+
+    def status(self):
+        return {
+            'pid': os.getpid(),
+            'draining': self.draining,
+            'reason': self.reason,
+            'in_flight': self._in_flight,
+            'rss_mb': round(rss_bytes() / (1024 * 1024), 1),
+        }
+
+
+class MemoryWatchdog:
+    """Thread nền kiểm tra RSS mỗi `interval` giây, gọi on_exceeded(rss) một lần khi vượt limit"""
+
+    def __init__(self, limit_bytes, on_exceeded, interval=10):
+        self.limit_bytes = limit_bytes
+        self.on_exceeded = on_exceeded
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if not self.limit_bytes or self._thread is not None:
+            return False
+        self._thread = threading.Thread(target=self._run, name='memory-watchdog', daemon=True)
+        self._thread.start()
+        return True
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            rss = rss_bytes()
+            if rss > self.limit_bytes:
+                logger.warning(f"[WARNING] Worker {os.getpid()} RSS {rss / (1024 * 1024):.0f} MB vượt giới hạn "
+                               f"{self.limit_bytes / (1024 * 1024):.0f} MB, thay worker sau request hiện tại")
+                self.on_exceeded(rss)
+                return
+
+    def stop(self):
+        self._stop.set()
+
+
+def shutdown_app(app, timeout=10):
+    """
+    Drain và dừng thành phần nền của app trong process hiện tại: chờ request đang xử lý,
+    gửi nốt job của dispatcher / fan-out, dừng profiler, flush log
+    """
+    lifecycle = app.extensions[LIFECYCLE_KEY]
+    lifecycle.begin_drain()
+    deadline = time.monotonic() + timeout
+    if not lifecycle.wait_idle(timeout):
+        logger.warning(f"[WARNING] {lifecycle.in_flight} requests còn dang dở khi tắt worker {os.getpid()}")
+    profiler = app.extensions.get('cpu_profiler')
+    if profiler is not None and profiler.running:
+        profiler.stop()
+    app.extensions['webhook_services'].shutdown(timeout=max(deadline - time.monotonic(), 1))
+    logger.info(f"[SUCCESS] Worker {os.getpid()} shut down")
+    flush_logs()
@@ -0,0 +1,435 @@
+"""
+Client Python cho Mailgun Webhook API
+
+- Session dùng chung (keep-alive, connection pool) thay cho requests.get/post rời rạc
+- Tự phân trang: skip cho /webhooks và /emails/search?to=, cursor cho full-text search
+- Conditional GET (If-None-Match) cho inbox / mã xác minh: poll không đổi chỉ tốn một 304
+- wait_for_email / wait_for_code: poll với backoff thích ứng tới khi có email mới
+- AsyncWebhookClient: cùng API cho asyncio (request chạy trong thread pool, chờ bằng asyncio.sleep)
+
+Ví dụ:
+    client = WebhookClient('http://localhost:5000')
+    email = client.wait_for_email('user@example.com', subject='verification code', timeout=60)
+"""
+
+import asyncio
+import functools
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from urllib.parse import quote
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_BASE_URL = 'http://localhost:5000'
+
+
+class WebhookAPIError(Exception):
+    """Response lỗi từ API (status code và message của server)"""
+
+    def __init__(self, status_code, message):
+        super().__init__(f'{status_code}: {message}')
+        self.status_code = status_code
+        self.message = message
+
+
+class WaitState:
+    """Trạng thái của một lần chờ email: ETag đã thấy, các email có sẵn cần bỏ qua, khoảng poll hiện tại"""
+
+    def __init__(self, recipient, subject, since, poll_interval, max_interval):
+        self.recipient = recipient
+        self.subject = (subject or '').lower()
+        self.since = since
+        self.interval = poll_interval
+        self.poll_interval = poll_interval
+        self.max_interval = max_interval
+        self.etag = None
+        # Không có since: chỉ nhận email đến sau khi bắt đầu chờ (tránh lệch giờ client / server)
+        self.seen_ids = None if since is not None else set()
+        self.first = True
+
+    def backoff(self):
+        """Khoảng chờ tới lần poll tiếp theo, tăng dần khi inbox không thay đổi (có jitter)"""
+        delay = self.interval
+        self.interval = min(self.interval * 1.5, self.max_interval)
+        return delay * random.uniform(0.8, 1.0)
+
+    def reset(self):
+        """Inbox vừa thay đổi: poll lại nhanh vì email mong đợi thường đến ngay sau đó"""
+        self.interval = self.poll_interval
+
+
+def _parse_timestamp(value):
+    try:
+        return datetime.fromisoformat(value) if isinstance(value, str) else value
+    except ValueError:
+        return None
+
+
+class WebhookClient:
+    """Client đồng bộ, an toàn khi dùng chung giữa nhiều thread"""
+
+    def __init__(self, base_url=None, timeout=10, pool_size=10, session=None, api_key=None, conditional_cache_size=256):
+        self.base_url = (base_url or os.getenv('WEBHOOK_API_URL', DEFAULT_BASE_URL)).rstrip('/')
+        self.timeout = timeout
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        self.session = session
+        # API key của tenant: mọi request đọc chỉ thấy dữ liệu của tenant đó
+        api_key = api_key or os.getenv('WEBHOOK_API_KEY')
+        if api_key:
+            self.session.headers['X-API-Key'] = api_key
+        # URL -> (etag, kết quả) của các GET có điều kiện, LRU tối đa conditional_cache_size URL
+        # (poll nhiều inbox / email khác nhau không làm cache lớn mãi)
+        self.conditional_cache_size = conditional_cache_size
+        self._conditional = OrderedDict()
+        self._conditional_lock = threading.Lock()
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # ---- HTTP ----
+
+    def _request(self, method, path, expected=(200,), **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        response = self.session.request(method, self.base_url + path, **kwargs)
+        if response.status_code not in expected:
+            try:
+                message = response.json().get('message', response.text)
+            except ValueError:
+                message = response.text[:200]
+            raise WebhookAPIError(response.status_code, message)
+        return response
+
+    def _get_json(self, path, params=None, not_found=False):
+        """GET trả về JSON; not_found=True thì 404 trả về None thay vì raise"""
+        expected = (200, 404) if not_found else (200,)
+        response = self._request('GET', path, expected=expected, params=params)
+        return None if response.status_code == 404 else response.json()
+
+    def _get_conditional(self, path, params, parse):
+        """
+        GET có If-None-Match: 304 trả lại kết quả đã cache của URL đó.
+        Trả về (kết quả, changed); 404 cho kết quả None.
+        """
+        key = (path, tuple(sorted((params or {}).items())))
+        with self._conditional_lock:
+            cached = self._conditional.get(key)
+            if cached:
+                self._conditional.move_to_end(key)
+        headers = {'If-None-Match': cached[0]} if cached else {}
+        response = self._request('GET', path, expected=(200, 304, 404), params=params, headers=headers)
+        if response.status_code == 304:
+            return cached[1], False
+        result = parse(response) if response.status_code == 200 else None
+        etag = response.headers.get('ETag')
+        with self._conditional_lock:
+            if etag:
+                self._conditional[key] = (etag, result)
+                self._conditional.move_to_end(key)
+                while len(self._conditional) > self.conditional_cache_size:
+                    self._conditional.popitem(last=False)
+            else:
+                self._conditional.pop(key, None)
+        return result, True
+
+    # ---- Webhooks ----
+
+    def health(self):
+        # 503: database mất kết nối, body vẫn là JSON trạng thái
+        return self._request('GET', '/health', expected=(200, 503)).json()
+
+    def list_webhooks(self, limit=50, skip=0, fields=None, since=None, until=None, max_body_bytes=None):
+        params = {'limit': limit, 'skip': skip}
+        if fields:
+            params['fields'] = ','.join(fields)
+        if since:
+            params['since'] = since.isoformat()
+        if until:
+            params['until'] = until.isoformat()
+        if max_body_bytes is not None:
+            params['max_body_bytes'] = max_body_bytes
+        return self._get_json('/webhooks', params)['webhooks']
+
+    def iter_webhooks(self, page_size=100, limit=None, **filters):
+        """Duyệt toàn bộ webhooks (mới nhất trước), tự lấy trang tiếp theo"""
+        yield from self._paginate(functools.partial(self.list_webhooks, **filters), page_size, limit)
+
+    def changes(self, since=None, limit=100, wait=0, max_body_bytes=None):
+        """
+        Một batch của change feed: (changes, next_token, has_more).
+        since=None đọc từ đầu, 'now' chỉ lấy webhook mới; wait > 0 giữ request tới khi có thay đổi.
+        """
+        params = {'since': since or '', 'limit': limit, 'wait': wait}
+        if max_body_bytes is not None:
+            params['max_body_bytes'] = max_body_bytes
+        data = self._request('GET', '/changes', params=params, timeout=self.timeout + wait).json()
+        return data['changes'], data['next_token'], data['has_more']
+
+    def get_webhook(self, webhook_id, fields=None):
+        params = {'fields': ','.join(fields)} if fields else None
+        data = self._get_json(f'/webhook/{quote(str(webhook_id))}', params, not_found=True)
+        return data and data['webhook']
+
+    # ---- Emails ----
+
+    def search_emails(self, to, limit=50, skip=0):
+        return self._get_json('/emails/search', {'to': to, 'limit': limit, 'skip': skip})['emails']
+
+    def iter_emails(self, to, page_size=50, limit=None):
+        """Duyệt emails của một người nhận (mới nhất trước)"""
+        yield from self._paginate(functools.partial(self.search_emails, to), page_size, limit)
+
+    def search_text(self, query, limit=20, cursor=None):
+        """Một trang full-text search, trả về (results, next_cursor)"""
+        params = {'q': query, 'limit': limit}
+        if cursor:
+            params['cursor'] = cursor
+        data = self._get_json('/emails/search', params)
+        return data['results'], data.get('next_cursor')
+
+    def iter_search(self, query, page_size=20, limit=None):
+        """Duyệt kết quả full-text search theo cursor"""
+        cursor, count = None, 0
+        while True:
+            results, cursor = self.search_text(query, limit=page_size, cursor=cursor)
+            for result in results:
+                if limit is not None and count >= limit:
+                    return
+                yield result
+                count += 1
+            if not cursor or not results:
+                return
+
+    def get_email(self, email_id, fields=None):
+        params = {'fields': ','.join(fields)} if fields else None
+        data = self._get_json(f'/emails/{quote(str(email_id))}', params, not_found=True)
+        return data and data['email']
+
+    def get_email_html(self, email_id):
+        """HTML gốc của email {'html_content', 'stripped_html', ...} hoặc None"""
+        return self._get_json(f'/emails/{quote(str(email_id))}/html', not_found=True)
+
+    def render_email(self, email_id, variant='safe'):
+        """Nội dung email đã render (safe | text | preview), xem lại cùng email chỉ tốn một 304"""
+        content, _ = self._get_conditional(f'/emails/{quote(str(email_id))}/html', {'variant': variant},
+                                           lambda response: response.json()['content'])
+        return content
+
+    def inbox_html(self, recipient, subject='verification code', limit=10, variant=None, category=None):
+        """
+        HTML các email trong inbox (None nếu chưa có), hoặc variant đã render (safe | text | preview);
+        poll lặp lại chỉ tốn 304 khi inbox không đổi. `category` (otp, password-reset, ...) thay cho
+        regex subject: tra index, nhanh hơn
+        """
+        params = {'category': category} if category else {'subject': subject}
+        params['limit'] = limit
+        if variant:
+            params['variant'] = variant
+        html, _ = self._get_conditional(f'/emails/inbox/{quote(recipient, safe="@")}', params,
+                                        lambda response: response.text)
+        return html
+
+    def inbox_batch(self, recipients, subject=None, since=None, limit=5, html=False, category=None):
+        """Inbox của nhiều người nhận trong một request: {address: [email, ...]}"""
+        payload = {'recipients': list(recipients), 'limit': limit, 'html': html}
+        if subject:
+            payload['subject'] = subject
+        if category:
+            payload['category'] = category
+        if since:
+            payload['since'] = since.isoformat()
+        return self._request('POST', '/emails/inbox/batch', json=payload).json()['results']
+
+    def latest_code(self, recipient, max_age=None):
+        """Mã xác minh mới nhất {'code', 'link', 'email_id', 'timestamp'} hoặc None"""
+        path = f'/emails/inbox/{quote(recipient, safe="@")}/code'
+        if max_age is not None:
+            return self._get_json(path, {'max_age': int(max_age)}, not_found=True)
+        code, _ = self._get_conditional(path, None, lambda response: response.json())
+        return code
+
+    # ---- Thống kê / giao nhận / subscriptions ----
+
+    def stats(self):
+        return self._get_json('/stats')
+
+    def message(self, message_id):
+        return self._get_json(f'/messages/{quote(message_id, safe="@")}', not_found=True)
+
+    def domain_stats(self, hours=24, domain=None, buckets=False):
+        params = {'hours': hours, 'buckets': '1' if buckets else '0'}
+        if domain:
+            params['domain'] = domain
+        return self._get_json('/stats/domains', params)
+
+    def tenant_stats(self):
+        return self._get_json('/stats/tenants')
+
+    def subscribe(self, **subscription):
+        return self._request('POST', '/subscriptions', expected=(201,), json=subscription).json()['subscription']
+
+    def subscriptions(self):
+        return self._get_json('/subscriptions')['subscriptions']
+
+    def unsubscribe(self, subscription_id):
+        response = self._request('DELETE', f'/subscriptions/{quote(subscription_id)}', expected=(200, 404))
+        return response.status_code == 200
+
+    def dead_letters(self, subscription_id, limit=50):
+        return self._get_json(f'/subscriptions/{quote(subscription_id)}/dead-letters', {'limit': limit})['dead_letters']
+
+    # ---- Chờ email ----
+
+    def _poll_new_email(self, state):
+        """
+        Một lần poll của wait_for_email: trả về email khớp hoặc None.
+
+        Kiểm tra thay đổi bằng GET có điều kiện trên inbox (304 khi không có gì mới),
+        chỉ khi inbox thay đổi mới tìm email khớp subject qua /emails/search.
+        """
+        path = f'/emails/inbox/{quote(state.recipient, safe="@")}'
+        headers = {'If-None-Match': state.etag} if state.etag else {}
+        response = self._request('GET', path, expected=(200, 304, 404),
+                                 params={'subject': '', 'limit': 1}, headers=headers)
+        if response.status_code == 304:
+            return None
+        state.etag = response.headers.get('ETag')
+
+        candidates = []
+        for email in self.search_emails(state.recipient, limit=20):
+            email_data = email.get('processed_data', {}).get('email_data', {})
+            if state.subject and state.subject not in (email_data.get('subject') or '').lower():
+                continue
+            if state.seen_ids is not None:
+                if state.first:
+                    state.seen_ids.add(email['_id'])
+                    continue
+                if email['_id'] in state.seen_ids:
+                    continue
+            else:
+                timestamp = _parse_timestamp(email.get('timestamp'))
+                if timestamp is None or timestamp < state.since:
+                    continue
+            candidates.append(email)
+        state.first = False
+        if not candidates:
+            state.reset()
+            return None
+        # Kết quả sắp xếp mới nhất trước: trả về email khớp đến sớm nhất
+        return self.get_email(candidates[-1]['_id'])
+
+    def wait_for_email(self, recipient, subject=None, timeout=60, since=None, poll_interval=0.5, max_interval=5):
+        """
+        Chờ tới khi có inbound email tới `recipient` với subject chứa `subject` (không phân biệt hoa thường).
+
+        since=None chỉ nhận email đến sau khi bắt đầu chờ; truyền datetime (giờ của server)
+        để nhận cả email đã đến từ thời điểm đó. Hết `timeout` giây thì raise TimeoutError.
+        """
+        state = WaitState(recipient.strip().lower(), subject, since, poll_interval, max_interval)
+        deadline = time.monotonic() + timeout
+        while True:
+            email = self._poll_new_email(state)
+            if email is not None:
+                return email
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f'Không nhận được email cho {recipient} sau {timeout} giây')
+            time.sleep(min(state.backoff(), remaining))
+
+    def wait_for_code(self, recipient, subject=None, timeout=60, **kwargs):
+        """Chờ email mới rồi trả về mã xác minh đã trích xuất {'code', 'link'} của email đó"""
+        email = self.wait_for_email(recipient, subject=subject, timeout=timeout, **kwargs)
+        return email.get('otp') or {}
+
+    @staticmethod
+    def _paginate(fetch, page_size, limit):
+        skip = 0
+        while True:
+            size = page_size if limit is None else min(page_size, limit - skip)
+            if size <= 0:
+                return
+            page = fetch(limit=size, skip=skip)
+            yield from page
+            if len(page) < size:
+                return
+            skip += len(page)
+
+
+class AsyncWebhookClient:
+    """
+    Phiên bản asyncio của WebhookClient với cùng tên method (dùng `await`).
+
+    Request chạy trên thread pool qua session dùng chung của một WebhookClient nên không
+    cần thêm thư viện HTTP async; khi chờ email, khoảng nghỉ giữa các lần poll dùng
+    asyncio.sleep và không giữ thread nào.
+    """
+
+    def __init__(self, base_url=None, timeout=10, pool_size=10, client=None):
+        self.client = client or WebhookClient(base_url, timeout=timeout, pool_size=pool_size)
+
+    def __getattr__(self, name):
+        method = getattr(self.client, name)
+        if not callable(method) or name.startswith('_'):
+            return method
+
+        @functools.wraps(method)
+        async def call(*args, **kwargs):
+            return await asyncio.to_thread(method, *args, **kwargs)
+        return call
+
+    async def close(self):
+        await asyncio.to_thread(self.client.close)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def _iterate(self, iterator):
+        """Chuyển generator phân trang đồng bộ thành async generator"""
+        sentinel = object()
+        while True:
+            item = await asyncio.to_thread(next, iterator, sentinel)
+            if item is sentinel:
+                return
+            yield item
+
+    def iter_webhooks(self, page_size=100, limit=None, **filters):
+        return self._iterate(self.client.iter_webhooks(page_size, limit, **filters))
+
+    def iter_emails(self, to, page_size=50, limit=None):
+        return self._iterate(self.client.iter_emails(to, page_size, limit))
+
+    def iter_search(self, query, page_size=20, limit=None):
+        return self._iterate(self.client.iter_search(query, page_size, limit))
+
+    async def wait_for_email(self, recipient, subject=None, timeout=60, since=None, poll_interval=0.5, max_interval=5):
+        state = WaitState(recipient.strip().lower(), subject, since, poll_interval, max_interval)
+        deadline = time.monotonic() + timeout
+        while True:
+            email = await asyncio.to_thread(self.client._poll_new_email, state)
+            if email is not None:
+                return email
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f'Không nhận được email cho {recipient} sau {timeout} giây')
+            await asyncio.sleep(min(state.backoff(), remaining))
+
+    async def wait_for_code(self, recipient, subject=None, timeout=60, **kwargs):
+        email = await self.wait_for_email(recipient, subject=subject, timeout=timeout, **kwargs)
+        return email.get('otp') or {}
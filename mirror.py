@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Mirror webhooks từ API vào một file SQLite cục bộ qua change feed (/changes)
+
+Bản sao dùng đúng schema của SQLiteWebhookStorage nên có thể chạy API đọc trên nó
+(STORAGE_BACKEND=sqlite SQLITE_PATH=mirror.db). Mỗi batch được ghi trong một transaction;
+token tiếp tục là _id lớn nhất đã mirror (tra qua PRIMARY KEY), nên dừng / chạy lại bất kỳ
+lúc nào cũng không mất hoặc lặp webhook, và chi phí mỗi thay đổi không phụ thuộc kích thước bản sao.
+
+Cách chạy:
+    python mirror.py --db mirror.db --url http://localhost:5000
+    python mirror.py --db mirror.db --once      # đồng bộ tới hiện tại rồi thoát
+"""
+
+import argparse
+import time
+from datetime import datetime
+
+from bson import ObjectId
+
+from mailgun_client import WebhookClient
+from storage import SQLiteWebhookStorage
+
+
+def to_document(change):
+    """Chuyển document JSON của API về kiểu gốc (_id ObjectId, timestamp datetime) trước khi ghi"""
+    change['_id'] = ObjectId(change['_id'])
+    if isinstance(change.get('timestamp'), str):
+        change['timestamp'] = datetime.fromisoformat(change['timestamp'])
+    return change
+
+
+def sync(client, storage, batch_size=500, wait=25, once=False):
+    """Vòng lặp đồng bộ; trả về số webhook đã mirror khi once=True"""
+    token = storage.newest_id()
+    mirrored = 0
+    backoff = 1
+    print(f"[SUCCESS] Bắt đầu mirror từ token {token or '(đầu)'}")
+    while True:
+        try:
+            changes, token_after, has_more = client.changes(
+                since=token, limit=batch_size, wait=0 if once else wait
+            )
+            backoff = 1
+        except Exception as e:
+            if once:
+                raise
+            print(f"[ERROR] Lỗi đọc change feed: {e}, thử lại sau {backoff}s")
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 60)
+            continue
+
+        if changes:
+            storage.insert_many([to_document(change) for change in changes])
+            token = token_after
+            mirrored += len(changes)
+            print(f"[STATS] +{len(changes)} webhooks (tổng {mirrored}), token {token}")
+        if once and not has_more:
+            return mirrored
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Mirror webhooks vào SQLite qua /changes')
+    parser.add_argument('--db', default='mirror.db', help='File SQLite của bản sao')
+    parser.add_argument('--url', default=None, help='Địa chỉ API (mặc định WEBHOOK_API_URL)')
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--wait', type=int, default=25, help='Số giây long-poll mỗi request')
+    parser.add_argument('--once', action='store_true', help='Đồng bộ tới hiện tại rồi thoát')
+    args = parser.parse_args()
+
+    storage = SQLiteWebhookStorage(args.db)
+    with WebhookClient(args.url) as client:
+        try:
+            mirrored = sync(client, storage, batch_size=args.batch_size, wait=args.wait, once=args.once)
+            print(f"[SUCCESS] Đã mirror {mirrored} webhooks vào {args.db}")
+        except KeyboardInterrupt:
+            print("[WARNING] Dừng mirror")
+
+
+if __name__ == '__main__':
+    main()
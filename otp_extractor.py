@@ -0,0 +1,145 @@
+"""
+Trích xuất mã xác minh (OTP) và link xác minh từ inbound email tại thời điểm ingest
+"""
+
+import html
+import json
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+# Chỉ quét phần đầu của HTML lớn, mã xác minh luôn nằm ở đầu email
+MAX_SCAN_CHARS = 200_000
+
+DEFAULT_PATTERNS = {
+    'code': [
+        # "Your verification code is 123456", "Mã xác minh: 123456", "OTP - 1234"
+        r'(?:code|otp|pin|passcode|verification|mã|xác minh|xác nhận|xác thực)\D{0,40}?(?P<code>\d{4,8})\b',
+        # "123456 is your verification code", "123456 là mã xác minh"
+        r'\b(?P<code>\d{4,8})\b(?=\s*(?:is your|is the|là mã|là otp))',
+        # Mã chữ + số dạng "ABC-123" / "G-123456"
+        r'(?:code|mã)\W{0,10}(?P<code>[A-Z]{1,4}-\d{3,8})\b',
+    ],
+    'link': [
+        r'https?://[^\s"\'<>]*(?:verify|verification|confirm|activate|activation|validate|magic|reset)[^\s"\'<>]*',
+    ],
+}
+
+_TAG_RE = re.compile(r'<(?:script|style)[^>]*>.*?</(?:script|style)>|<[^>]+>', re.IGNORECASE | re.DOTALL)
+_HREF_RE = re.compile(r'href\s*=\s*["\']([^"\']+)["\']', re.IGNORECASE)
+
+
+def html_to_text(body_html):
+    """Bỏ tag HTML để tìm mã trong nội dung hiển thị"""
+    return ' '.join(html.unescape(_TAG_RE.sub(' ', body_html)).split())
+
+
+class OTPExtractor:
+    """
+    Trích xuất OTP theo bộ pattern cấu hình cho từng sender / domain.
+
+    Thứ tự ưu tiên: pattern của sender > pattern của domain (kể cả domain cha) > default.
+    Pattern `code` dùng named group `code` (hoặc group 1, hoặc toàn bộ match).
+    """
+
+    def __init__(self, config=None):
+        config = config or {}
+        self.default = self._compile(config.get('default') or DEFAULT_PATTERNS)
+        self.senders = {
+            sender.lower(): self._compile(patterns)
+            for sender, patterns in (config.get('senders') or {}).items()
+        }
+        self.domains = {
+            domain.lower(): self._compile(patterns)
+            for domain, patterns in (config.get('domains') or {}).items()
+        }
+
+    @classmethod
+    def from_settings(cls, settings):
+        """Đọc cấu hình pattern từ file JSON OTP_PATTERNS_FILE (nếu có)"""
+        path = settings.otp_patterns_file
+        if not path:
+            return cls()
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                config = json.load(f)
+            logger.info(f"Đã tải OTP patterns từ {path}")
+            return cls(config)
+        except Exception as e:
+            logger.error(f"Lỗi đọc OTP patterns {path}: {e}, dùng pattern mặc định")
+            return cls()
+
+    def _compile(self, patterns):
+        return {
+            'code': [re.compile(p, re.IGNORECASE) for p in patterns.get('code', DEFAULT_PATTERNS['code'])],
+            'link': [re.compile(p, re.IGNORECASE) for p in patterns.get('link', DEFAULT_PATTERNS['link'])],
+        }
+
+    def patterns_for(self, sender):
+        """Chọn bộ pattern theo địa chỉ sender"""
+        sender = (sender or '').strip().lower()
+        if sender in self.senders:
+            return self.senders[sender]
+        domain = sender.rsplit('@', 1)[-1]
+        while domain:
+            if domain in self.domains:
+                return self.domains[domain]
+            if '.' not in domain:
+                break
+            domain = domain.split('.', 1)[1]
+        return self.default
+
+    def extract(self, sender='', subject='', text='', body_html=''):
+        """
+        Trích xuất mã và link xác minh. Trả về dict {'code', 'codes', 'link', 'source'}
+        hoặc None nếu không tìm thấy gì.
+        """
+        patterns = self.patterns_for(sender)
+        body_html = (body_html or '')[:MAX_SCAN_CHARS]
+        sources = [
+            ('subject', subject or ''),
+            ('text', (text or '')[:MAX_SCAN_CHARS]),
+            ('html', html_to_text(body_html) if body_html else ''),
+        ]
+
+        codes = []
+        code_source = None
+        for source, content in sources:
+            if not content:
+                continue
+            for pattern in patterns['code']:
+                for match in pattern.finditer(content):
+                    code = self._match_value(match)
+                    if code and code not in codes:
+                        codes.append(code)
+                        code_source = code_source or source
+            if codes:
+                break
+
+        links = []
+        candidates = _HREF_RE.findall(body_html) + [text or '']
+        for candidate in candidates:
+            for pattern in patterns['link']:
+                for match in pattern.finditer(html.unescape(candidate)):
+                    link = match.group(0)
+                    if link not in links:
+                        links.append(link)
+
+        if not codes and not links:
+            return None
+        return {
+            'code': codes[0] if codes else None,
+            'codes': codes[:5],
+            'link': links[0] if links else None,
+            'source': code_source,
+        }
+
+    @staticmethod
+    def _match_value(match):
+        groups = match.groupdict()
+        if groups.get('code'):
+            return groups['code']
+        if match.groups():
+            return match.group(1)
+        return match.group(0)
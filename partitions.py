@@ -0,0 +1,428 @@
+"""
+Chia webhooks thành các collection theo ngày / tuần của `timestamp` và router đọc trên nhiều partition
+"""
+
+import heapq
+import logging
+import re
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+from storage import MongoWebhookStorage, WebhookStorage, tenant_query, timestamp_range_query
+
+logger = logging.getLogger(__name__)
+
+_DAY_RE = re.compile(r'^(?P<prefix>.+)_(?P<year>\d{4})(?P<month>\d{2})(?P<day>\d{2})$')
+_WEEK_RE = re.compile(r'^(?P<prefix>.+)_(?P<year>\d{4})w(?P<week>\d{2})$')
+
+
+class PartitionScheme:
+    """Quy tắc đặt tên và khoảng thời gian [start, end) của một partition"""
+
+    def __init__(self, scheme, prefix='webhooks'):
+        if scheme not in ('day', 'week'):
+            raise ValueError(f'PARTITION_SCHEME không hợp lệ: {scheme}')
+        self.scheme = scheme
+        self.prefix = prefix
+
+    def name_for(self, timestamp):
+        if self.scheme == 'day':
+            return f'{self.prefix}_{timestamp:%Y%m%d}'
+        year, week, _ = timestamp.isocalendar()
+        return f'{self.prefix}_{year}w{week:02d}'
+
+    def bounds(self, name):
+        """Khoảng thời gian của partition theo tên, None nếu không phải partition của scheme này"""
+        if self.scheme == 'day':
+            match = _DAY_RE.match(name)
+            if not match or match.group('prefix') != self.prefix:
+                return None
+            start = datetime(int(match.group('year')), int(match.group('month')), int(match.group('day')))
+            return start, start + timedelta(days=1)
+        match = _WEEK_RE.match(name)
+        if not match or match.group('prefix') != self.prefix:
+            return None
+        start = datetime.fromisocalendar(int(match.group('year')), int(match.group('week')), 1)
+        return start, start + timedelta(weeks=1)
+
+    def next_name(self, timestamp):
+        """Tên partition ngay sau partition chứa timestamp"""
+        _, end = self.bounds(self.name_for(timestamp))
+        return self.name_for(end)
+
+
+class PartitionedMongoWebhookStorage(WebhookStorage):
+    """
+    Ghi mỗi webhook vào collection của ngày / tuần theo `timestamp` (webhooks_20240101,
+    webhooks_2024w01). Mỗi partition là một MongoWebhookStorage đầy đủ index; các truy vấn
+    đọc chỉ chạy trên partition giao với khoảng thời gian yêu cầu, từ mới đến cũ.
+
+    Các partition không giao nhau về thời gian nên ghép kết quả theo thứ tự partition
+    đã là thứ tự timestamp; riêng full-text search được merge theo score.
+    Collection `webhooks` cũ (trước khi chia partition) được coi là partition cũ nhất.
+    """
+
+    name = 'mongo'
+    REFRESH_INTERVAL = 30
+
+    def __init__(self, client, scheme, db_name='mailgun_webhooks', legacy_collection='webhooks', read_preference=None):
+        self.client = client
+        self.db_name = db_name
+        self.read_preference = read_preference
+        self.db = client[db_name]
+        self.scheme = PartitionScheme(scheme, prefix=legacy_collection)
+        self.legacy = MongoWebhookStorage(client, db_name, legacy_collection, read_preference)
+        self._partitions = {}
+        self._has_legacy = False
+        self._refreshed_at = 0
+        self._preparing = False
+        self._lock = threading.Lock()
+
+    # --- Quản lý partition ---
+
+    def _refresh(self, force=False):
+        """Đọc danh sách partition hiện có (cache REFRESH_INTERVAL giây)"""
+        if not force and time.monotonic() - self._refreshed_at < self.REFRESH_INTERVAL:
+            return
+        names = self.db.list_collection_names(filter={'name': {'$regex': f'^{self.scheme.prefix}'}})
+        with self._lock:
+            for name in names:
+                if name not in self._partitions and self.scheme.bounds(name):
+                    self._partitions[name] = MongoWebhookStorage(self.client, self.db_name, name, self.read_preference)
+            for name in list(self._partitions):
+                if name not in names:
+                    del self._partitions[name]
+            self._has_legacy = self.legacy.collection.name in names
+            self._refreshed_at = time.monotonic()
+
+    def _create_partition(self, name):
+        """Tạo collection của partition kèm đầy đủ index (idempotent)"""
+        partition = MongoWebhookStorage(self.client, self.db_name, name, self.read_preference)
+        partition.ensure_indexes()
+        with self._lock:
+            partition = self._partitions.setdefault(name, partition)
+        logger.info(f"Created webhook partition: {name}")
+        return partition
+
+    def prepare_partitions(self, now=None):
+        """Tạo trước partition hiện tại và partition kế tiếp, trả về tên các partition mới tạo"""
+        now = now or datetime.now()
+        created = []
+        for name in (self.scheme.name_for(now), self.scheme.next_name(now)):
+            with self._lock:
+                exists = name in self._partitions
+            if not exists:
+                self._create_partition(name)
+                created.append(name)
+        return created
+
+    def _prepare_in_background(self):
+        try:
+            self.prepare_partitions()
+        except Exception as e:
+            logger.error(f"[ERROR] Prepare webhook partitions error: {e}")
+        finally:
+            with self._lock:
+                self._preparing = False
+
+    def _partition_for_write(self, timestamp):
+        name = self.scheme.name_for(timestamp)
+        with self._lock:
+            partition = self._partitions.get(name)
+            # Ghi vào partition hiện tại mà partition kế tiếp chưa có: tạo trước trong thread nền,
+            # request không phải chờ tạo index khi sang ngày / tuần mới
+            prepare = (not self._preparing and name == self.scheme.name_for(datetime.now())
+                       and self.scheme.next_name(timestamp) not in self._partitions)
+            if prepare:
+                self._preparing = True
+        if prepare:
+            threading.Thread(target=self._prepare_in_background, name='partition-prepare', daemon=True).start()
+        if partition is None:
+            # Chưa được tạo trước (webhook có timestamp cũ, hoặc prepare lỗi): tạo ngay, kèm index
+            partition = self._create_partition(name)
+        return partition
+
+    def partitions(self, since=None, until=None, newest_first=True):
+        """Các partition giao với [since, until), kèm collection cũ nếu có"""
+        self._refresh()
+        # Snapshot dưới lock: _refresh / _create_partition ở thread khác có thể đổi dict
+        with self._lock:
+            items = list(self._partitions.items())
+            has_legacy = self._has_legacy
+        selected = []
+        for name, partition in items:
+            start, end = self.scheme.bounds(name)
+            if since and end <= since:
+                continue
+            if until and start >= until:
+                continue
+            selected.append((start, partition))
+        selected.sort(key=lambda item: item[0], reverse=newest_first)
+        result = [partition for _, partition in selected]
+        if has_legacy:
+            if newest_first:
+                result.append(self.legacy)
+            else:
+                result.insert(0, self.legacy)
+        return result
+
+    def _partitions_for_id(self, webhook_id):
+        """Partition có thể chứa ID: theo thời điểm tạo ObjectId (±1 partition), sau đó toàn bộ"""
+        created = ObjectId(webhook_id).generation_time.astimezone().replace(tzinfo=None)
+        window = timedelta(days=1) if self.scheme.scheme == 'day' else timedelta(weeks=1)
+        nearby = self.partitions(since=created - window, until=created + window)
+        rest = [partition for partition in self.partitions() if partition not in nearby]
+        return nearby + rest
+
+    def drop_partitions_before(self, cutoff, archive=None):
+        """Xóa nguyên partition kết thúc trước cutoff (archive trước nếu có), trả về tên đã xóa"""
+        self._refresh(force=True)
+        dropped = []
+        for partition in self.partitions(until=cutoff, newest_first=False):
+            if partition is self.legacy:
+                continue
+            _, end = self.scheme.bounds(partition.collection.name)
+            if end > cutoff:
+                continue
+            if archive is not None:
+                batch = []
+                for document in partition.collection.find().sort('timestamp', 1):
+                    batch.append(document)
+                    if len(batch) >= 1000:
+                        archive.write(batch)
+                        batch = []
+                if batch:
+                    archive.write(batch)
+            partition.collection.drop()
+            dropped.append(partition.collection.name)
+            logger.info(f"[SUCCESS] Dropped webhook partition: {partition.collection.name}")
+        self._refresh(force=True)
+        return dropped
+
+    def _fan_out(self, fetch, limit, skip, since=None, until=None):
+        """Đọc tuần tự từ partition mới nhất cho tới khi đủ skip + limit kết quả"""
+        needed = skip + limit
+        collected = []
+        for partition in self.partitions(since, until):
+            collected.extend(fetch(partition, needed - len(collected)))
+            if len(collected) >= needed:
+                break
+        return collected[skip:skip + limit]
+
+    # --- WebhookStorage interface ---
+
+    def ping(self):
+        self.client.admin.command('ping')
+
+    def ensure_indexes(self):
+        self._refresh(force=True)
+        for partition in self.partitions():
+            partition.ensure_indexes()
+        self.legacy.ensure_delivery_indexes()
+        self.prepare_partitions()
+
+    def insert(self, document, durability=None):
+        document.setdefault('timestamp', datetime.now())
+        return self._partition_for_write(document['timestamp']).insert(document, durability=durability)
+
+    def insert_many(self, documents, durability=None):
+        groups = defaultdict(list)
+        for document in documents:
+            document.setdefault('timestamp', datetime.now())
+            groups[self.scheme.name_for(document['timestamp'])].append(document)
+        inserted = set()
+        for items in groups.values():
+            inserted.update(self._partition_for_write(items[0]['timestamp']).insert_many(items, durability=durability))
+        return [str(document['_id']) for document in documents if str(document['_id']) in inserted]
+
+    def find_by_id(self, webhook_id, webhook_type=None, fields=None, tenant=None):
+        for partition in self._partitions_for_id(webhook_id):
+            document = partition.find_by_id(webhook_id, webhook_type=webhook_type, fields=fields, tenant=tenant)
+            if document:
+                return document
+        return None
+
+    def list_webhooks(self, limit=50, skip=0, fields=None, since=None, until=None, tenant=None):
+        collected = []
+        remaining_skip = skip
+        for partition in self.partitions(since, until):
+            if remaining_skip:
+                # Bỏ qua cả partition bằng count thay vì tải document về
+                count = partition.reader.count_documents(tenant_query(timestamp_range_query(since, until), tenant))
+                if count <= remaining_skip:
+                    remaining_skip -= count
+                    continue
+            collected.extend(partition.list_webhooks(
+                limit=limit - len(collected), skip=remaining_skip, fields=fields, since=since, until=until,
+                tenant=tenant,
+            ))
+            remaining_skip = 0
+            if len(collected) >= limit:
+                break
+        return collected
+
+    def _change_partitions(self, after_id):
+        """Partition có thể chứa _id > after_id (timestamp lưu theo giờ local, lùi thêm một ngày cho an toàn)"""
+        if not after_id:
+            return self.partitions(newest_first=False)
+        since = ObjectId(after_id).generation_time.astimezone().replace(tzinfo=None) - timedelta(days=1)
+        return self.partitions(since=since, newest_first=False)
+
+    def list_changes(self, after_id=None, before_id=None, limit=100, fields=None, tenant=None):
+        per_partition = [partition.list_changes(after_id, before_id, limit, fields, tenant)
+                         for partition in self._change_partitions(after_id)]
+        return list(heapq.merge(*per_partition, key=lambda document: document['_id']))[:limit]
+
+    def newest_id(self):
+        for partition in self.partitions():
+            newest = partition.newest_id()
+            if newest:
+                return newest
+        return None
+
+    def search_by_recipient(self, to_email, limit=50, skip=0, tenant=None):
+        return self._fan_out(
+            lambda partition, n: partition.search_by_recipient(to_email, limit=n, tenant=tenant), limit, skip
+        )
+
+    def find_inbox(self, recipient, subject_filter=None, limit=50, skip=0, category=None, tenant=None):
+        return self._fan_out(
+            lambda partition, n: partition.find_inbox(recipient, subject_filter, limit=n, category=category, tenant=tenant),
+            limit, skip
+        )
+
+    def find_inbox_batch(self, recipients, subject_filter=None, since=None, limit=5, include_html=False, category=None,
+                         tenant=None):
+        results = {address: [] for address in recipients}
+        for partition in self.partitions(since=since):
+            # Partition cũ hơn chỉ cần hỏi cho các địa chỉ chưa đủ limit
+            pending = [address for address, emails in results.items() if len(emails) < limit]
+            if not pending:
+                break
+            found = partition.find_inbox_batch(pending, subject_filter, since, limit, include_html, category, tenant)
+            for address, emails in found.items():
+                results[address].extend(emails[:limit - len(results[address])])
+        return results
+
+    def tag_subject_categories(self, categorize, retag=False, batch_size=500):
+        return sum(partition.tag_subject_categories(categorize, retag=retag, batch_size=batch_size)
+                   for partition in self.partitions())
+
+    def search_text(self, query, limit=20, cursor=None, tenant=None):
+        # Cursor (score, id) là keyset toàn cục nên dùng chung cho mọi partition
+        per_partition = [partition.search_text(query, limit=limit, cursor=cursor, tenant=tenant)
+                         for partition in self.partitions()]
+        merged = list(heapq.merge(
+            *[results for results, _ in per_partition],
+            key=lambda item: (-item['score'], -int(str(item['_id']), 16))
+        ))
+        results = merged[:limit]
+        has_more = len(merged) > limit or any(next_cursor for _, next_cursor in per_partition)
+        next_cursor = (results[-1]['score'], str(results[-1]['_id'])) if results and has_more else None
+        return results, next_cursor
+
+    def inbox_validator(self, recipient, tenant=None):
+        validator = {'count': 0, 'newest_id': None, 'newest': None}
+        for partition in self.partitions():
+            result = partition.inbox_validator(recipient, tenant=tenant)
+            validator['count'] += result['count']
+            if validator['newest_id'] is None and result['newest_id']:
+                validator['newest_id'] = result['newest_id']
+                validator['newest'] = result['newest']
+        return validator
+
+    def latest_code(self, recipient, since=None, tenant=None):
+        for partition in self.partitions(since=since):
+            result = partition.latest_code(recipient, since=since, tenant=tenant)
+            if result:
+                return result
+        return None
+
+    def references_blob(self, key, tenant=None):
+        return any(partition.references_blob(key, tenant=tenant) for partition in self.partitions())
+
+    def live_blob_keys(self):
+        return set().union(*(partition.live_blob_keys() for partition in self.partitions()))
+
+    def retention_report(self, webhook_type, cutoff):
+        report = {'documents': 0, 'bytes': 0}
+        for partition in self.partitions(until=cutoff):
+            result = partition.retention_report(webhook_type, cutoff)
+            report['documents'] += result['documents']
+            report['bytes'] += result['bytes']
+        return report
+
+    def find_expired(self, webhook_type, cutoff, limit=500):
+        collected = []
+        for partition in self.partitions(until=cutoff, newest_first=False):
+            collected.extend(partition.find_expired(webhook_type, cutoff, limit=limit - len(collected)))
+            if len(collected) >= limit:
+                break
+        return collected
+
+    def delete_by_ids(self, ids):
+        groups = defaultdict(list)
+        for webhook_id in ids:
+            created = ObjectId(webhook_id).generation_time.astimezone().replace(tzinfo=None)
+            groups[self.scheme.name_for(created)].append(webhook_id)
+        deleted = 0
+        for name, group in groups.items():
+            partition = self._partitions.get(name)
+            if partition is not None:
+                deleted += partition.delete_by_ids(group)
+        if deleted < len(ids):
+            # ID nằm ở partition lân cận (timestamp và ObjectId khác ngày) hoặc collection cũ
+            for partition in self.partitions():
+                deleted += partition.delete_by_ids(ids)
+        return deleted
+
+    def stats(self, tenant=None):
+        combined = {'total': 0, 'by_type': defaultdict(int), 'newest': None, 'oldest': None}
+        for partition in self.partitions():
+            stats = partition.stats(tenant=tenant)
+            combined['total'] += stats['total']
+            for webhook_type, count in stats['by_type'].items():
+                combined['by_type'][webhook_type] += count
+            if stats['newest'] and (combined['newest'] is None or stats['newest'] > combined['newest']):
+                combined['newest'] = stats['newest']
+            if stats['oldest'] and (combined['oldest'] is None or stats['oldest'] < combined['oldest']):
+                combined['oldest'] = stats['oldest']
+        combined['by_type'] = dict(combined['by_type'])
+        combined['partitions'] = len(self.partitions())
+        return combined
+
+    # Collection bản ghi riêng theo loại webhook không chia partition
+    def ensure_record_indexes(self, collection, indexes):
+        self.legacy.ensure_record_indexes(collection, indexes)
+
+    def insert_records(self, collection, records, key_field=None):
+        self.legacy.insert_records(collection, records, key_field=key_field)
+
+    def find_records(self, collection, key_field, key, limit=50):
+        return self.legacy.find_records(collection, key_field, key, limit=limit)
+
+    # Subscription fan-out, state giao nhận và bộ đếm domain không chia partition
+    def save_subscription(self, subscription):
+        return self.legacy.save_subscription(subscription)
+
+    def list_subscriptions(self):
+        return self.legacy.list_subscriptions()
+
+    def delete_subscription(self, subscription_id):
+        return self.legacy.delete_subscription(subscription_id)
+
+    def upsert_message_event(self, event, timeline_limit=50):
+        return self.legacy.upsert_message_event(event, timeline_limit=timeline_limit)
+
+    def find_message_state(self, message_id, tenant=None):
+        return self.legacy.find_message_state(message_id, tenant=tenant)
+
+    def increment_domain_counter(self, domain, bucket, event, tenant=''):
+        self.legacy.increment_domain_counter(domain, bucket, event, tenant=tenant)
+
+    def domain_counters(self, since, domain=None, tenant=None):
+        return self.legacy.domain_counters(since, domain=domain, tenant=tenant)
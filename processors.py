@@ -0,0 +1,319 @@
+"""
+Phân loại webhook và pipeline xử lý riêng cho từng loại (inbound email, email event, JSON webhook)
+"""
+
+import json
+import logging
+import re
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from storage import extract_email_fields, extract_recipient_addresses, subject_category_fields
+
+logger = logging.getLogger(__name__)
+
+# Registry các processor, sắp xếp theo priority (nhỏ chạy detect trước)
+PROCESSOR_CLASSES = []
+
+_ATTACHMENT_RE = re.compile(r'^attachment-(\d+)$')
+
+
+def register_processor(cls):
+    """Decorator đăng ký một processor vào registry"""
+    PROCESSOR_CLASSES.append(cls)
+    PROCESSOR_CLASSES.sort(key=lambda processor_cls: processor_cls.priority)
+    return cls
+
+
+class WebhookProcessor:
+    """
+    Processor cho một loại webhook.
+
+    - `detect(document)`: nhận diện loại webhook từ form / JSON đã parse
+    - `enrich(document)`: bổ sung processed_data vào document gốc, chạy trên request path
+      vì các API đọc cần dữ liệu này ngay sau khi lưu
+    - `build_record(document)`: tạo bản ghi gọn cho collection riêng của loại webhook,
+      có thể chạy ngoài request path trong worker pool
+    """
+
+    webhook_type = 'unknown'
+    priority = 1000
+    # Collection riêng, field dùng làm key tra cứu và các index MongoDB
+    collection = None
+    key_field = None
+    indexes = []
+
+    def detect(self, document):
+        return False
+
+    def enrich(self, document):
+        pass
+
+    def build_record(self, document):
+        return None
+
+
+@register_processor
+class EmailEventProcessor(WebhookProcessor):
+    """Event của Mailgun (delivered, opened, failed, ...) gửi qua field event-data hoặc JSON body"""
+
+    webhook_type = 'email_event'
+    priority = 10
+    collection = 'email_events'
+    key_field = 'message_id'
+    indexes = [
+        [('message_id', 1), ('event_timestamp', 1)],
+        [('recipient', 1), ('timestamp', -1)],
+        [('domain', 1), ('event_type', 1), ('timestamp', -1)],
+    ]
+
+    @staticmethod
+    def event_data(document):
+        """Lấy event-data từ form (chuỗi JSON) hoặc JSON body, None nếu không có / lỗi"""
+        request_json = document.get('request_json')
+        if isinstance(request_json, dict) and isinstance(request_json.get('event-data'), dict):
+            return request_json['event-data']
+        raw = (document.get('request_form_data') or {}).get('event-data')
+        if not raw:
+            return None
+        try:
+            event = json.loads(raw)
+        except (TypeError, ValueError):
+            logger.warning("Không thể parse event-data JSON")
+            return None
+        return event if isinstance(event, dict) else None
+
+    def detect(self, document):
+        return self.event_data(document) is not None
+
+    def enrich(self, document):
+        event = self.event_data(document)
+        message = event.get('message') or {}
+        processed = {
+            'event_type': event.get('event', 'unknown'),
+            'message_id': (message.get('headers') or {}).get('message-id', ''),
+            'recipient': (event.get('recipient') or '').lower(),
+            'domain': event.get('domain', ''),
+            'event_timestamp': event.get('timestamp'),
+            'event_data': event,
+        }
+        document['processed_data'] = processed
+        # Các field top-level như mô tả trong README / view_webhooks.py
+        for key in ('event_type', 'message_id', 'recipient', 'domain'):
+            document[key] = processed[key]
+        logger.info(f"Detected email event webhook: {processed['event_type']}")
+
+    def build_record(self, document):
+        processed = document['processed_data']
+        event = processed['event_data']
+        delivery_status = event.get('delivery-status') or {}
+        return {
+            'webhook_id': document['_id'],
+            'timestamp': document['timestamp'],
+            'event_timestamp': processed['event_timestamp'],
+            'event_type': processed['event_type'],
+            'message_id': processed['message_id'],
+            'recipient': processed['recipient'],
+            'domain': processed['domain'],
+            'severity': event.get('severity'),
+            'reason': event.get('reason'),
+            'delivery_code': delivery_status.get('code'),
+        }
+
+
+@register_processor
+class InboundEmailProcessor(WebhookProcessor):
+    """Email gửi tới domain qua Mailgun Routes (form có field sender)"""
+
+    webhook_type = 'inbound_email'
+    priority = 20
+    collection = 'inbound_emails'
+    key_field = 'message_id'
+    indexes = [
+        [('recipients', 1), ('timestamp', -1)],
+        [('message_id', 1)],
+        [('sender', 1), ('timestamp', -1)],
+    ]
+
+    def __init__(self, otp_extractor=None, subject_categorizer=None):
+        self.otp_extractor = otp_extractor
+        self.subject_categorizer = subject_categorizer
+
+    def detect(self, document):
+        return 'sender' in (document.get('request_form_data') or {})
+
+    @staticmethod
+    def attachments(form_data, files=None):
+        """Metadata file đính kèm từ các field attachment-N của Mailgun"""
+        attachments = []
+        for key in sorted(form_data, key=lambda k: int(_ATTACHMENT_RE.match(k).group(1)) if _ATTACHMENT_RE.match(k) else 0):
+            if not _ATTACHMENT_RE.match(key):
+                continue
+            attachments.append({
+                'name': form_data.get(key, ''),
+                'size': form_data.get(f'{key}-size', ''),
+                'content_type': form_data.get(f'{key}-content-type', ''),
+            })
+        for key, info in (files or {}).items():
+            attachments.append({
+                'name': info.get('filename', key),
+                'size': str(info.get('size', '')),
+                'content_type': info.get('content_type', ''),
+            })
+        return attachments
+
+    def enrich(self, document):
+        form_data = document.get('request_form_data') or {}
+        document['processed_data'] = {
+            'email_data': {
+                'sender': form_data.get('sender', ''),
+                'from': form_data.get('from', ''),
+                'to': form_data.get('To', '') or form_data.get('to', ''),
+                'subject': form_data.get('Subject', '') or form_data.get('subject', ''),
+                'body_plain': form_data.get('body-plain', ''),
+                'body_html': form_data.get('body-html', ''),
+                'stripped_text': form_data.get('stripped-text', ''),
+                'stripped_html': form_data.get('stripped-html', ''),
+                'stripped_signature': form_data.get('stripped-signature', ''),
+                'message_id': form_data.get('Message-Id', '') or form_data.get('message-id', ''),
+                'timestamp': form_data.get('timestamp', ''),
+                'token': form_data.get('token', ''),
+                'signature': form_data.get('signature', ''),
+                'attachment_count': form_data.get('attachment-count', '0'),
+                'recipient': form_data.get('recipient', ''),
+                'domain': form_data.get('domain', ''),
+                'message_headers': form_data.get('message-headers', ''),
+                'content_id_map': form_data.get('content-id-map', ''),
+                'attachments': self.attachments(form_data, document.get('request_files')),
+            }
+        }
+
+        # Chuẩn hóa người nhận, gắn subject category và trích xuất mã xác minh một lần khi ingest
+        document['recipient_addresses'] = extract_recipient_addresses(document)
+        email_fields = extract_email_fields(document)
+        if self.subject_categorizer is not None:
+            categories = self.subject_categorizer.categorize(email_fields['subject'])
+            document.update(subject_category_fields(categories, document['recipient_addresses']))
+        if self.otp_extractor is not None:
+            otp = self.otp_extractor.extract(
+                sender=form_data.get('sender', ''),
+                subject=email_fields['subject'],
+                text=email_fields['text'],
+                body_html=form_data.get('body-html', '')
+            )
+            if otp:
+                document['otp'] = otp
+                logger.info(f"Extracted OTP from {otp['source']}: code={otp['code']} link={bool(otp['link'])}")
+        logger.info(f"Detected inbound email webhook from: {form_data.get('from', 'N/A')}")
+
+    def build_record(self, document):
+        email_data = document['processed_data']['email_data']
+        return {
+            'webhook_id': document['_id'],
+            'timestamp': document['timestamp'],
+            'recipients': document.get('recipient_addresses', []),
+            'sender': email_data['sender'].lower(),
+            'subject': email_data['subject'],
+            'message_id': email_data['message_id'],
+            'attachment_count': int(email_data['attachment_count'] or 0),
+            'otp_code': (document.get('otp') or {}).get('code'),
+        }
+
+
+@register_processor
+class JSONWebhookProcessor(WebhookProcessor):
+    """Webhook khác gửi JSON body"""
+
+    webhook_type = 'json_webhook'
+    priority = 30
+    collection = 'json_webhooks'
+    indexes = [
+        [('timestamp', -1)],
+    ]
+
+    def detect(self, document):
+        return document.get('request_json') is not None
+
+    def enrich(self, document):
+        request_json = document['request_json']
+        document['processed_data'] = {
+            'keys': sorted(request_json) if isinstance(request_json, dict) else [],
+        }
+
+    def build_record(self, document):
+        return {
+            'webhook_id': document['_id'],
+            'timestamp': document['timestamp'],
+            'keys': document['processed_data']['keys'],
+            'body': document['request_json'],
+        }
+
+
+class WebhookDispatcher:
+    """
+    Chọn processor cho từng webhook và chạy phần xử lý sau khi lưu (ghi collection riêng,
+    các listener đăng ký theo loại webhook) trong worker pool, hoặc ngay trên request path nếu workers = 0.
+    """
+
+    def __init__(self, storage, processors, workers=0):
+        self.storage = storage
+        self.processors = processors
+        self.fallback = WebhookProcessor()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='webhook-processor') if workers > 0 else None
+        self._indexed = set()
+        self.listeners = defaultdict(list)
+
+    def add_listener(self, webhook_type, callback):
+        """Đăng ký callback(document) chạy sau khi một webhook loại này ('*' = mọi loại) được lưu"""
+        self.listeners[webhook_type].append(callback)
+
+    def classify(self, document):
+        """Processor đầu tiên nhận diện được document (theo priority)"""
+        for processor in self.processors:
+            if processor.detect(document):
+                return processor
+        return self.fallback
+
+    def _listeners_for(self, webhook_type):
+        return self.listeners.get(webhook_type, []) + self.listeners.get('*', [])
+
+    def after_store(self, processor, document):
+        """Ghi bản ghi gọn vào collection riêng của loại webhook và gọi các listener"""
+        if processor.collection is None and not self._listeners_for(processor.webhook_type):
+            return
+        if self.executor is not None:
+            self.executor.submit(self._process, processor, document)
+        else:
+            self._process(processor, document)
+
+    def _process(self, processor, document):
+        if processor.collection is not None:
+            try:
+                if processor.collection not in self._indexed:
+                    self.storage.ensure_record_indexes(processor.collection, processor.indexes)
+                    self._indexed.add(processor.collection)
+                record = processor.build_record(document)
+                if record is not None:
+                    self.storage.insert_records(processor.collection, [record], key_field=processor.key_field)
+            except Exception as e:
+                logger.error(f"[ERROR] Processor {processor.webhook_type} error for {document.get('_id')}: {e}")
+        for callback in self._listeners_for(processor.webhook_type):
+            try:
+                callback(document)
+            except Exception as e:
+                logger.error(f"[ERROR] Listener {getattr(callback, '__qualname__', callback)} error for {document.get('_id')}: {e}")
+
+    def shutdown(self, wait=True):
+        if self.executor is not None:
+            self.executor.shutdown(wait=wait)
+
+
+def create_dispatcher(storage, otp_extractor=None, workers=0, subject_categorizer=None):
+    """Khởi tạo dispatcher với toàn bộ processor đã đăng ký"""
+    processors = []
+    for processor_cls in PROCESSOR_CLASSES:
+        if processor_cls is InboundEmailProcessor:
+            processors.append(processor_cls(otp_extractor=otp_extractor, subject_categorizer=subject_categorizer))
+        else:
+            processors.append(processor_cls())
+    return WebhookDispatcher(storage, processors, workers=workers)
@@ -0,0 +1,284 @@
+"""
+Profiler truy vấn MongoDB theo route (bật bằng QUERY_PROFILING=1)
+
+Đăng ký như một CommandListener của pymongo nên thấy mọi lệnh do handler, dispatcher hay
+thread nền gửi đi mà không phải sửa storage. Mỗi lệnh được quy về "shape" (filter bỏ giá trị,
+chỉ giữ tên field / operator) và cộng dồn theo (collection, shape); lệnh chậm hơn
+SLOW_QUERY_MS được ghi vào ring buffer. Số document examined / returned và việc có chạy
+collection scan hay không lấy từ `explain` (executionStats), chạy trong thread nền cho mẫu
+đầu tiên của mỗi shape và tối đa một lần mỗi `explain_interval` giây.
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+# Lệnh đọc có thể explain an toàn
+EXPLAINABLE_COMMANDS = {'find', 'aggregate', 'count', 'distinct'}
+# Lệnh nội bộ của driver, không tính
+IGNORED_COMMANDS = {
+    'explain', 'hello', 'ismaster', 'isMaster', 'ping', 'saslStart', 'saslContinue',
+    'endSessions', 'killCursors', 'buildInfo', 'getLastError',
+}
+# Field của command không phải một phần của truy vấn (session, read preference, $db...)
+COMMAND_META_FIELDS = {'lsid', 'txnNumber', 'readConcern', 'writeConcern', 'cursor', 'maxTimeMS'}
+
+
+def value_shape(value):
+    """Bỏ giá trị cụ thể, giữ cấu trúc: {'a': {'$in': ['x', 'y']}} -> {'a': {'$in': ['str']}}"""
+    if isinstance(value, dict):
+        return {key: value_shape(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [value_shape(value[0])] if value else []
+    if hasattr(value, 'pattern'):
+        return 'regex'
+    return type(value).__name__
+
+
+def command_shape(command_name, command):
+    """Shape của phần truy vấn trong một command (filter / pipeline / sort)"""
+    if command_name == 'find':
+        shape = {'filter': value_shape(command.get('filter', {}))}
+        if command.get('sort'):
+            shape['sort'] = dict(command['sort'])
+        return shape
+    if command_name == 'aggregate':
+        return {'pipeline': [
+            {stage: value_shape(body) if stage in ('$match', '$sort') else '...'}
+            for item in command.get('pipeline', []) for stage, body in item.items()
+        ]}
+    if command_name in ('count', 'distinct', 'findAndModify'):
+        return {'filter': value_shape(command.get('query', {}))}
+    if command_name in ('update', 'delete'):
+        statements = command.get('updates') or command.get('deletes') or []
+        return {'filter': value_shape(statements[0].get('q', {})) if statements else {}}
+    return {}
+
+
+def shape_key(collection, command_name, shape):
+    return f'{collection}.{command_name} {shape}'
+
+
+def returned_count(command_name, reply):
+    """Số document trả về / bị ảnh hưởng theo reply của command"""
+    cursor = reply.get('cursor')
+    if cursor is not None:
+        return len(cursor.get('firstBatch') or cursor.get('nextBatch') or [])
+    if command_name == 'distinct':
+        return len(reply.get('values', []))
+    return reply.get('n')
+
+
+def summarize_explain(explain):
+    """{docs_examined, keys_examined, returned, collscan, plan} từ output explain executionStats"""
+    stats = {}
+    stages = []
+
+    def walk(node):
+        if isinstance(node, dict):
+            if 'executionStats' in node and 'docs_examined' not in stats:
+                execution = node['executionStats']
+                stats['docs_examined'] = execution.get('totalDocsExamined')
+                stats['keys_examined'] = execution.get('totalKeysExamined')
+                stats['returned'] = execution.get('nReturned')
+            stage = node.get('stage')
+            if isinstance(stage, str) and 'rejectedPlans' not in node:
+                stages.append(f"{stage} {node['indexName']}" if node.get('indexName') else stage)
+            for key, item in node.items():
+                if key != 'rejectedPlans':
+                    walk(item)
+        elif isinstance(node, list):
+            for item in node:
+                walk(item)
+
+    walk(explain)
+    stats['collscan'] = any(stage.startswith('COLLSCAN') for stage in stages)
+    stats['plan'] = ' <- '.join(stages)
+    return stats
+
+
+class QueryProfiler(monitoring.CommandListener):
+    """Thống kê truy vấn MongoDB theo route / shape và ring buffer các truy vấn chậm"""
+
+    def __init__(self, slow_ms=100, buffer_size=500, explain_interval=60):
+        self.slow_ms = slow_ms
+        self.explain_interval = explain_interval
+        self.client = None
+        self.slow_queries = deque(maxlen=buffer_size)
+        self.shapes = {}
+        self.routes = {}
+        self._pending = {}
+        self._explained = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._explainer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='query-explain')
+
+    def attach(self, client):
+        """Client dùng để chạy explain (chính client đã đăng ký listener)"""
+        self.client = client
+
+    # Theo dõi request hiện tại của thread (gọi từ before/after request)
+    def begin_request(self, route):
+        self._local.request = {'route': route, 'started': time.perf_counter(), 'calls': 0, 'mongo_ms': 0.0}
+
+    def end_request(self, status_code, response_bytes):
+        current = getattr(self._local, 'request', None)
+        self._local.request = None
+        if current is None:
+            return
+        elapsed_ms = (time.perf_counter() - current['started']) * 1000
+        with self._lock:
+            route = self.routes.setdefault(current['route'], {
+                'requests': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'mongo_ms': 0.0, 'mongo_calls': 0,
+                'response_bytes': 0, 'errors': 0,
+            })
+            route['requests'] += 1
+            route['total_ms'] += elapsed_ms
+            route['max_ms'] = max(route['max_ms'], elapsed_ms)
+            route['mongo_ms'] += current['mongo_ms']
+            route['mongo_calls'] += current['calls']
+            route['response_bytes'] += response_bytes or 0
+            route['errors'] += status_code >= 500
+
+    def _current_route(self):
+        current = getattr(self._local, 'request', None)
+        return current['route'] if current else threading.current_thread().name
+
+    # CommandListener
+    def started(self, event):
+        if event.command_name in IGNORED_COMMANDS:
+            return
+        command = event.command
+        collection = command.get(event.command_name)
+        self._pending[(event.connection_id, event.request_id)] = {
+            'route': self._current_route(),
+            'database': event.database_name,
+            'collection': collection if isinstance(collection, str) else None,
+            'shape': command_shape(event.command_name, command),
+            # Chỉ giữ command (có thể rất lớn với insert) nếu cần explain
+            'command': command if event.command_name in EXPLAINABLE_COMMANDS else None,
+        }
+
+    def succeeded(self, event):
+        self._finish(event, reply=event.reply)
+
+    def failed(self, event):
+        self._finish(event, error=str(event.failure.get('errmsg', event.failure)))
+
+    def _finish(self, event, reply=None, error=None):
+        pending = self._pending.pop((event.connection_id, event.request_id), None)
+        if pending is None:
+            return
+        duration_ms = event.duration_micros / 1000
+        current = getattr(self._local, 'request', None)
+        if current is not None:
+            current['calls'] += 1
+            current['mongo_ms'] += duration_ms
+
+        key = shape_key(pending['collection'], event.command_name, pending['shape'])
+        returned = returned_count(event.command_name, reply) if reply is not None else None
+        with self._lock:
+            shape = self.shapes.get(key)
+            if shape is None:
+                shape = self.shapes[key] = {
+                    'collection': pending['collection'], 'command': event.command_name,
+                    'shape': pending['shape'], 'count': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                    'returned': 0, 'routes': {}, 'explain': None,
+                }
+            shape['count'] += 1
+            shape['total_ms'] += duration_ms
+            shape['max_ms'] = max(shape['max_ms'], duration_ms)
+            shape['returned'] += returned or 0
+            shape['routes'][pending['route']] = shape['routes'].get(pending['route'], 0) + 1
+
+            if duration_ms >= self.slow_ms:
+                self.slow_queries.append({
+                    'key': key,
+                    'timestamp': datetime.now().isoformat(),
+                    'route': pending['route'],
+                    'collection': pending['collection'],
+                    'command': event.command_name,
+                    'shape': pending['shape'],
+                    'duration_ms': round(duration_ms, 2),
+                    'returned': returned,
+                    'error': error,
+                })
+
+        if pending['command'] is not None and error is None:
+            self._maybe_explain(key, pending['database'], pending['command'])
+
+    def _maybe_explain(self, key, database, command):
+        now = time.monotonic()
+        with self._lock:
+            if self.client is None or self.explain_interval <= 0:
+                return
+            if key in self._explained and now - self._explained[key] < self.explain_interval:
+                return
+            self._explained[key] = now
+        explainable = {name: value for name, value in command.items()
+                       if not name.startswith('$') and name not in COMMAND_META_FIELDS}
+        self._explainer.submit(self._explain, key, database, explainable)
+
+    def _explain(self, key, database, command):
+        try:
+            explain = self.client[database].command('explain', command, verbosity='executionStats')
+        except Exception as e:
+            logger.warning(f"[WARNING] Explain failed for {key}: {e}")
+            return
+        summary = summarize_explain(explain)
+        if summary['collscan']:
+            logger.warning(f"[WARNING] Collection scan: {key} ({summary['docs_examined']} docs examined)")
+        with self._lock:
+            if key in self.shapes:
+                self.shapes[key]['explain'] = summary
+
+    # Báo cáo
+    def report(self, limit=100, route=None, collscan_only=False):
+        with self._lock:
+            # Kết quả explain có thể đến sau khi truy vấn được ghi vào buffer
+            queries = []
+            for query in self.slow_queries:
+                query = dict(query)
+                query['explain'] = self.shapes[query.pop('key')]['explain']
+                queries.append(query)
+            shapes = [dict(shape, routes=dict(shape['routes'])) for shape in self.shapes.values()]
+            routes = {name: dict(stats) for name, stats in self.routes.items()}
+        if route:
+            queries = [query for query in queries if query['route'] == route]
+            shapes = [shape for shape in shapes if route in shape['routes']]
+        if collscan_only:
+            queries = [query for query in queries if (query['explain'] or {}).get('collscan')]
+            shapes = [shape for shape in shapes if (shape['explain'] or {}).get('collscan')]
+        for shape in shapes:
+            shape['avg_ms'] = round(shape['total_ms'] / shape['count'], 2)
+            shape['total_ms'] = round(shape['total_ms'], 2)
+            shape['max_ms'] = round(shape['max_ms'], 2)
+        for stats in routes.values():
+            stats['avg_ms'] = round(stats['total_ms'] / stats['requests'], 2)
+            stats['avg_mongo_ms'] = round(stats['mongo_ms'] / stats['requests'], 2)
+            stats['avg_response_bytes'] = stats['response_bytes'] // stats['requests']
+            for field in ('total_ms', 'max_ms', 'mongo_ms'):
+                stats[field] = round(stats[field], 2)
+        return {
+            'threshold_ms': self.slow_ms,
+            'slow_queries': list(reversed(queries))[:limit],
+            'shapes': sorted(shapes, key=lambda shape: shape['total_ms'], reverse=True)[:limit],
+            'routes': routes,
+        }
+
+    def reset(self):
+        with self._lock:
+            self.slow_queries.clear()
+            self.shapes.clear()
+            self.routes.clear()
+            self._explained.clear()
+
+    def shutdown(self):
+        self._explainer.shutdown(wait=False)
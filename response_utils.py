@@ -0,0 +1,182 @@
+"""
+Kiểm soát kích thước response: JSON encoder nhanh, cắt bớt body và nén gzip/brotli
+"""
+
+import gzip
+import logging
+
+from flask import request
+from flask.json.provider import DefaultJSONProvider
+
+from storage import json_default
+
+try:
+    import orjson
+except ImportError:  # orjson là tùy chọn, fallback về json chuẩn
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # brotli là tùy chọn, chỉ dùng gzip nếu không có
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Không nén response nhỏ hơn ngưỡng này (byte)
+COMPRESSION_MIN_SIZE = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+# Các field chứa nội dung email lớn, bị cắt khi có max_body_bytes
+BODY_FIELDS = {
+    'body-html', 'body-plain', 'stripped-html', 'stripped-text', 'stripped-signature',
+    'body_html', 'body_plain', 'stripped_html', 'stripped_text', 'stripped_signature',
+    'request_raw_data',
+}
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    JSON provider cho Flask dùng orjson nếu được cài đặt.
+    datetime và ObjectId được serialize trực tiếp nên handler không cần tự convert.
+    """
+
+    default = staticmethod(json_default)
+    sort_keys = False
+
+    def dumps(self, obj, **kwargs):
+        if orjson is not None and not kwargs:
+            return orjson.dumps(obj, default=json_default, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+        kwargs.setdefault('default', json_default)
+        kwargs.setdefault('ensure_ascii', False)
+        return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if orjson is not None and not kwargs:
+            return orjson.loads(s)
+        return super().loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        if orjson is not None:
+            body = orjson.dumps(obj, default=json_default, option=orjson.OPT_NON_STR_KEYS)
+        else:
+            body = self.dumps(obj)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+def parse_fields(value):
+    """Tách tham số fields=a,b.c thành danh sách field (None nếu không có)"""
+    fields = [field.strip() for field in (value or '').split(',') if field.strip()]
+    return fields or None
+
+
+def truncate_text(value, max_bytes):
+    """Cắt chuỗi theo số byte UTF-8 mà không làm vỡ ký tự"""
+    encoded = value.encode('utf-8')
+    if len(encoded) <= max_bytes:
+        return value, False
+    return encoded[:max_bytes].decode('utf-8', errors='ignore'), True
+
+
+def truncate_bodies(document, max_bytes):
+    """
+    Cắt các field nội dung email trong document (đệ quy) xuống tối đa max_bytes.
+    Trả về danh sách field đã bị cắt.
+    """
+    truncated = []
+
+    def visit(node, path):
+        for key, value in node.items():
+            if isinstance(value, dict):
+                visit(value, f'{path}{key}.')
+            elif key in BODY_FIELDS and isinstance(value, str):
+                node[key], was_truncated = truncate_text(value, max_bytes)
+                if was_truncated:
+                    truncated.append(f'{path}{key}')
+            elif key in BODY_FIELDS and isinstance(value, (bytes, bytearray)):
+                # request_raw_data lưu dạng bytes: cắt trước khi decode
+                node[key] = bytes(value[:max_bytes]).decode('utf-8', errors='ignore')
+                if len(value) > max_bytes:
+                    truncated.append(f'{path}{key}')
+
+    if max_bytes is not None and isinstance(document, dict):
+        visit(document, '')
+    return truncated
+
+
+def parse_max_body_bytes():
+    """Đọc tham số max_body_bytes từ query string (None nếu không giới hạn), raise ValueError nếu không hợp lệ"""
+    value = request.args.get('max_body_bytes', '').strip()
+    if not value:
+        return None
+    try:
+        return max(int(value), 0)
+    except ValueError:
+        raise ValueError(f'max_body_bytes không hợp lệ: {value}') from None
+
+
+def _parse_accept_encoding(accept_encoding):
+    """Tách Accept-Encoding thành {coding: q}; q không hợp lệ coi như 0"""
+    codings = {}
+    for item in accept_encoding.lower().split(','):
+        coding, _, params = item.partition(';')
+        coding = coding.strip()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        codings[coding] = q
+    return codings
+
+
+def _choose_encoding(accept_encoding):
+    """Coding có q cao nhất trong các coding hỗ trợ (bằng q thì ưu tiên brotli); q=0 là không chấp nhận"""
+    codings = _parse_accept_encoding(accept_encoding)
+    wildcard = codings.get('*', 0.0)
+    chosen, chosen_q = None, 0.0
+    for coding in ('br', 'gzip') if brotli is not None else ('gzip',):
+        q = codings.get(coding, wildcard)
+        if q > chosen_q:
+            chosen, chosen_q = coding, q
+    return chosen
+
+
+def compress_response(response):
+    """Nén response theo Accept-Encoding của client (brotli ưu tiên, sau đó gzip)"""
+    if response.direct_passthrough or response.is_streamed:
+        return response
+    if response.status_code < 200 or response.status_code in (204, 304):
+        return response
+    if 'Content-Encoding' in response.headers:
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = _choose_encoding(request.headers.get('Accept-Encoding', ''))
+    if encoding is None:
+        return response
+
+    data = response.get_data()
+    if len(data) < COMPRESSION_MIN_SIZE:
+        return response
+
+    if encoding == 'br':
+        compressed = brotli.compress(data, quality=BROTLI_QUALITY)
+    else:
+        compressed = gzip.compress(data, compresslevel=GZIP_LEVEL)
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    response.headers['Content-Length'] = str(len(compressed))
+    return response
+
+
+def init_app(app):
+    """Đăng ký JSON provider và nén response cho Flask app"""
+    app.json = FastJSONProvider(app)
+    app.after_request(compress_response)
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+Retention theo webhook_type: archive webhook cũ ra NDJSON nén (theo ngày) rồi xóa theo batch
+
+Cách chạy:
+    RETENTION_POLICIES='{"inbound_email": "1h", "unknown": "30d"}' python retention.py --dry-run
+    RETENTION_POLICIES='...' ARCHIVE_DIR=archive python retention.py
+    RETENTION_POLICIES='...' python retention.py --gc-blobs     # chỉ xóa blob không còn được tham chiếu
+"""
+
+import argparse
+import gzip
+import json
+import logging
+import os
+import re
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from bson import json_util
+
+logger = logging.getLogger(__name__)
+
+_DURATION_RE = re.compile(r'^\s*(\d+)\s*([smhdw]?)\s*$')
+_DURATION_UNITS = {'': 1, 's': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+
+
+def parse_duration(value):
+    """Chuyển '15m', '1h', '7d', '2w' hoặc số giây thành timedelta"""
+    if isinstance(value, (int, float)):
+        return timedelta(seconds=value)
+    match = _DURATION_RE.match(str(value))
+    if not match:
+        raise ValueError(f'Thời gian retention không hợp lệ: {value}')
+    return timedelta(seconds=int(match.group(1)) * _DURATION_UNITS[match.group(2)])
+
+
+def load_policies(raw):
+    """Đọc RETENTION_POLICIES (JSON: {webhook_type: duration}) thành {webhook_type: timedelta}"""
+    if not raw.strip():
+        return {}
+    return {webhook_type: parse_duration(duration) for webhook_type, duration in json.loads(raw).items()}
+
+
+class DailyArchiveWriter:
+    """
+    Ghi document ra file NDJSON nén gzip, chia theo loại webhook và ngày của `timestamp`:
+    <archive_dir>/<webhook_type>/<YYYY-MM-DD>.ndjson.gz (ghi nối thêm, mỗi batch một gzip member).
+    Dùng Extended JSON để có thể khôi phục bằng mongoimport.
+    """
+
+    def __init__(self, archive_dir):
+        self.archive_dir = archive_dir
+
+    def write(self, documents):
+        """Archive một batch, trả về tổng số byte (đã nén) được ghi"""
+        partitions = defaultdict(list)
+        for document in documents:
+            day = document['timestamp'].strftime('%Y-%m-%d')
+            partitions[(document.get('webhook_type') or 'unknown', day)].append(document)
+
+        written = 0
+        for (webhook_type, day), items in partitions.items():
+            directory = os.path.join(self.archive_dir, webhook_type)
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f'{day}.ndjson.gz')
+            payload = ''.join(
+                json_util.dumps(item, json_options=json_util.RELAXED_JSON_OPTIONS) + '\n' for item in items
+            ).encode('utf-8')
+            compressed = gzip.compress(payload)
+            with open(path, 'ab') as f:
+                f.write(compressed)
+                f.flush()
+                os.fsync(f.fileno())  # Phải chắc chắn đã archive trước khi xóa
+            written += len(compressed)
+        return written
+
+
+class RetentionPruner:
+    """
+    Xóa webhook quá hạn theo batch, archive trước khi xóa nếu có archive_dir; sau khi xóa,
+    blob (file đính kèm, field lớn) không còn webhook nào tham chiếu được dọn khỏi blob_store
+    """
+
+    def __init__(self, storage, policies, archive_dir=None, batch_size=500, partition_max_age=None,
+                 blob_store=None, blob_grace=timedelta(days=1)):
+        self.storage = storage
+        self.policies = policies
+        self.blob_store = blob_store
+        # Blob mới ghi (webhook còn trong spool / đang insert) chưa có trong pha mark: chỉ xóa blob cũ hơn
+        self.blob_grace = blob_grace
+        # Với storage chia partition: xóa nguyên partition cũ hơn partition_max_age
+        self.partition_max_age = partition_max_age
+        self.archive = DailyArchiveWriter(archive_dir) if archive_dir else None
+        self.batch_size = batch_size
+        self._stop = threading.Event()
+
+    def report(self, now=None):
+        """Dry-run: số document và byte mỗi policy sẽ xóa"""
+        now = now or datetime.now()
+        report = []
+        for webhook_type, max_age in self.policies.items():
+            cutoff = now - max_age
+            result = self.storage.retention_report(webhook_type, cutoff)
+            report.append({
+                'webhook_type': webhook_type,
+                'max_age_seconds': int(max_age.total_seconds()),
+                'cutoff': cutoff.isoformat(),
+                'documents': result['documents'],
+                'bytes': result['bytes'],
+            })
+        return report
+
+    def run_once(self, now=None):
+        """Archive + xóa toàn bộ document quá hạn, trả về thống kê theo policy"""
+        now = now or datetime.now()
+        summary = []
+        removed_any = False
+        if self.partition_max_age and hasattr(self.storage, 'drop_partitions_before'):
+            dropped = self.storage.drop_partitions_before(now - self.partition_max_age, archive=self.archive)
+            summary.append({'webhook_type': '*', 'dropped_partitions': dropped})
+            removed_any = bool(dropped)
+        for webhook_type, max_age in self.policies.items():
+            cutoff = now - max_age
+            deleted = archived_bytes = 0
+            while not self._stop.is_set():
+                batch = self.storage.find_expired(webhook_type, cutoff, limit=self.batch_size)
+                if not batch:
+                    break
+                if self.archive:
+                    archived_bytes += self.archive.write(batch)
+                deleted += self.storage.delete_by_ids([str(document['_id']) for document in batch])
+                if len(batch) < self.batch_size:
+                    break
+            summary.append({
+                'webhook_type': webhook_type,
+                'cutoff': cutoff.isoformat(),
+                'deleted': deleted,
+                'archived_bytes': archived_bytes,
+            })
+            if deleted:
+                removed_any = True
+                logger.info(f"[SUCCESS] Retention {webhook_type}: deleted {deleted} webhooks older than {cutoff.isoformat()}")
+        if removed_any and self.blob_store is not None and not self._stop.is_set():
+            summary.append({'webhook_type': '*', **self.collect_blobs()})
+        return summary
+
+    def collect_blobs(self):
+        """Mark-and-sweep: mark các key webhook còn tham chiếu, sweep blob còn lại cũ hơn blob_grace"""
+        live_keys = self.storage.live_blob_keys()
+        removed, freed = self.blob_store.sweep(live_keys, min_age=self.blob_grace.total_seconds())
+        if removed:
+            logger.info(f"[SUCCESS] Blob GC: removed {removed} unreferenced blobs ({freed / 1024:.1f} KB)")
+        return {'removed_blobs': removed, 'freed_bytes': freed}
+
+    def start(self, interval):
+        """Chạy pruner định kỳ trong thread nền"""
+        def loop():
+            while not self._stop.wait(interval):
+                try:
+                    self.run_once()
+                except Exception as e:
+                    logger.error(f"[ERROR] Retention pruner error: {e}")
+
+        thread = threading.Thread(target=loop, name='retention-pruner', daemon=True)
+        thread.start()
+        logger.info(f"Retention pruner started (interval={interval}s, policies={list(self.policies)})")
+        return thread
+
+    def stop(self):
+        self._stop.set()
+
+
+def create_pruner(storage, settings):
+    """Tạo pruner theo settings, None nếu không cấu hình policy"""
+    policies = load_policies(settings.retention_policies)
+    if storage is None or not (policies or settings.partition_retention):
+        return None
+    return RetentionPruner(
+        storage,
+        policies,
+        archive_dir=settings.archive_dir or None,
+        batch_size=settings.retention_batch_size,
+        partition_max_age=parse_duration(settings.partition_retention) if settings.partition_retention else None,
+        blob_store=settings.blob_store(),
+        blob_grace=parse_duration(settings.blob_gc_grace),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Retention / archival cho webhooks')
+    parser.add_argument('--dry-run', action='store_true', help='Chỉ báo cáo số document và byte sẽ bị xóa')
+    parser.add_argument('--gc-blobs', action='store_true',
+                        help='Chỉ xóa blob không còn webhook nào tham chiếu (không xóa webhook)')
+    args = parser.parse_args()
+
+    from services import open_storage
+    from settings import Settings
+
+    settings = Settings.from_env()
+    pruner = create_pruner(open_storage(settings), settings)
+    if pruner is None:
+        print("[ERROR] Chưa cấu hình RETENTION_POLICIES hoặc không kết nối được database")
+        return
+
+    if args.gc_blobs:
+        if pruner.blob_store is None:
+            print("[ERROR] BLOB_DIR rỗng, không có blob để dọn")
+            return
+        result = pruner.collect_blobs()
+        print(f"[SUCCESS] Đã xóa {result['removed_blobs']} blob, giải phóng {result['freed_bytes'] / 1024:.1f} KB")
+        return
+
+    if args.dry_run:
+        print("[STATS] Dry-run retention:")
+        for item in pruner.report():
+            print(f"  - {item['webhook_type']}: {item['documents']} documents, "
+                  f"{item['bytes'] / 1024:.1f} KB (cũ hơn {item['cutoff']})")
+        return
+
+    for item in pruner.run_once():
+        if 'dropped_partitions' in item:
+            print(f"[SUCCESS] Đã xóa partitions: {', '.join(item['dropped_partitions']) or 'không có'}")
+            continue
+        if 'removed_blobs' in item:
+            print(f"[SUCCESS] Đã xóa {item['removed_blobs']} blob không còn được tham chiếu, "
+                  f"giải phóng {item['freed_bytes'] / 1024:.1f} KB")
+            continue
+        print(f"[SUCCESS] {item['webhook_type']}: đã xóa {item['deleted']} documents, "
+              f"archive {item['archived_bytes'] / 1024:.1f} KB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,242 @@
+"""
+Profiler lấy mẫu stack (thống kê) cho request path của worker, bật / tắt lúc đang chạy
+
+Một thread nền đọc stack của các thread đang xử lý request (sys._current_frames) mỗi
+`interval` giây và cộng dồn theo stack. Không cần agent bên ngoài và không chậm request
+khi tắt; khi bật, chi phí tỉ lệ với tần suất lấy mẫu chứ không với số lời gọi hàm.
+Mẫu là wall-clock: thời gian chờ I/O (MongoDB, socket) hiện dưới frame đang chờ.
+
+Xuất ra định dạng collapsed stack (`frame;frame;frame count`, dùng được với flamegraph.pl,
+speedscope, inferno) hoặc SVG flame graph tự chứa.
+"""
+
+import html
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+import zlib
+from collections import Counter
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+MAX_STACK_DEPTH = 128
+
+
+def frame_label(code):
+    """Tên frame: hàm (file:dòng định nghĩa), gom mọi mẫu trong cùng một hàm"""
+    filename = code.co_filename
+    parts = filename.replace('\\', '/').rsplit('/', 2)
+    short = '/'.join(parts[-2:]) if 'site-packages' in filename or 'lib/python' in filename else parts[-1]
+    return f'{code.co_name} ({short}:{code.co_firstlineno})'.replace(';', ':')
+
+
+def install_signal(profiler, signal_name):
+    """`kill -<signal> <pid>` bật / tắt profiler của process đó; chỉ đăng ký được ở main thread"""
+    if not signal_name or threading.current_thread() is not threading.main_thread():
+        return False
+    signum = getattr(signal, signal_name.upper())
+    # Toggle trong thread riêng: handler chạy ở main thread, có thể đúng lúc main thread giữ lock của profiler
+    signal.signal(signum, lambda *_: threading.Thread(target=profiler.toggle, daemon=True).start())
+    signal.siginterrupt(signum, False)
+    return True
+
+
+class SamplingProfiler:
+    """Lấy mẫu stack các thread đang xử lý request, cộng dồn theo stack trong một cửa sổ thời gian"""
+
+    def __init__(self, interval=0.01, max_seconds=300, output_dir='profiles'):
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self.output_dir = output_dir
+        self._counts = Counter()
+        self._samples = 0
+        self._active = {}
+        self._labels = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._started_at = None
+        self._ended_at = None
+        self._options = {}
+
+    @property
+    def running(self):
+        # Sau fork, thread lấy mẫu của process cha không tồn tại trong process con
+        return self._pid == os.getpid() and self._thread is not None and self._thread.is_alive()
+
+    # Thread đang xử lý request (gọi từ before / teardown request)
+    def track(self, route):
+        self._active[threading.get_ident()] = route
+
+    def untrack(self):
+        self._active.pop(threading.get_ident(), None)
+
+    def start(self, seconds=30, interval=None, all_threads=False):
+        """Bắt đầu cửa sổ lấy mẫu mới (xóa kết quả cũ); False nếu đang chạy"""
+        with self._lock:
+            if self.running:
+                return False
+            seconds = min(seconds or self.max_seconds, self.max_seconds)
+            interval = interval or self.interval
+            self._counts = Counter()
+            self._samples = 0
+            self._stop = threading.Event()
+            self._pid = os.getpid()
+            self._started_at, self._ended_at = time.time(), None
+            self._options = {'seconds': seconds, 'interval_ms': interval * 1000, 'all_threads': all_threads}
+            self._thread = threading.Thread(
+                target=self._run, args=(self._stop, interval, time.monotonic() + seconds, all_threads),
+                name='sampling-profiler', daemon=True
+            )
+            self._thread.start()
+        logger.info(f"[SUCCESS] Sampling profiler started in process {os.getpid()} ({seconds}s, every {interval * 1000:.0f}ms)")
+        return True
+
+    def stop(self):
+        """Dừng lấy mẫu, giữ kết quả để xuất"""
+        thread = self._thread if self.running else None
+        self._stop.set()
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout=1)
+        return self.status()
+
+    def toggle(self):
+        """Bật nếu đang tắt; tắt và ghi file collapsed nếu đang bật (dùng cho signal)"""
+        if not self.running:
+            self.start()
+            return None
+        self.stop()
+        return self.dump()
+
+    def _run(self, stop, interval, deadline, all_threads):
+        own = threading.get_ident()
+        while not stop.wait(interval) and time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()} if all_threads else None
+            frames = sys._current_frames()
+            active = dict(self._active)
+            stacks = []
+            for ident, frame in frames.items():
+                root = active.get(ident)
+                if root is None:
+                    if names is None or ident == own:
+                        continue
+                    root = f'thread {names.get(ident, ident)}'
+                stacks.append(self._stack(root, frame))
+            frames = frame = None  # Không giữ frame (và biến local của chúng) tới mẫu sau
+            with self._lock:
+                self._counts.update(stacks)
+                self._samples += 1
+        self._ended_at = time.time()
+        logger.info(f"[SUCCESS] Sampling profiler stopped: {self._samples} samples, {len(self._counts)} stacks")
+
+    def _stack(self, root, frame):
+        labels = []
+        while frame is not None and len(labels) < MAX_STACK_DEPTH:
+            code = frame.f_code
+            label = self._labels.get(code)
+            if label is None:
+                label = self._labels[code] = frame_label(code)
+            labels.append(label)
+            frame = frame.f_back
+        labels.append(root)
+        return tuple(reversed(labels))
+
+    # Kết quả
+    def status(self):
+        ended = self._ended_at or time.time()
+        return {
+            'running': self.running,
+            'pid': os.getpid(),
+            'started_at': datetime.fromtimestamp(self._started_at).isoformat() if self._started_at else None,
+            'elapsed_seconds': round(ended - self._started_at, 2) if self._started_at else 0,
+            'samples': self._samples,
+            'stacks': len(self._counts),
+            'active_requests': len(self._active),
+            **self._options,
+        }
+
+    def counts(self):
+        with self._lock:
+            return Counter(self._counts)
+
+    def collapsed(self):
+        """Định dạng collapsed stack, mỗi dòng `root;frame;...;leaf count`"""
+        return ''.join(f"{';'.join(stack)} {count}\n" for stack, count in self.counts().most_common())
+
+    def top(self, limit=30):
+        """Hàm tốn thời gian nhất: self (ở đỉnh stack) và total (có mặt trong stack)"""
+        counts = self.counts()
+        total_samples = sum(counts.values()) or 1
+        self_counts, total_counts = Counter(), Counter()
+        for stack, count in counts.items():
+            self_counts[stack[-1]] += count
+            for label in set(stack[1:]):
+                total_counts[label] += count
+        return [{
+            'function': label,
+            'self': self_counts[label],
+            'total': count,
+            'self_percent': round(self_counts[label] * 100 / total_samples, 1),
+            'total_percent': round(count * 100 / total_samples, 1),
+        } for label, count in total_counts.most_common(limit)]
+
+    def dump(self):
+        """Ghi kết quả collapsed ra output_dir, trả về đường dẫn"""
+        os.makedirs(self.output_dir, exist_ok=True)
+        path = os.path.join(self.output_dir, f"cpu-{os.getpid()}-{datetime.now():%Y%m%d-%H%M%S}.collapsed")
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(self.collapsed())
+        logger.info(f"[SUCCESS] Sampling profile written to {path}")
+        return path
+
+    def flamegraph_svg(self, title='Flame graph', width=1200, row_height=16, min_width=0.5):
+        """SVG flame graph tự chứa (tooltip theo <title>), không cần công cụ ngoài"""
+        root = {'children': {}, 'value': 0}
+        for stack, count in self.counts().items():
+            root['value'] += count
+            node = root
+            for label in stack:
+                node = node['children'].setdefault(label, {'children': {}, 'value': 0})
+                node['value'] += count
+
+        total = root['value'] or 1
+        scale = (width - 20) / total
+        rects, max_depth = [], 0
+        pending = [(root['children'], 10.0, 0)]
+        while pending:
+            children, x, depth = pending.pop()
+            for label, node in sorted(children.items()):
+                node_width = node['value'] * scale
+                if node_width >= min_width:
+                    rects.append((label, node['value'], x, depth, node_width))
+                    max_depth = max(max_depth, depth)
+                    pending.append((node['children'], x, depth + 1))
+                x += node_width
+
+        height = (max_depth + 1) * row_height + 50
+        parts = [
+            f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+            f'font-family="Verdana, sans-serif" font-size="11">',
+            f'<rect width="100%" height="100%" fill="#f8f8f8"/>',
+            f'<text x="{width / 2}" y="20" text-anchor="middle" font-size="15">{html.escape(title)} '
+            f'({total} samples)</text>',
+        ]
+        for label, value, x, depth, node_width in rects:
+            y = height - 10 - (depth + 1) * row_height
+            # Màu ổn định theo tên hàm (dải màu ấm như flamegraph.pl)
+            hue = zlib.crc32(label.encode('utf-8'))
+            color = f'rgb({205 + hue % 50},{(hue >> 8) % 180 + 40},{(hue >> 16) % 55})'
+            text = label if node_width > 7 * len(label) else label[:max(int(node_width / 7) - 2, 0)] + '..'
+            parts.append(
+                f'<g><title>{html.escape(label)} ({value} samples, {value * 100 / total:.1f}%)</title>'
+                f'<rect x="{x:.1f}" y="{y}" width="{node_width:.1f}" height="{row_height - 1}" fill="{color}" rx="2"/>'
+                + (f'<text x="{x + 3:.1f}" y="{y + row_height - 4}">{html.escape(text)}</text>'
+                   if node_width > 21 else '') + '</g>'
+            )
+        parts.append('</svg>')
+        return '\n'.join(parts)
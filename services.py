@@ -0,0 +1,170 @@
+"""
+Các thành phần runtime của API (storage, dispatcher, cache...) và cách khởi tạo chúng.
+
+Không có kết nối nào được mở khi import hay khi tạo app: Services được khởi tạo ở request
+đầu tiên của mỗi process. Khi chạy `gunicorn --preload`, process master chỉ import code,
+mỗi worker sau khi fork tự tạo MongoClient / connection SQLite và thread nền của riêng nó.
+"""
+
+import logging
+import os
+import threading
+import time
+
+from changes import ChangeFeed
+from delivery import DeliveryAggregator
+from durability import read_preference
+from fanout import create_outbound_dispatcher
+from html_render import RenderCache
+from inbox_validators import InboxValidatorCache
+from ingest_queue import PartitionedSpool
+from otp_extractor import OTPExtractor
+from processors import create_dispatcher
+from query_profiler import QueryProfiler
+from retention import create_pruner
+from storage import create_storage, get_mongodb_client
+from subject_categories import SubjectCategorizer
+from tenants import TenantMetrics, TenantQuotas
+
+logger = logging.getLogger(__name__)
+
+
+def open_storage(settings, event_listeners=None):
+    """Kết nối database và tạo index theo settings, None nếu không kết nối được"""
+    mongodb_client = None
+    if settings.storage_backend == 'mongo':
+        mongodb_client = get_mongodb_client(
+            settings.mongodb_uri, timeout_ms=settings.mongodb_timeout_ms, event_listeners=event_listeners
+        )
+    return create_storage(
+        settings,
+        mongodb_client=mongodb_client,
+        read_preference=read_preference(settings.read_preference, settings.max_staleness_seconds),
+    )
+
+
+class Services:
+    """Storage và các thành phần dùng chung của một process"""
+
+    def __init__(self, settings):
+        self.settings = settings
+
+        # QUERY_PROFILING=1: thống kê mọi lệnh MongoDB theo route, truy vấn chậm ở /debug/slow-queries
+        self.query_profiler = QueryProfiler(
+            slow_ms=settings.slow_query_ms,
+            buffer_size=settings.slow_query_buffer,
+            explain_interval=settings.query_explain_interval,
+        ) if settings.query_profiling and settings.storage_backend == 'mongo' else None
+        self.storage = open_storage(
+            settings, event_listeners=[self.query_profiler] if self.query_profiler is not None else None
+        )
+        if self.query_profiler is not None and self.storage is not None:
+            self.query_profiler.attach(self.storage.client)
+
+        # Trích xuất OTP / link xác minh và gắn subject category tại thời điểm ingest
+        self.otp_extractor = OTPExtractor.from_settings(settings)
+        self.subject_categorizer = SubjectCategorizer.from_settings(settings)
+
+        # Processor theo loại webhook; PROCESSING_WORKERS > 0 thì ghi collection riêng trong worker pool
+        self.webhook_dispatcher = create_dispatcher(
+            self.storage, otp_extractor=self.otp_extractor, workers=settings.processing_workers,
+            subject_categorizer=self.subject_categorizer,
+        )
+
+        # Timeline giao nhận theo message-id và bộ đếm theo domain, cập nhật khi event đến
+        self.delivery_aggregator = DeliveryAggregator(self.storage)
+        self.webhook_dispatcher.add_listener('email_event', self.delivery_aggregator.apply)
+
+        # Fan-out webhook mới lưu tới các subscriber đã đăng ký thay cho polling
+        self.outbound_dispatcher = create_outbound_dispatcher(self.storage, settings)
+        self.webhook_dispatcher.add_listener('*', self.outbound_dispatcher.publish)
+
+        # Quota và metrics theo tenant trong process này
+        self.tenant_quotas = TenantQuotas()
+        self.tenant_metrics = TenantMetrics()
+
+        # Profile độ bền khi ghi theo loại webhook (fast | majority | spool)
+        self.durability = settings.durability_policy()
+
+        # INGEST_MODE=queue (hoặc profile spool): đưa payload đã parse vào spool, ingest_worker.py
+        # xử lý và ghi database
+        self.ingest_spool = PartitionedSpool(
+            settings.ingest_spool_dir, settings.ingest_partitions, fsync=settings.spool_fsync
+        ) if settings.ingest_mode == 'queue' or self.durability.uses_spool else None
+
+        # Validator ETag cho các endpoint polling inbox
+        self.inbox_validator_cache = InboxValidatorCache(self.storage, ttl=settings.etag_validator_ttl)
+
+        # Change feed cho mirror / client đồng bộ (/changes)
+        self.change_feed = ChangeFeed(self.storage, settle_seconds=settings.changes_settle_seconds)
+
+        # Cache các variant HTML đã render (safe | text | preview) theo hash nội dung
+        self.html_render_cache = RenderCache(max_chars=settings.render_cache_chars)
+
+        # Retention: pruner chạy nền khi đặt RETENTION_INTERVAL (chỉ bật trên một instance,
+        # hoặc chạy `python retention.py` bằng cron)
+        self.retention_pruner = create_pruner(self.storage, settings)
+        if self.retention_pruner is not None and settings.retention_interval > 0:
+            self.retention_pruner.start(settings.retention_interval)
+
+    def shutdown(self, timeout=10):
+        """Dừng thread nền và gửi nốt các webhook fan-out đang chờ"""
+        if self.retention_pruner is not None:
+            self.retention_pruner.stop()
+        self.webhook_dispatcher.shutdown()
+        self.outbound_dispatcher.shutdown(timeout=timeout)
+        if self.query_profiler is not None:
+            self.query_profiler.shutdown()
+
+
+class ServiceContainer:
+    """
+    Khởi tạo Services lần đầu được dùng trong mỗi process.
+
+    Services được gắn với PID tạo ra nó: sau fork, process con không dùng lại MongoClient /
+    thread pool của process cha (không fork-safe) mà tạo bộ mới. Nếu lần khởi tạo không kết nối
+    được database, request sau `retry_interval` giây sẽ thử kết nối lại thay vì lỗi mãi.
+    """
+
+    def __init__(self, settings, factory=Services, retry_interval=10):
+        self.settings = settings
+        self.factory = factory
+        self.retry_interval = retry_interval
+        self._services = None
+        self._pid = None
+        self._created_at = 0.0
+        self._lock = threading.Lock()
+
+    def _usable(self):
+        services = self._services
+        if services is None or self._pid != os.getpid():
+            return None
+        if services.storage is None and time.monotonic() - self._created_at >= self.retry_interval:
+            return None
+        return services
+
+    def get(self):
+        services = self._usable()
+        if services is not None:
+            return services
+        with self._lock:
+            services = self._usable()
+            if services is not None:
+                return services
+            previous = self._services if self._pid == os.getpid() else None
+            services = self.factory(self.settings)
+            self._services, self._pid, self._created_at = services, os.getpid(), time.monotonic()
+            if previous is not None:
+                previous.shutdown()
+            if services.storage is None:
+                logger.error(f"[ERROR] Cannot connect to database, retry in {self.retry_interval}s")
+            else:
+                logger.info(f"[SUCCESS] Services initialized in process {os.getpid()} ({self.settings.storage_backend})")
+            return services
+
+    def shutdown(self, timeout=10):
+        """Dừng Services của process hiện tại (nếu đã khởi tạo)"""
+        with self._lock:
+            services, self._services = self._services, None
+            if services is not None and self._pid == os.getpid():
+                services.shutdown(timeout=timeout)
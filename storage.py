@@ -0,0 +1,1650 @@
+"""
+Lớp lưu trữ webhook: MongoDB (Atlas) hoặc SQLite nhúng cho triển khai một node
+"""
+
+import json
+import logging
+import re
+import sqlite3
+import threading
+from datetime import datetime
+from email.utils import getaddresses
+
+from bson import ObjectId
+from pymongo import MongoClient, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from blob_store import extract_blob_keys
+from durability import write_concern
+from settings import Settings
+from text_search import SNIPPET_END, SNIPPET_START, build_fts_query, make_snippet, tokenize
+
+logger = logging.getLogger(__name__)
+
+# Định dạng timestamp cố định độ rộng để sắp xếp theo chuỗi trong SQLite
+SQLITE_TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+# Các field của email_data trả về cho API tìm kiếm emails theo người nhận
+EMAIL_SUMMARY_FIELDS = [
+    'from', 'to', 'subject', 'body_plain', 'body_html', 'stripped_text',
+    'stripped_html', 'attachment_count', 'message_id'
+]
+
+EMAIL_SEARCH_PROJECTION = {
+    '_id': 1,
+    'timestamp': 1,
+    **{f'processed_data.email_data.{field}': 1 for field in EMAIL_SUMMARY_FIELDS}
+}
+
+
+# Field cần để gắn lại subject category cho webhook đã lưu
+SUBJECT_CATEGORY_PROJECTION = {
+    'recipient_addresses': 1,
+    'request_form_data.Subject': 1,
+    'request_form_data.subject': 1,
+    'request_form_data.To': 1,
+    'request_form_data.to': 1,
+    'request_form_data.recipient': 1,
+    'processed_data.email_data.to': 1,
+}
+
+# Field cần cho kết quả inbox theo lô (không tải body trừ khi được yêu cầu)
+INBOX_BATCH_PROJECTION = {
+    'timestamp': 1,
+    'recipient_addresses': 1,
+    'otp': 1,
+    'request_form_data.Subject': 1,
+    'request_form_data.subject': 1,
+    'request_form_data.from': 1,
+    'request_form_data.From': 1,
+    'request_form_data.sender': 1,
+}
+
+
+def is_plain_address(recipient):
+    """Chuỗi là một địa chỉ email đầy đủ (không chứa ký tự regex) để tra cứu chính xác qua index"""
+    return '@' in recipient and not re.search(r'[\^$*+?()\[\]{}|\\]', recipient)
+
+
+def timestamp_range_query(since=None, until=None):
+    """Filter MongoDB cho khoảng thời gian [since, until) trên field timestamp"""
+    query = {}
+    if since:
+        query.setdefault('timestamp', {})['$gte'] = since
+    if until:
+        query.setdefault('timestamp', {})['$lt'] = until
+    return query
+
+
+def tenant_query(query, tenant=None):
+    """Thêm điều kiện tenant vào filter MongoDB (None = mọi tenant)"""
+    if tenant is not None:
+        query['tenant'] = tenant
+    return query
+
+
+def mongo_projection(fields, include_id=True):
+    """Tạo projection MongoDB từ danh sách field (dạng a.b.c)"""
+    if not fields:
+        return None if include_id else {'_id': 0}
+    projection = {field: 1 for field in fields}
+    if '_id' not in projection:
+        projection['_id'] = 1 if include_id else 0
+    return projection
+
+
+def project_document(document, fields):
+    """Áp dụng projection (dạng a.b.c) lên document đã đọc, dùng cho backend không hỗ trợ projection"""
+    if not fields or document is None:
+        return document
+    projected = {}
+    for field in fields:
+        source, target = document, projected
+        parts = field.split('.')
+        for part in parts[:-1]:
+            if not isinstance(source, dict) or part not in source:
+                break
+            source = source[part]
+            target = target.setdefault(part, {})
+        else:
+            if isinstance(source, dict) and parts[-1] in source:
+                target[parts[-1]] = source[parts[-1]]
+    if '_id' in document:
+        projected['_id'] = document['_id']
+    return projected
+
+
+def get_form_value(form_data, *keys):
+    """Lấy giá trị đầu tiên khác rỗng trong form data theo danh sách key"""
+    for key in keys:
+        value = form_data.get(key)
+        if value:
+            return value
+    return ''
+
+
+def extract_recipient_addresses(document):
+    """Lấy danh sách địa chỉ người nhận (chữ thường) từ một webhook document"""
+    form_data = document.get('request_form_data') or {}
+    email_data = (document.get('processed_data') or {}).get('email_data') or {}
+    headers = [
+        form_data.get('To', ''),
+        form_data.get('to', ''),
+        form_data.get('recipient', ''),
+        email_data.get('to', ''),
+    ]
+    addresses = []
+    for _, address in getaddresses([h for h in headers if h]):
+        address = address.strip().lower()
+        if address and address not in addresses:
+            addresses.append(address)
+    return addresses
+
+
+def extract_email_fields(document):
+    """Lấy sender/subject/text từ webhook document (ưu tiên header gốc của Mailgun)"""
+    form_data = document.get('request_form_data') or {}
+    return {
+        'sender': get_form_value(form_data, 'sender', 'from', 'From'),
+        'subject': get_form_value(form_data, 'Subject', 'subject'),
+        'text': get_form_value(form_data, 'stripped-text', 'body-plain'),
+    }
+
+
+def inbox_summary(document, include_html=False):
+    """Tóm tắt một inbound email cho kết quả inbox theo lô"""
+    form_data = document.get('request_form_data') or {}
+    summary = {
+        '_id': document['_id'],
+        'timestamp': document.get('timestamp'),
+        'subject': get_form_value(form_data, 'Subject', 'subject'),
+        'from': get_form_value(form_data, 'from', 'From', 'sender'),
+        'otp': document.get('otp'),
+    }
+    if include_html:
+        summary['body_html'] = form_data.get('body-html', '')
+    return summary
+
+
+def subject_category_fields(categories, addresses):
+    """
+    Field lưu subject category của inbound email: mảng `subject_categories` và key
+    `<category>:<địa chỉ>` cho index inbox (MongoDB không index được hai field mảng trong một index)
+    """
+    return {
+        'subject_categories': categories,
+        'subject_category_keys': [f'{category}:{address}' for category in categories for address in addresses],
+    }
+
+
+def categorize_document(document, categorize):
+    """subject_category_fields của một webhook đã lưu (gắn lại category)"""
+    addresses = document.get('recipient_addresses') or extract_recipient_addresses(document)
+    return subject_category_fields(categorize(extract_email_fields(document)['subject']), addresses)
+
+
+class WebhookStorage:
+    """Interface chung cho các backend lưu trữ webhook"""
+
+    name = 'base'
+
+    def ping(self):
+        """Kiểm tra kết nối tới backend, raise exception nếu lỗi"""
+        raise NotImplementedError
+
+    def ensure_indexes(self):
+        """Tạo các index cần thiết (idempotent)"""
+        raise NotImplementedError
+
+    def insert(self, document, durability=None):
+        """Lưu một webhook, trả về ID dạng chuỗi (durability: profile ghi fast | majority, xem durability.py)"""
+        raise NotImplementedError
+
+    def insert_many(self, documents, durability=None):
+        """
+        Lưu nhiều webhook trong một lần ghi, trả về danh sách ID đã thực sự ghi; document có _id
+        hoặc ingest_id đã tồn tại được bỏ qua (ghi lại batch của ingest worker / mirror không tạo bản trùng)
+        """
+        raise NotImplementedError
+
+    def find_by_id(self, webhook_id, webhook_type=None, fields=None, tenant=None):
+        """Lấy webhook theo ID (có thể lọc thêm theo loại / tenant và chỉ lấy một số field)"""
+        raise NotImplementedError
+
+    def list_webhooks(self, limit=50, skip=0, fields=None, since=None, until=None, tenant=None):
+        """
+        Danh sách webhooks mới nhất, có thể giới hạn khoảng thời gian [since, until) và tenant
+        (không có _id trừ khi được yêu cầu trong fields)
+        """
+        raise NotImplementedError
+
+    def list_changes(self, after_id=None, before_id=None, limit=100, fields=None, tenant=None):
+        """
+        Webhooks có after_id < _id < before_id theo thứ tự _id tăng dần (document đầy đủ, hoặc chỉ
+        `fields` nếu có; luôn có _id), chỉ của `tenant` nếu có
+        """
+        raise NotImplementedError
+
+    def newest_id(self):
+        """_id lớn nhất đã lưu (chuỗi) hoặc None nếu chưa có webhook"""
+        raise NotImplementedError
+
+    def search_by_recipient(self, to_email, limit=50, skip=0, tenant=None):
+        """Tìm emails theo người nhận, trả về các field tóm tắt"""
+        raise NotImplementedError
+
+    def find_inbox(self, recipient, subject_filter=None, limit=50, skip=0, category=None, tenant=None):
+        """
+        Lấy emails trong inbox theo người nhận (chỉ body-html), lọc theo subject category đã gắn
+        khi ingest (tra index) và / hoặc regex subject (quét); chỉ email của `tenant` nếu có
+        """
+        raise NotImplementedError
+
+    def find_inbox_batch(self, recipients, subject_filter=None, since=None, limit=5, include_html=False, category=None,
+                         tenant=None):
+        """
+        Inbox của nhiều địa chỉ (đã chuẩn hóa chữ thường) trong một truy vấn, chỉ email của `tenant` nếu có.
+        Trả về {address: [email, ...]} mới nhất trước, tối đa `limit` email mỗi địa chỉ;
+        mỗi email gồm _id, timestamp, subject, from, otp (và body_html nếu include_html).
+        """
+        raise NotImplementedError
+
+    def tag_subject_categories(self, categorize, retag=False, batch_size=500):
+        """
+        Gắn subject category cho inbound email đã lưu (chưa có category, hoặc tất cả nếu retag);
+        `categorize(subject)` trả về danh sách category. Trả về số email đã gắn.
+        """
+        raise NotImplementedError
+
+    def search_text(self, query, limit=20, cursor=None, tenant=None):
+        """
+        Full-text search trên subject, stripped-text và sender của inbound emails.
+        Trả về (results, next_cursor) với results đã xếp hạng, mỗi phần tử gồm
+        _id, timestamp, subject, sender, score, snippet; cursor là tuple (score, id).
+        """
+        raise NotImplementedError
+
+    def inbox_validator(self, recipient, tenant=None):
+        """
+        Thông tin rẻ để làm validator cho inbox của một địa chỉ:
+        {'count', 'newest_id', 'newest'} của các inbound email (của `tenant` nếu có) gửi tới địa chỉ đó.
+        """
+        raise NotImplementedError
+
+    def latest_code(self, recipient, since=None, tenant=None):
+        """
+        Mã xác minh mới nhất đã trích xuất cho một người nhận (trong email của `tenant` nếu có).
+        Trả về {'_id', 'timestamp', 'otp'} hoặc None.
+        """
+        raise NotImplementedError
+
+    def references_blob(self, key, tenant=None):
+        """Có webhook (của `tenant` nếu có) tham chiếu blob `key` không"""
+        raise NotImplementedError
+
+    def live_blob_keys(self):
+        """Tập key của mọi blob còn được webhook tham chiếu (pha mark của GC blob)"""
+        raise NotImplementedError
+
+    def retention_report(self, webhook_type, cutoff):
+        """Số document và tổng dung lượng (byte) của một loại webhook cũ hơn cutoff"""
+        raise NotImplementedError
+
+    def find_expired(self, webhook_type, cutoff, limit=500):
+        """Lấy tối đa `limit` document cũ hơn cutoff (cũ nhất trước) để archive / xóa"""
+        raise NotImplementedError
+
+    def delete_by_ids(self, ids):
+        """Xóa webhooks theo danh sách ID, trả về số document đã xóa"""
+        raise NotImplementedError
+
+    def stats(self, tenant=None):
+        """Thống kê số lượng webhook theo loại"""
+        raise NotImplementedError
+
+    def ensure_record_indexes(self, collection, indexes):
+        """Tạo index cho collection bản ghi riêng của một loại webhook (danh sách key của index)"""
+        raise NotImplementedError
+
+    def insert_records(self, collection, records, key_field=None):
+        """
+        Lưu bản ghi đã xử lý của một loại webhook vào collection riêng.
+        `key_field` là field được tra cứu bằng find_records (backend không có index tùy ý dùng để index).
+        """
+        raise NotImplementedError
+
+    def find_records(self, collection, key_field, key, limit=50):
+        """Bản ghi có `key_field` bằng key trong collection riêng, mới nhất trước"""
+        raise NotImplementedError
+
+    def save_subscription(self, subscription):
+        """Lưu subscription fan-out, trả về ID dạng chuỗi"""
+        raise NotImplementedError
+
+    def list_subscriptions(self):
+        """Toàn bộ subscription fan-out"""
+        raise NotImplementedError
+
+    def delete_subscription(self, subscription_id):
+        """Xóa subscription, trả về True nếu tồn tại"""
+        raise NotImplementedError
+
+    def upsert_message_event(self, event, timeline_limit=50):
+        """
+        Gộp một delivery event vào state của message (theo event['message_id']).
+        Trả về True nếu đây là lần đầu message có loại event này.
+        """
+        raise NotImplementedError
+
+    def find_message_state(self, message_id, tenant=None):
+        """State của message (của `tenant` nếu có): recipient, domain, events, counts, timeline; None nếu chưa có"""
+        raise NotImplementedError
+
+    def increment_domain_counter(self, domain, bucket, event, tenant=''):
+        """Tăng bộ đếm event của domain (trong tenant) trong bucket thời gian"""
+        raise NotImplementedError
+
+    def domain_counters(self, since, domain=None, tenant=None):
+        """Các bucket từ since (chỉ của `tenant` nếu có): danh sách {'domain', 'bucket', 'counts'}"""
+        raise NotImplementedError
+
+
+class MongoWebhookStorage(WebhookStorage):
+    """Backend MongoDB (Atlas)"""
+
+    name = 'mongo'
+
+    def __init__(self, client, db_name='mailgun_webhooks', collection_name='webhooks', read_preference=None):
+        self.client = client
+        self.db = client[db_name]
+        self.collection = self.db[collection_name]
+        # Danh sách / tìm kiếm / thống kê đọc theo READ_PREFERENCE (có thể từ secondary);
+        # inbox, OTP và change feed luôn đọc primary để thấy webhook vừa ghi
+        self.reader = self.collection.with_options(read_preference=read_preference) if read_preference else self.collection
+        self._writers = {}
+
+    def _writer(self, durability):
+        """Collection với write concern của profile (cache theo profile)"""
+        concern = write_concern(durability)
+        if concern is None:
+            return self.collection
+        writer = self._writers.get(durability)
+        if writer is None:
+            writer = self._writers[durability] = self.collection.with_options(write_concern=concern)
+        return writer
+
+    def ping(self):
+        self.client.admin.command('ping')
+
+    def ensure_indexes(self):
+        self.collection.create_index([('timestamp', -1)])
+        self.collection.create_index([('webhook_type', 1), ('timestamp', -1)])
+        # Text index duy nhất của collection, không stemming để khớp cả tiếng Việt / mã OTP
+        self.collection.create_index(
+            [
+                ('request_form_data.Subject', 'text'),
+                ('request_form_data.subject', 'text'),
+                ('request_form_data.stripped-text', 'text'),
+                ('request_form_data.sender', 'text'),
+            ],
+            name='email_text',
+            weights={
+                'request_form_data.Subject': 10,
+                'request_form_data.subject': 10,
+                'request_form_data.sender': 3,
+                'request_form_data.stripped-text': 1,
+            },
+            default_language='none',
+            partialFilterExpression={'webhook_type': 'inbound_email'}
+        )
+        # Inbox theo địa chỉ người nhận đã chuẩn hóa
+        self.collection.create_index(
+            [('recipient_addresses', 1), ('webhook_type', 1), ('timestamp', -1)],
+            name='recipient_lookup'
+        )
+        # Tra cứu OTP mới nhất theo người nhận, chỉ index các email có mã
+        self.collection.create_index(
+            [('recipient_addresses', 1), ('timestamp', -1)],
+            name='otp_lookup',
+            partialFilterExpression={'otp': {'$exists': True}}
+        )
+        # Inbox theo subject category: một key `<category>:<địa chỉ>` thay cho regex subject
+        self.collection.create_index([('subject_category_keys', 1), ('timestamp', -1)], name='category_lookup')
+        # Tenant đứng đầu index: truy vấn của một tenant chỉ quét dữ liệu của tenant đó
+        # (inbox theo regex người nhận dùng tenant_type_timestamp)
+        self.collection.create_index([('tenant', 1), ('timestamp', -1)], name='tenant_timestamp')
+        self.collection.create_index(
+            [('tenant', 1), ('webhook_type', 1), ('timestamp', -1)], name='tenant_type_timestamp'
+        )
+        self.collection.create_index(
+            [('tenant', 1), ('recipient_addresses', 1), ('webhook_type', 1), ('timestamp', -1)],
+            name='tenant_recipient_lookup'
+        )
+        self.collection.create_index(
+            [('tenant', 1), ('subject_category_keys', 1), ('timestamp', -1)], name='tenant_category_lookup'
+        )
+        self.collection.create_index(
+            [('tenant', 1), ('recipient_addresses', 1), ('timestamp', -1)],
+            name='tenant_otp_lookup',
+            partialFilterExpression={'otp': {'$exists': True}}
+        )
+        self.collection.create_index([('tenant', 1), ('_id', 1)], name='tenant_changes')
+        # Khóa idempotency của ingest worker: batch ghi lại không tạo bản trùng
+        self.collection.create_index(
+            'ingest_id', name='ingest_id_unique', unique=True, partialFilterExpression={'ingest_id': {'$exists': True}}
+        )
+        # Blob (file đính kèm / field bị cắt) thuộc tenant nào, và blob nào còn được tham chiếu
+        self.collection.create_index(
+            [('blob_keys', 1), ('tenant', 1)],
+            name='blob_lookup',
+            partialFilterExpression={'blob_keys': {'$exists': True}}
+        )
+        self.ensure_delivery_indexes()
+
+    def ensure_delivery_indexes(self):
+        """Index cho bộ đếm domain (message_states tra cứu theo _id)"""
+        self.db.domain_stats.create_index([('bucket', 1), ('domain', 1)])
+        self.db.domain_stats.create_index([('domain', 1), ('bucket', 1)])
+        self.db.domain_stats.create_index([('tenant', 1), ('bucket', 1), ('domain', 1)])
+
+    def insert(self, document, durability=None):
+        result = self._writer(durability).insert_one(document)
+        return str(result.inserted_id)
+
+    def insert_many(self, documents, durability=None):
+        if not documents:
+            return []
+        skipped = set()
+        try:
+            self._writer(durability).insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            # ordered=False: document mới vẫn được ghi, chỉ bỏ qua lỗi trùng _id / ingest_id (11000)
+            errors = e.details.get('writeErrors', [])
+            if any(error.get('code') != 11000 for error in errors) or e.details.get('writeConcernErrors'):
+                raise
+            skipped = {error['index'] for error in errors}
+            logger.warning(f"[WARNING] Skipped {len(skipped)} webhooks already stored")
+        return [str(document['_id']) for index, document in enumerate(documents) if index not in skipped]
+
+    def find_by_id(self, webhook_id, webhook_type=None, fields=None, tenant=None):
+        query = {'_id': ObjectId(webhook_id)}
+        if webhook_type:
+            query['webhook_type'] = webhook_type
+        return self.collection.find_one(tenant_query(query, tenant), mongo_projection(fields))
+
+    def list_webhooks(self, limit=50, skip=0, fields=None, since=None, until=None, tenant=None):
+        return list(self.reader.find(
+            tenant_query(timestamp_range_query(since, until), tenant),
+            mongo_projection(fields, include_id=False)  # Loại bỏ _id field
+        ).sort('timestamp', -1).skip(skip).limit(limit))
+
+    def list_changes(self, after_id=None, before_id=None, limit=100, fields=None, tenant=None):
+        id_range = {}
+        if after_id:
+            id_range['$gt'] = ObjectId(after_id)
+        if before_id:
+            id_range['$lt'] = ObjectId(before_id)
+        query = tenant_query({'_id': id_range} if id_range else {}, tenant)
+        return list(self.collection.find(query, mongo_projection(fields)).sort('_id', 1).limit(limit))
+
+    def newest_id(self):
+        newest = self.collection.find_one({}, {'_id': 1}, sort=[('_id', -1)])
+        return str(newest['_id']) if newest else None
+
+    def search_by_recipient(self, to_email, limit=50, skip=0, tenant=None):
+        query = {
+            'webhook_type': 'inbound_email',
+            'processed_data.email_data.to': {'$regex': to_email, '$options': 'i'}  # Case-insensitive search
+        }
+        return list(self.reader.find(
+            tenant_query(query, tenant),
+            EMAIL_SEARCH_PROJECTION
+        ).sort('timestamp', -1).skip(skip).limit(limit))
+
+    def find_inbox(self, recipient, subject_filter=None, limit=50, skip=0, category=None, tenant=None):
+        address = recipient.strip().lower()
+        if category and is_plain_address(address):
+            # Truy vấn bằng trên index category_lookup (tenant_category_lookup nếu có tenant)
+            query = {'subject_category_keys': f'{category}:{address}'}
+        else:
+            # Địa chỉ đầy đủ: truy vấn bằng trên index recipient_lookup như find_inbox_batch;
+            # chuỗi không phải địa chỉ là regex trên các địa chỉ đã chuẩn hóa (như SQLite)
+            recipient_filter = address if is_plain_address(address) else {'$regex': address, '$options': 'i'}
+            query = {'recipient_addresses': recipient_filter, 'webhook_type': 'inbound_email'}
+            if category:
+                query['subject_categories'] = category
+        if subject_filter:
+            query['request_form_data.Subject'] = {'$regex': subject_filter, '$options': 'i'}
+        return list(self.collection.find(
+            tenant_query(query, tenant),
+            {
+                '_id': 1,
+                'request_form_data.body-html': 1
+            }
+        ).sort('timestamp', -1).skip(skip).limit(limit))
+
+    def find_inbox_batch(self, recipients, subject_filter=None, since=None, limit=5, include_html=False, category=None,
+                         tenant=None):
+        results = {address: [] for address in recipients}
+        def recipient_query(addresses):
+            if category:
+                query = {'subject_category_keys': {'$in': [f'{category}:{address}' for address in addresses]}}
+            else:
+                query = {'recipient_addresses': {'$in': addresses}, 'webhook_type': 'inbound_email'}
+            if subject_filter:
+                query['request_form_data.Subject'] = {'$regex': subject_filter, '$options': 'i'}
+            if since:
+                query['timestamp'] = {'$gte': since}
+            return tenant_query(query, tenant)
+
+        projection = dict(INBOX_BATCH_PROJECTION)
+        if include_html:
+            projection['request_form_data.body-html'] = 1
+        # Một truy vấn $in trên index recipient_lookup (category_lookup nếu lọc theo category),
+        # đọc mới nhất trước tới khi mọi địa chỉ đủ limit. Cursor bị chặn ở limit * số địa chỉ:
+        # một địa chỉ nhận rất nhiều email không kéo cả lịch sử của nó về
+        max_scan = limit * len(results)
+        pending, scanned = len(results), 0
+        cursor = self.collection.find(recipient_query(list(results)), projection).sort('timestamp', -1).limit(max_scan)
+        for document in cursor:
+            scanned += 1
+            for address in document.get('recipient_addresses') or []:
+                emails = results.get(address)
+                if emails is None or len(emails) >= limit:
+                    continue
+                emails.append(inbox_summary(document, include_html))
+                if len(emails) == limit:
+                    pending -= 1
+            if not pending:
+                break
+        if pending and scanned == max_scan:
+            # Hết giới hạn mà còn địa chỉ chưa đủ: truy vấn riêng từng địa chỉ đó (tối đa limit email)
+            for address, emails in results.items():
+                if len(emails) < limit:
+                    results[address] = [
+                        inbox_summary(document, include_html) for document in self.collection.find(
+                            recipient_query([address]), projection
+                        ).sort('timestamp', -1).limit(limit)
+                    ]
+        return results
+
+    def tag_subject_categories(self, categorize, retag=False, batch_size=500):
+        query = {'webhook_type': 'inbound_email'}
+        if not retag:
+            query['subject_categories'] = {'$exists': False}
+        tagged, last_id = 0, None
+        while True:
+            page = dict(query, _id={'$gt': last_id}) if last_id else query
+            documents = list(self.collection.find(page, SUBJECT_CATEGORY_PROJECTION).sort('_id', 1).limit(batch_size))
+            if not documents:
+                return tagged
+            self.collection.bulk_write([
+                UpdateOne({'_id': document['_id']}, {'$set': categorize_document(document, categorize)})
+                for document in documents
+            ], ordered=False)
+            tagged += len(documents)
+            last_id = documents[-1]['_id']
+
+    def search_text(self, query, limit=20, cursor=None, tenant=None):
+        pipeline = [
+            {'$match': tenant_query({'webhook_type': 'inbound_email', '$text': {'$search': query}}, tenant)},
+            {'$addFields': {'_score': {'$meta': 'textScore'}}},
+        ]
+        if cursor:
+            score, last_id = cursor
+            pipeline.append({'$match': {'$or': [
+                {'_score': {'$lt': score}},
+                {'_score': score, '_id': {'$lt': ObjectId(last_id)}},
+            ]}})
+        pipeline += [
+            {'$sort': {'_score': -1, '_id': -1}},
+            {'$limit': limit + 1},
+            {'$project': {
+                'timestamp': 1,
+                '_score': 1,
+                'request_form_data.Subject': 1,
+                'request_form_data.subject': 1,
+                'request_form_data.sender': 1,
+                'request_form_data.stripped-text': 1,
+            }},
+        ]
+        documents = list(self.reader.aggregate(pipeline))
+
+        terms = tokenize(query)
+        results = []
+        for document in documents[:limit]:
+            fields = extract_email_fields(document)
+            results.append({
+                '_id': document['_id'],
+                'timestamp': document.get('timestamp'),
+                'subject': fields['subject'],
+                'sender': fields['sender'],
+                'score': document['_score'],
+                'snippet': make_snippet(fields['text'] or fields['subject'], terms),
+            })
+        next_cursor = None
+        if len(documents) > limit and results:
+            next_cursor = (results[-1]['score'], str(results[-1]['_id']))
+        return results, next_cursor
+
+    def inbox_validator(self, recipient, tenant=None):
+        query = tenant_query({'recipient_addresses': recipient.strip().lower(), 'webhook_type': 'inbound_email'}, tenant)
+        newest = self.collection.find_one(query, {'timestamp': 1}, sort=[('timestamp', -1)])
+        return {
+            'count': self.collection.count_documents(query) if newest else 0,
+            'newest_id': str(newest['_id']) if newest else None,
+            'newest': newest['timestamp'] if newest else None,
+        }
+
+    def latest_code(self, recipient, since=None, tenant=None):
+        query = tenant_query({'recipient_addresses': recipient.strip().lower(), 'otp': {'$exists': True}}, tenant)
+        if since:
+            query['timestamp'] = {'$gte': since}
+        return self.collection.find_one(query, {'otp': 1, 'timestamp': 1}, sort=[('timestamp', -1)])
+
+    def references_blob(self, key, tenant=None):
+        return self.collection.find_one(tenant_query({'blob_keys': key}, tenant), {'_id': 1}) is not None
+
+    def live_blob_keys(self):
+        # Webhook ghi trước khi có blob_keys chỉ có key trong request_files / request_blobs
+        query = {'$or': [
+            {'blob_keys': {'$exists': True}},
+            {'request_blobs': {'$exists': True}},
+            {'request_files': {'$nin': [{}, None]}},
+        ]}
+        keys = set()
+        for document in self.collection.find(query, {'blob_keys': 1, 'request_files': 1, 'request_blobs': 1}):
+            keys.update(document.get('blob_keys') or extract_blob_keys(document))
+        return keys
+
+    def retention_report(self, webhook_type, cutoff):
+        rows = list(self.collection.aggregate([
+            {'$match': {'webhook_type': webhook_type, 'timestamp': {'$lt': cutoff}}},
+            {'$group': {'_id': None, 'documents': {'$sum': 1}, 'bytes': {'$sum': {'$bsonSize': '$$ROOT'}}}},
+        ]))
+        if not rows:
+            return {'documents': 0, 'bytes': 0}
+        return {'documents': rows[0]['documents'], 'bytes': rows[0]['bytes']}
+
+    def find_expired(self, webhook_type, cutoff, limit=500):
+        return list(self.collection.find(
+            {'webhook_type': webhook_type, 'timestamp': {'$lt': cutoff}}
+        ).sort('timestamp', 1).limit(limit))
+
+    def delete_by_ids(self, ids):
+        if not ids:
+            return 0
+        result = self.collection.delete_many({'_id': {'$in': [ObjectId(i) for i in ids]}})
+        return result.deleted_count
+
+    def stats(self, tenant=None):
+        query = tenant_query({}, tenant)
+        by_type = {}
+        for row in self.reader.aggregate([
+            {'$match': query},
+            {'$group': {'_id': '$webhook_type', 'count': {'$sum': 1}}}
+        ]):
+            by_type[row['_id'] or 'unknown'] = row['count']
+        newest = self.reader.find_one(query, {'timestamp': 1}, sort=[('timestamp', -1)])
+        oldest = self.reader.find_one(query, {'timestamp': 1}, sort=[('timestamp', 1)])
+        return {
+            'total': sum(by_type.values()),
+            'by_type': by_type,
+            'newest': newest['timestamp'] if newest else None,
+            'oldest': oldest['timestamp'] if oldest else None,
+        }
+
+    def ensure_record_indexes(self, collection, indexes):
+        for keys in indexes:
+            self.db[collection].create_index(keys)
+
+    def insert_records(self, collection, records, key_field=None):
+        if records:
+            self.db[collection].insert_many(records, ordered=False)
+
+    def find_records(self, collection, key_field, key, limit=50):
+        return list(self.db[collection].find({key_field: key}, {'_id': 0}).sort('timestamp', -1).limit(limit))
+
+    def save_subscription(self, subscription):
+        return str(self.db.subscriptions.insert_one(subscription).inserted_id)
+
+    def list_subscriptions(self):
+        return list(self.db.subscriptions.find().sort('created_at', 1))
+
+    def delete_subscription(self, subscription_id):
+        return self.db.subscriptions.delete_one({'_id': ObjectId(subscription_id)}).deleted_count > 0
+
+    def upsert_message_event(self, event, timeline_limit=50):
+        name = event['event']
+        timestamp = event['timestamp']
+        entry = {key: event[key] for key in ('event', 'timestamp', 'severity', 'reason', 'webhook_id')}
+        # Một lệnh atomic; $min / $max / $push + $sort cho kết quả như nhau bất kể thứ tự event đến
+        previous = self.db.message_states.find_one_and_update(
+            {'_id': event['message_id']},
+            {
+                '$setOnInsert': {
+                    'recipient': event['recipient'], 'domain': event['domain'], 'tenant': event.get('tenant') or '',
+                },
+                '$min': {'first_event_at': timestamp, f'events.{name}': timestamp},
+                '$max': {'last_event_at': timestamp},
+                '$inc': {f'counts.{name}': 1},
+                '$push': {'timeline': {'$each': [entry], '$sort': {'timestamp': 1}, '$slice': -timeline_limit}},
+            },
+            projection={f'events.{name}': 1},
+            upsert=True,
+            return_document=ReturnDocument.BEFORE,
+        )
+        return previous is None or name not in (previous.get('events') or {})
+
+    def find_message_state(self, message_id, tenant=None):
+        state = self.db.message_states.find_one(tenant_query({'_id': message_id}, tenant))
+        if state is not None:
+            state['message_id'] = state.pop('_id')
+        return state
+
+    def increment_domain_counter(self, domain, bucket, event, tenant=''):
+        key = f'{domain}|{bucket:%Y%m%d%H%M}'
+        self.db.domain_stats.update_one(
+            # Bộ đếm không thuộc tenant nào giữ _id cũ
+            {'_id': f'{tenant}|{key}' if tenant else key},
+            {'$setOnInsert': {'domain': domain, 'bucket': bucket, 'tenant': tenant}, '$inc': {f'counts.{event}': 1}},
+            upsert=True
+        )
+
+    def domain_counters(self, since, domain=None, tenant=None):
+        query = {'bucket': {'$gte': since}}
+        if domain:
+            query['domain'] = domain
+        return list(self.db.domain_stats.find(tenant_query(query, tenant), {'_id': 0, 'tenant': 0}))
+
+
+def json_default(value):
+    """Chuyển các kiểu không phải JSON (datetime, ObjectId, bytes) khi serialize document"""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value).decode('utf-8', errors='replace')
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def _sqlite_regexp(pattern, value):
+    """Hàm REGEXP cho SQLite, tương đương $regex với $options: 'i' của MongoDB"""
+    if value is None:
+        return False
+    return _compile_regex(pattern).search(value) is not None
+
+
+_regex_cache = {}
+
+
+def _compile_regex(pattern):
+    compiled = _regex_cache.get(pattern)
+    if compiled is None:
+        if len(_regex_cache) > 256:
+            _regex_cache.clear()
+        compiled = _regex_cache[pattern] = re.compile(pattern, re.IGNORECASE)
+    return compiled
+
+
+class SQLiteWebhookStorage(WebhookStorage):
+    """
+    Backend SQLite nhúng (WAL) cho triển khai một node và môi trường test.
+
+    Document gốc được lưu dạng JSON; các field cần truy vấn (timestamp, loại,
+    sender, subject, người nhận) được tách ra cột riêng có index.
+    """
+
+    name = 'sqlite'
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS webhooks (
+            id TEXT PRIMARY KEY,
+            ts TEXT NOT NULL,
+            webhook_type TEXT NOT NULL,
+            sender TEXT NOT NULL DEFAULT '',
+            subject TEXT NOT NULL DEFAULT '',
+            document TEXT NOT NULL,
+            tenant TEXT NOT NULL DEFAULT '',
+            ingest_id TEXT
+        );
+        CREATE TABLE IF NOT EXISTS webhook_recipients (
+            address TEXT NOT NULL,
+            ts TEXT NOT NULL,
+            webhook_id TEXT NOT NULL,
+            PRIMARY KEY (address, ts, webhook_id)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS webhook_codes (
+            address TEXT NOT NULL,
+            ts TEXT NOT NULL,
+            webhook_id TEXT NOT NULL,
+            otp TEXT NOT NULL,
+            PRIMARY KEY (address, ts, webhook_id)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS webhook_categories (
+            address TEXT NOT NULL,
+            category TEXT NOT NULL,
+            ts TEXT NOT NULL,
+            webhook_id TEXT NOT NULL,
+            PRIMARY KEY (address, category, ts, webhook_id)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS webhook_blobs (
+            blob TEXT NOT NULL,
+            webhook_id TEXT NOT NULL,
+            PRIMARY KEY (blob, webhook_id)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS webhook_records (
+            collection TEXT NOT NULL,
+            record_key TEXT NOT NULL,
+            ts TEXT NOT NULL,
+            webhook_id TEXT NOT NULL,
+            document TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS subscriptions (
+            id TEXT PRIMARY KEY,
+            document TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS message_states (
+            message_id TEXT PRIMARY KEY,
+            recipient TEXT NOT NULL,
+            domain TEXT NOT NULL,
+            first_event_at TEXT NOT NULL,
+            last_event_at TEXT NOT NULL,
+            state TEXT NOT NULL,
+            tenant TEXT NOT NULL DEFAULT ''
+        );
+        CREATE TABLE IF NOT EXISTS domain_stats (
+            tenant TEXT NOT NULL DEFAULT '',
+            domain TEXT NOT NULL,
+            bucket TEXT NOT NULL,
+            event TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (tenant, domain, bucket, event)
+        ) WITHOUT ROWID;
+        CREATE VIRTUAL TABLE IF NOT EXISTS webhooks_fts USING fts5(
+            subject, body, sender,
+            webhook_id UNINDEXED,
+            tokenize = 'unicode61 remove_diacritics 2'
+        );
+    """
+
+    # Trọng số bm25 theo thứ tự cột: subject, body, sender
+    FTS_RANK = 'bm25(webhooks_fts, 10.0, 1.0, 3.0)'
+
+    INDEXES = """
+        CREATE INDEX IF NOT EXISTS idx_webhooks_ts ON webhooks (ts);
+        CREATE INDEX IF NOT EXISTS idx_webhooks_type_ts ON webhooks (webhook_type, ts);
+        CREATE INDEX IF NOT EXISTS idx_webhooks_tenant_ts ON webhooks (tenant, ts);
+        CREATE INDEX IF NOT EXISTS idx_webhooks_tenant_type_ts ON webhooks (tenant, webhook_type, ts);
+        CREATE INDEX IF NOT EXISTS idx_webhooks_tenant_id ON webhooks (tenant, id);
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_webhooks_ingest_id ON webhooks (ingest_id) WHERE ingest_id IS NOT NULL;
+        CREATE INDEX IF NOT EXISTS idx_recipients_webhook ON webhook_recipients (webhook_id);
+        CREATE INDEX IF NOT EXISTS idx_codes_webhook ON webhook_codes (webhook_id);
+        CREATE INDEX IF NOT EXISTS idx_categories_webhook ON webhook_categories (webhook_id);
+        CREATE INDEX IF NOT EXISTS idx_blobs_webhook ON webhook_blobs (webhook_id);
+        CREATE INDEX IF NOT EXISTS idx_records_key ON webhook_records (collection, record_key, ts);
+        CREATE INDEX IF NOT EXISTS idx_records_webhook ON webhook_records (webhook_id);
+        CREATE INDEX IF NOT EXISTS idx_domain_stats_bucket ON domain_stats (bucket);
+    """
+
+    def __init__(self, path='webhooks.db'):
+        self.path = path
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self.ensure_indexes()
+
+    def _connect(self):
+        """Mỗi thread dùng một connection riêng (sqlite3 không chia sẻ connection giữa các thread)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA temp_store=MEMORY')
+            conn.execute('PRAGMA cache_size=-16000')
+            conn.create_function('REGEXP', 2, _sqlite_regexp, deterministic=True)
+            self._local.conn = conn
+        return conn
+
+    def ping(self):
+        self._connect().execute('SELECT 1').fetchone()
+
+    def ensure_indexes(self):
+        conn = self._connect()
+        conn.executescript(self.SCHEMA)
+        # Database tạo trước khi có cột tenant (webhook cũ không thuộc tenant nào)
+        columns = {row['name'] for row in conn.execute('PRAGMA table_info(webhooks)')}
+        if 'tenant' not in columns:
+            conn.execute("ALTER TABLE webhooks ADD COLUMN tenant TEXT NOT NULL DEFAULT ''")
+        if 'ingest_id' not in columns:
+            conn.execute('ALTER TABLE webhooks ADD COLUMN ingest_id TEXT')
+        self._migrate_delivery_tenant(conn)
+        conn.executescript(self.INDEXES)
+        self._backfill_fts(conn)
+        self._backfill_blobs(conn)
+
+    @staticmethod
+    def _migrate_delivery_tenant(conn):
+        """Thêm tenant cho message_states / domain_stats của database tạo trước khi có tenant"""
+        if 'tenant' not in {row['name'] for row in conn.execute('PRAGMA table_info(message_states)')}:
+            conn.execute("ALTER TABLE message_states ADD COLUMN tenant TEXT NOT NULL DEFAULT ''")
+        if 'tenant' not in {row['name'] for row in conn.execute('PRAGMA table_info(domain_stats)')}:
+            # tenant nằm trong khóa chính: dựng lại bảng, bộ đếm cũ không thuộc tenant nào
+            conn.executescript("""
+                BEGIN;
+                ALTER TABLE domain_stats RENAME TO domain_stats_old;
+                CREATE TABLE domain_stats (
+                    tenant TEXT NOT NULL DEFAULT '',
+                    domain TEXT NOT NULL,
+                    bucket TEXT NOT NULL,
+                    event TEXT NOT NULL,
+                    count INTEGER NOT NULL,
+                    PRIMARY KEY (tenant, domain, bucket, event)
+                ) WITHOUT ROWID;
+                INSERT INTO domain_stats (tenant, domain, bucket, event, count)
+                    SELECT '', domain, bucket, event, count FROM domain_stats_old;
+                DROP TABLE domain_stats_old;
+                COMMIT;
+            """)
+
+    def _backfill_fts(self, conn):
+        """Đánh index full-text cho database tạo trước khi có bảng FTS"""
+        if conn.execute('SELECT 1 FROM webhooks_fts LIMIT 1').fetchone():
+            return
+        if not conn.execute("SELECT 1 FROM webhooks WHERE webhook_type = 'inbound_email' LIMIT 1").fetchone():
+            return
+        logger.info("Backfill SQLite full-text index...")
+        conn.execute(
+            'INSERT INTO webhooks_fts (rowid, subject, body, sender, webhook_id) '
+            'SELECT rowid, subject, '
+            "COALESCE(json_extract(document, '$.request_form_data.\"stripped-text\"'), "
+            "json_extract(document, '$.request_form_data.\"body-plain\"'), ''), "
+            "sender, id FROM webhooks WHERE webhook_type = 'inbound_email'"
+        )
+
+    def _backfill_blobs(self, conn):
+        """Bảng webhook_blobs cho database tạo trước khi có bảng này"""
+        if conn.execute('SELECT 1 FROM webhook_blobs LIMIT 1').fetchone():
+            return
+        for field in ('request_files', 'request_blobs'):
+            conn.execute(
+                'INSERT OR IGNORE INTO webhook_blobs (blob, webhook_id) '
+                "SELECT json_extract(f.value, '$.blob'), w.id "
+                f"FROM webhooks w, json_each(w.document, '$.{field}') f "
+                "WHERE json_extract(f.value, '$.blob') IS NOT NULL"
+            )
+
+    # Câu lệnh ghi cho từng nhóm row sinh ra từ một document
+    INSERT_SQL = {
+        'webhooks': 'INSERT INTO webhooks (id, ts, webhook_type, sender, subject, document, tenant, ingest_id) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+        'recipients': 'INSERT OR IGNORE INTO webhook_recipients (address, ts, webhook_id) VALUES (?, ?, ?)',
+        # rowid của FTS trùng rowid của bảng webhooks để join và xóa theo rowid
+        'fts': 'INSERT INTO webhooks_fts (rowid, subject, body, sender, webhook_id) '
+               'VALUES ((SELECT rowid FROM webhooks WHERE id = ?4), ?1, ?2, ?3, ?4)',
+        'codes': 'INSERT OR IGNORE INTO webhook_codes (address, ts, webhook_id, otp) VALUES (?, ?, ?, ?)',
+        'categories': 'INSERT OR IGNORE INTO webhook_categories (address, category, ts, webhook_id) '
+                      'VALUES (?, ?, ?, ?)',
+        'blobs': 'INSERT OR IGNORE INTO webhook_blobs (blob, webhook_id) VALUES (?, ?)',
+    }
+
+    def _collect_rows(self, document, rows):
+        """Tách một document thành các row cho bảng chính và các bảng index phụ"""
+        document_id = str(document.setdefault('_id', ObjectId()))
+        timestamp = document.get('timestamp') or datetime.now()
+        ts = timestamp.strftime(SQLITE_TIMESTAMP_FORMAT)
+        fields = extract_email_fields(document)
+        body = {key: value for key, value in document.items() if key not in ('_id', 'timestamp')}
+        rows['webhooks'].append((
+            document_id,
+            ts,
+            document.get('webhook_type') or 'unknown',
+            fields['sender'],
+            fields['subject'],
+            json.dumps(body, ensure_ascii=False, default=json_default),
+            document.get('tenant') or '',
+            str(document['ingest_id']) if document.get('ingest_id') else None,
+        ))
+        addresses = document.get('recipient_addresses') or extract_recipient_addresses(document)
+        rows['recipients'].extend((address, ts, document_id) for address in addresses)
+        if document.get('webhook_type') == 'inbound_email':
+            rows['fts'].append((fields['subject'], fields['text'], fields['sender'], document_id))
+        if document.get('otp'):
+            otp = json.dumps(document['otp'], ensure_ascii=False)
+            rows['codes'].extend((address, ts, document_id, otp) for address in addresses)
+        for category in document.get('subject_categories') or []:
+            rows['categories'].extend((address, category, ts, document_id) for address in addresses)
+        rows['blobs'].extend((key, document_id) for key in document.get('blob_keys') or extract_blob_keys(document))
+        return document_id
+
+    def _collect_all(self, documents):
+        rows = {table: [] for table in self.INSERT_SQL}
+        for document in documents:
+            self._collect_rows(document, rows)
+        return rows
+
+    @staticmethod
+    def _existing(conn, column, values):
+        existing = set()
+        for start in range(0, len(values), 500):
+            chunk = values[start:start + 500]
+            existing.update(row[0] for row in conn.execute(
+                f"SELECT {column} FROM webhooks WHERE {column} IN ({', '.join('?' * len(chunk))})", chunk
+            ))
+        return existing
+
+    def _write(self, documents):
+        ids = [str(document.setdefault('_id', ObjectId())) for document in documents]
+        ingest_ids = [str(document['ingest_id']) for document in documents if document.get('ingest_id')]
+        rows = self._collect_all(documents)
+
+        conn = self._connect()
+        with self._write_lock:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                existing_ids = self._existing(conn, 'id', ids)
+                existing_ingest = self._existing(conn, 'ingest_id', ingest_ids) if ingest_ids else set()
+                if existing_ids or existing_ingest:
+                    # Batch ghi lại (ingest worker thử lại, mirror chạy lại): bỏ qua webhook đã có
+                    documents = [
+                        document for document in documents
+                        if str(document['_id']) not in existing_ids
+                        and str(document.get('ingest_id')) not in existing_ingest
+                    ]
+                    logger.warning(f"[WARNING] Skipped {len(ids) - len(documents)} webhooks already stored")
+                    ids = [str(document['_id']) for document in documents]
+                    rows = self._collect_all(documents)
+                for table, sql in self.INSERT_SQL.items():
+                    if rows[table]:
+                        conn.executemany(sql, rows[table])
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+        return ids
+
+    # Một node: profile độ bền không áp dụng
+    def insert(self, document, durability=None):
+        self._write([document])
+        return str(document['_id'])
+
+    def insert_many(self, documents, durability=None):
+        if not documents:
+            return []
+        return self._write(documents)
+
+    @staticmethod
+    def _to_document(row, include_id=True):
+        document = json.loads(row['document'])
+        if include_id:
+            document['_id'] = ObjectId(row['id'])
+        document['timestamp'] = datetime.strptime(row['ts'], SQLITE_TIMESTAMP_FORMAT)
+        return document
+
+    def find_by_id(self, webhook_id, webhook_type=None, fields=None, tenant=None):
+        webhook_id = str(ObjectId(webhook_id))  # Validate giống MongoDB
+        sql = 'SELECT id, ts, document FROM webhooks WHERE id = ?'
+        params = [webhook_id]
+        if webhook_type:
+            sql += ' AND webhook_type = ?'
+            params.append(webhook_type)
+        if tenant is not None:
+            sql += ' AND tenant = ?'
+            params.append(tenant)
+        row = self._connect().execute(sql, params).fetchone()
+        return project_document(self._to_document(row), fields) if row else None
+
+    def list_webhooks(self, limit=50, skip=0, fields=None, since=None, until=None, tenant=None):
+        sql = 'SELECT id, ts, document FROM webhooks WHERE 1 = 1'
+        params = []
+        if tenant is not None:
+            sql += ' AND tenant = ?'
+            params.append(tenant)
+        if since:
+            sql += ' AND ts >= ?'
+            params.append(since.strftime(SQLITE_TIMESTAMP_FORMAT))
+        if until:
+            sql += ' AND ts < ?'
+            params.append(until.strftime(SQLITE_TIMESTAMP_FORMAT))
+        rows = self._connect().execute(
+            sql + ' ORDER BY ts DESC LIMIT ? OFFSET ?',
+            [*params, limit, skip]
+        ).fetchall()
+        include_id = bool(fields) and '_id' in fields
+        webhooks = [self._to_document(row, include_id=include_id) for row in rows]
+        return [project_document(webhook, fields) for webhook in webhooks]
+
+    def _recipient_query(self, recipient, extra_where='', extra_params=()):
+        """
+        Truy vấn theo người nhận: địa chỉ đầy đủ dùng index (address, ts),
+        chuỗi không phải địa chỉ thì quét theo REGEXP như MongoDB.
+        """
+        recipient = recipient.strip().lower()
+        if is_plain_address(recipient):
+            sql = (
+                'SELECT w.id, w.ts, w.document FROM webhook_recipients r '
+                'JOIN webhooks w ON w.id = r.webhook_id '
+                "WHERE r.address = ? AND w.webhook_type = 'inbound_email'" + extra_where +
+                ' ORDER BY r.ts DESC LIMIT ? OFFSET ?'
+            )
+            return sql, [recipient, *extra_params]
+        sql = (
+            'SELECT w.id, w.ts, w.document FROM webhooks w '
+            "WHERE w.webhook_type = 'inbound_email' AND EXISTS ("
+            'SELECT 1 FROM webhook_recipients r WHERE r.webhook_id = w.id AND r.address REGEXP ?)' +
+            extra_where + ' ORDER BY w.ts DESC LIMIT ? OFFSET ?'
+        )
+        return sql, [recipient, *extra_params]
+
+    def list_changes(self, after_id=None, before_id=None, limit=100, fields=None, tenant=None):
+        # id là ObjectId hex cùng độ dài nên so sánh chuỗi trùng thứ tự ObjectId (dùng PRIMARY KEY,
+        # hoặc index (tenant, id))
+        sql = 'SELECT id, ts, document FROM webhooks WHERE 1 = 1'
+        params = []
+        if tenant is not None:
+            sql += ' AND tenant = ?'
+            params.append(tenant)
+        if after_id:
+            sql += ' AND id > ?'
+            params.append(str(ObjectId(after_id)))
+        if before_id:
+            sql += ' AND id < ?'
+            params.append(str(ObjectId(before_id)))
+        rows = self._connect().execute(sql + ' ORDER BY id LIMIT ?', [*params, limit]).fetchall()
+        return [project_document(self._to_document(row), fields) for row in rows]
+
+    def newest_id(self):
+        return self._connect().execute('SELECT MAX(id) FROM webhooks').fetchone()[0]
+
+    def search_by_recipient(self, to_email, limit=50, skip=0, tenant=None):
+        if tenant is not None:
+            sql, params = self._recipient_query(to_email, ' AND w.tenant = ?', (tenant,))
+        else:
+            sql, params = self._recipient_query(to_email)
+        rows = self._connect().execute(sql, [*params, limit, skip]).fetchall()
+        emails = []
+        for row in rows:
+            document = self._to_document(row)
+            email_data = (document.get('processed_data') or {}).get('email_data') or {}
+            summary = {field: email_data[field] for field in EMAIL_SUMMARY_FIELDS if field in email_data}
+            email = {'_id': document['_id'], 'timestamp': document['timestamp']}
+            if summary:
+                email['processed_data'] = {'email_data': summary}
+            emails.append(email)
+        return emails
+
+    def find_inbox(self, recipient, subject_filter=None, limit=50, skip=0, category=None, tenant=None):
+        address = recipient.strip().lower()
+        subject_where, subject_params = (' AND w.subject REGEXP ?', [subject_filter]) if subject_filter else ('', [])
+        if tenant is not None:
+            subject_where += ' AND w.tenant = ?'
+            subject_params.append(tenant)
+        if category and is_plain_address(address):
+            # Tra bằng trên khóa chính (address, category, ts) của webhook_categories
+            sql = (
+                'SELECT w.id, w.ts, w.document FROM webhook_categories c '
+                'JOIN webhooks w ON w.id = c.webhook_id '
+                'WHERE c.address = ? AND c.category = ?' + subject_where +
+                ' ORDER BY c.ts DESC LIMIT ? OFFSET ?'
+            )
+            params = [address, category, *subject_params]
+        else:
+            if category:
+                subject_where = (' AND EXISTS (SELECT 1 FROM webhook_categories c '
+                                 'WHERE c.webhook_id = w.id AND c.category = ?)') + subject_where
+                subject_params = [category, *subject_params]
+            sql, params = self._recipient_query(recipient, subject_where, subject_params)
+        rows = self._connect().execute(sql, [*params, limit, skip]).fetchall()
+        emails = []
+        for row in rows:
+            document = self._to_document(row)
+            body_html = (document.get('request_form_data') or {}).get('body-html')
+            email = {'_id': document['_id']}
+            if body_html is not None:
+                email['request_form_data'] = {'body-html': body_html}
+            emails.append(email)
+        return emails
+
+    def find_inbox_batch(self, recipients, subject_filter=None, since=None, limit=5, include_html=False, category=None,
+                         tenant=None):
+        results = {address: [] for address in recipients}
+        if not results:
+            return results
+        # Danh sách địa chỉ truyền qua json_each (một tham số) để không vượt giới hạn số biến của SQLite
+        where = ("r.address IN (SELECT value FROM json_each(?)) AND w.webhook_type = 'inbound_email'")
+        params = [json.dumps(list(results))]
+        # Lọc theo category: đọc từ webhook_categories (cùng cột address, ts, webhook_id) thay cho webhook_recipients
+        source = 'webhook_recipients'
+        if category:
+            source = 'webhook_categories'
+            where += ' AND r.category = ?'
+            params.append(category)
+        if since:
+            where += ' AND r.ts >= ?'
+            params.append(since.strftime(SQLITE_TIMESTAMP_FORMAT))
+        if subject_filter:
+            where += ' AND w.subject REGEXP ?'
+            params.append(subject_filter)
+        if tenant is not None:
+            where += ' AND w.tenant = ?'
+            params.append(tenant)
+        html = ", json_extract(w.document, '$.request_form_data.\"body-html\"') AS body_html" if include_html else ''
+        rows = self._connect().execute(
+            'SELECT * FROM ('
+            'SELECT r.address, w.id, w.ts, w.subject, '
+            "COALESCE(json_extract(w.document, '$.request_form_data.from'), "
+            "json_extract(w.document, '$.request_form_data.From'), w.sender) AS sender, "
+            f"json_extract(w.document, '$.otp') AS otp{html}, "
+            'ROW_NUMBER() OVER (PARTITION BY r.address ORDER BY r.ts DESC) AS n '
+            f'FROM {source} r JOIN webhooks w ON w.id = r.webhook_id WHERE {where}'
+            ') WHERE n <= ? ORDER BY address, ts DESC',
+            [*params, limit]
+        ).fetchall()
+        for row in rows:
+            email = {
+                '_id': ObjectId(row['id']),
+                'timestamp': datetime.strptime(row['ts'], SQLITE_TIMESTAMP_FORMAT),
+                'subject': row['subject'],
+                'from': row['sender'],
+                'otp': json.loads(row['otp']) if row['otp'] else None,
+            }
+            if include_html:
+                email['body_html'] = row['body_html'] or ''
+            results[row['address']].append(email)
+        return results
+
+    def tag_subject_categories(self, categorize, retag=False, batch_size=500):
+        conn = self._connect()
+        sql = "SELECT id, ts, document FROM webhooks WHERE webhook_type = 'inbound_email' AND id > ?"
+        if not retag:
+            sql += " AND json_extract(document, '$.subject_categories') IS NULL"
+        tagged, last_id = 0, ''
+        while True:
+            rows = conn.execute(sql + ' ORDER BY id LIMIT ?', (last_id, batch_size)).fetchall()
+            if not rows:
+                return tagged
+            updates, categories = [], []
+            for row in rows:
+                fields = categorize_document(json.loads(row['document']), categorize)
+                updates.append((
+                    json.dumps(fields['subject_categories'], ensure_ascii=False),
+                    json.dumps(fields['subject_category_keys'], ensure_ascii=False),
+                    row['id'],
+                ))
+                for key in fields['subject_category_keys']:
+                    category, address = key.split(':', 1)
+                    categories.append((address, category, row['ts'], row['id']))
+            with self._write_lock:
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    conn.executemany(
+                        "UPDATE webhooks SET document = json_set(document, '$.subject_categories', json(?), "
+                        "'$.subject_category_keys', json(?)) WHERE id = ?",
+                        updates
+                    )
+                    conn.executemany('DELETE FROM webhook_categories WHERE webhook_id = ?', [(row['id'],) for row in rows])
+                    conn.executemany(self.INSERT_SQL['categories'], categories)
+                    conn.execute('COMMIT')
+                except Exception:
+                    conn.execute('ROLLBACK')
+                    raise
+            tagged += len(rows)
+            last_id = rows[-1]['id']
+
+    def search_text(self, query, limit=20, cursor=None, tenant=None):
+        match = build_fts_query(query)
+        if not match:
+            return [], None
+        # bm25 trả về giá trị âm, càng nhỏ càng liên quan; score công khai = -bm25
+        sql = (
+            'SELECT * FROM ('
+            f'SELECT f.webhook_id AS id, -{self.FTS_RANK} AS score, '
+            f"snippet(webhooks_fts, 1, '{SNIPPET_START}', '{SNIPPET_END}', '…', 24) AS body_snippet, "
+            f"snippet(webhooks_fts, 0, '{SNIPPET_START}', '{SNIPPET_END}', '…', 24) AS subject_snippet, "
+            'w.ts AS ts, w.subject AS subject, w.sender AS sender '
+            'FROM webhooks_fts f JOIN webhooks w ON w.rowid = f.rowid '
+            'WHERE webhooks_fts MATCH ?' + (' AND w.tenant = ?)' if tenant is not None else ')')
+        )
+        params = [match] if tenant is None else [match, tenant]
+        if cursor:
+            score, last_id = cursor
+            sql += ' WHERE score < ? OR (score = ? AND id < ?)'
+            params += [score, score, last_id]
+        sql += ' ORDER BY score DESC, id DESC LIMIT ?'
+        params.append(limit + 1)
+        rows = self._connect().execute(sql, params).fetchall()
+
+        results = []
+        for row in rows[:limit]:
+            snippet = row['body_snippet'] if SNIPPET_START in row['body_snippet'] else row['subject_snippet']
+            results.append({
+                '_id': ObjectId(row['id']),
+                'timestamp': datetime.strptime(row['ts'], SQLITE_TIMESTAMP_FORMAT),
+                'subject': row['subject'],
+                'sender': row['sender'],
+                'score': row['score'],
+                'snippet': snippet or row['body_snippet'],
+            })
+        next_cursor = None
+        if len(rows) > limit and results:
+            next_cursor = (results[-1]['score'], str(results[-1]['_id']))
+        return results, next_cursor
+
+    def inbox_validator(self, recipient, tenant=None):
+        # ?2 NULL = mọi tenant
+        row = self._connect().execute(
+            'SELECT COUNT(*) AS count, MAX(r.ts) AS newest, '
+            '(SELECT r2.webhook_id FROM webhook_recipients r2 JOIN webhooks w2 ON w2.id = r2.webhook_id '
+            " WHERE r2.address = ?1 AND w2.webhook_type = 'inbound_email' AND (?2 IS NULL OR w2.tenant = ?2) "
+            ' ORDER BY r2.ts DESC LIMIT 1) AS newest_id '
+            'FROM webhook_recipients r JOIN webhooks w ON w.id = r.webhook_id '
+            "WHERE r.address = ?1 AND w.webhook_type = 'inbound_email' AND (?2 IS NULL OR w.tenant = ?2)",
+            (recipient.strip().lower(), tenant)
+        ).fetchone()
+        return {
+            'count': row['count'],
+            'newest_id': row['newest_id'],
+            'newest': datetime.strptime(row['newest'], SQLITE_TIMESTAMP_FORMAT) if row['newest'] else None,
+        }
+
+    def latest_code(self, recipient, since=None, tenant=None):
+        sql = 'SELECT c.webhook_id, c.ts, c.otp FROM webhook_codes c'
+        params = []
+        if tenant is not None:
+            sql += ' JOIN webhooks w ON w.id = c.webhook_id AND w.tenant = ?'
+            params.append(tenant)
+        sql += ' WHERE c.address = ?'
+        params.append(recipient.strip().lower())
+        if since:
+            sql += ' AND c.ts >= ?'
+            params.append(since.strftime(SQLITE_TIMESTAMP_FORMAT))
+        row = self._connect().execute(sql + ' ORDER BY c.ts DESC LIMIT 1', params).fetchone()
+        if not row:
+            return None
+        return {
+            '_id': ObjectId(row['webhook_id']),
+            'timestamp': datetime.strptime(row['ts'], SQLITE_TIMESTAMP_FORMAT),
+            'otp': json.loads(row['otp']),
+        }
+
+    def references_blob(self, key, tenant=None):
+        sql = 'SELECT 1 FROM webhook_blobs b'
+        params = []
+        if tenant is not None:
+            sql += ' JOIN webhooks w ON w.id = b.webhook_id AND w.tenant = ?'
+            params.append(tenant)
+        return self._connect().execute(sql + ' WHERE b.blob = ? LIMIT 1', [*params, key]).fetchone() is not None
+
+    def live_blob_keys(self):
+        return {row[0] for row in self._connect().execute('SELECT DISTINCT blob FROM webhook_blobs')}
+
+    def retention_report(self, webhook_type, cutoff):
+        row = self._connect().execute(
+            'SELECT COUNT(*) AS documents, COALESCE(SUM(LENGTH(CAST(document AS BLOB))), 0) AS bytes '
+            'FROM webhooks WHERE webhook_type = ? AND ts < ?',
+            (webhook_type, cutoff.strftime(SQLITE_TIMESTAMP_FORMAT))
+        ).fetchone()
+        return {'documents': row['documents'], 'bytes': row['bytes']}
+
+    def find_expired(self, webhook_type, cutoff, limit=500):
+        rows = self._connect().execute(
+            'SELECT id, ts, document FROM webhooks WHERE webhook_type = ? AND ts < ? ORDER BY ts LIMIT ?',
+            (webhook_type, cutoff.strftime(SQLITE_TIMESTAMP_FORMAT), limit)
+        ).fetchall()
+        return [self._to_document(row) for row in rows]
+
+    def delete_by_ids(self, ids):
+        ids = [str(i) for i in ids]
+        if not ids:
+            return 0
+        placeholders = ','.join('?' * len(ids))
+        conn = self._connect()
+        with self._write_lock:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.execute(
+                    f'DELETE FROM webhooks_fts WHERE rowid IN (SELECT rowid FROM webhooks WHERE id IN ({placeholders}))',
+                    ids
+                )
+                conn.execute(f'DELETE FROM webhook_recipients WHERE webhook_id IN ({placeholders})', ids)
+                conn.execute(f'DELETE FROM webhook_codes WHERE webhook_id IN ({placeholders})', ids)
+                conn.execute(f'DELETE FROM webhook_categories WHERE webhook_id IN ({placeholders})', ids)
+                conn.execute(f'DELETE FROM webhook_blobs WHERE webhook_id IN ({placeholders})', ids)
+                conn.execute(f'DELETE FROM webhook_records WHERE webhook_id IN ({placeholders})', ids)
+                deleted = conn.execute(f'DELETE FROM webhooks WHERE id IN ({placeholders})', ids).rowcount
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+        return deleted
+
+    def stats(self, tenant=None):
+        conn = self._connect()
+        where, params = (' WHERE tenant = ?', [tenant]) if tenant is not None else ('', [])
+        by_type = {
+            row['webhook_type']: row['count']
+            for row in conn.execute(
+                f'SELECT webhook_type, COUNT(*) AS count FROM webhooks{where} GROUP BY webhook_type', params
+            )
+        }
+        bounds = conn.execute(f'SELECT MIN(ts) AS oldest, MAX(ts) AS newest FROM webhooks{where}', params).fetchone()
+        return {
+            'total': sum(by_type.values()),
+            'by_type': by_type,
+            'newest': datetime.strptime(bounds['newest'], SQLITE_TIMESTAMP_FORMAT) if bounds['newest'] else None,
+            'oldest': datetime.strptime(bounds['oldest'], SQLITE_TIMESTAMP_FORMAT) if bounds['oldest'] else None,
+        }
+
+    def ensure_record_indexes(self, collection, indexes):
+        # Một bảng webhook_records chung, index (collection, record_key, ts) phục vụ mọi loại
+        pass
+
+    def insert_records(self, collection, records, key_field=None):
+        rows = [
+            (
+                collection,
+                str(record.get(key_field) or '') if key_field else str(record['webhook_id']),
+                record['timestamp'].strftime(SQLITE_TIMESTAMP_FORMAT),
+                str(record['webhook_id']),
+                json.dumps(record, ensure_ascii=False, default=json_default),
+            )
+            for record in records
+        ]
+        if not rows:
+            return
+        conn = self._connect()
+        with self._write_lock:
+            conn.executemany(
+                'INSERT INTO webhook_records (collection, record_key, ts, webhook_id, document) VALUES (?, ?, ?, ?, ?)',
+                rows
+            )
+
+    def find_records(self, collection, key_field, key, limit=50):
+        # record_key đã là giá trị key_field của processor tại thời điểm ghi
+        rows = self._connect().execute(
+            'SELECT ts, document FROM webhook_records WHERE collection = ? AND record_key = ? '
+            'ORDER BY ts DESC LIMIT ?',
+            (collection, str(key), limit)
+        ).fetchall()
+        records = []
+        for row in rows:
+            record = json.loads(row['document'])
+            record['timestamp'] = datetime.strptime(row['ts'], SQLITE_TIMESTAMP_FORMAT)
+            records.append(record)
+        return records
+
+    def save_subscription(self, subscription):
+        subscription_id = str(subscription.setdefault('_id', ObjectId()))
+        body = {key: value for key, value in subscription.items() if key != '_id'}
+        conn = self._connect()
+        with self._write_lock:
+            conn.execute(
+                'INSERT INTO subscriptions (id, document) VALUES (?, ?)',
+                (subscription_id, json.dumps(body, ensure_ascii=False, default=json_default))
+            )
+        return subscription_id
+
+    def list_subscriptions(self):
+        subscriptions = []
+        for row in self._connect().execute('SELECT id, document FROM subscriptions ORDER BY rowid'):
+            subscription = json.loads(row['document'])
+            subscription['_id'] = ObjectId(row['id'])
+            subscriptions.append(subscription)
+        return subscriptions
+
+    def delete_subscription(self, subscription_id):
+        subscription_id = str(ObjectId(subscription_id))
+        conn = self._connect()
+        with self._write_lock:
+            return conn.execute('DELETE FROM subscriptions WHERE id = ?', (subscription_id,)).rowcount > 0
+
+    def upsert_message_event(self, event, timeline_limit=50):
+        name = event['event']
+        ts = event['timestamp'].strftime(SQLITE_TIMESTAMP_FORMAT)
+        entry = {key: event[key] for key in ('event', 'severity', 'reason', 'webhook_id')}
+        entry['timestamp'] = ts
+        conn = self._connect()
+        with self._write_lock:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = conn.execute(
+                    'SELECT first_event_at, last_event_at, state FROM message_states WHERE message_id = ?',
+                    (event['message_id'],)
+                ).fetchone()
+                if row is None:
+                    state = {'events': {}, 'counts': {}, 'timeline': []}
+                    first, last = ts, ts
+                else:
+                    state = json.loads(row['state'])
+                    first, last = min(row['first_event_at'], ts), max(row['last_event_at'], ts)
+                first_time = name not in state['events']
+                state['events'][name] = min(state['events'].get(name, ts), ts)
+                state['counts'][name] = state['counts'].get(name, 0) + 1
+                state['timeline'].append(entry)
+                state['timeline'] = sorted(state['timeline'], key=lambda item: item['timestamp'])[-timeline_limit:]
+                conn.execute(
+                    'INSERT INTO message_states (message_id, recipient, domain, first_event_at, last_event_at, state, '
+                    'tenant) VALUES (?, ?, ?, ?, ?, ?, ?) '
+                    'ON CONFLICT (message_id) DO UPDATE SET first_event_at = excluded.first_event_at, '
+                    'last_event_at = excluded.last_event_at, state = excluded.state',
+                    (event['message_id'], event['recipient'], event['domain'], first, last,
+                     json.dumps(state, ensure_ascii=False), event.get('tenant') or '')
+                )
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+        return first_time
+
+    def find_message_state(self, message_id, tenant=None):
+        sql = ('SELECT message_id, recipient, domain, first_event_at, last_event_at, state '
+               'FROM message_states WHERE message_id = ?')
+        params = [message_id]
+        if tenant is not None:
+            sql += ' AND tenant = ?'
+            params.append(tenant)
+        row = self._connect().execute(sql, params).fetchone()
+        if row is None:
+            return None
+
+        def parse(value):
+            return datetime.strptime(value, SQLITE_TIMESTAMP_FORMAT)
+
+        state = json.loads(row['state'])
+        for item in state['timeline']:
+            item['timestamp'] = parse(item['timestamp'])
+        return {
+            'message_id': row['message_id'],
+            'recipient': row['recipient'],
+            'domain': row['domain'],
+            'first_event_at': parse(row['first_event_at']),
+            'last_event_at': parse(row['last_event_at']),
+            'events': {name: parse(value) for name, value in state['events'].items()},
+            'counts': state['counts'],
+            'timeline': state['timeline'],
+        }
+
+    def increment_domain_counter(self, domain, bucket, event, tenant=''):
+        conn = self._connect()
+        with self._write_lock:
+            conn.execute(
+                'INSERT INTO domain_stats (tenant, domain, bucket, event, count) VALUES (?, ?, ?, ?, 1) '
+                'ON CONFLICT (tenant, domain, bucket, event) DO UPDATE SET count = count + 1',
+                (tenant, domain, bucket.strftime(SQLITE_TIMESTAMP_FORMAT), event)
+            )
+
+    def domain_counters(self, since, domain=None, tenant=None):
+        sql = 'SELECT domain, bucket, event, SUM(count) AS count FROM domain_stats WHERE bucket >= ?'
+        params = [since.strftime(SQLITE_TIMESTAMP_FORMAT)]
+        if tenant is not None:
+            sql += ' AND tenant = ?'
+            params.append(tenant)
+        if domain:
+            sql += ' AND domain = ?'
+            params.append(domain)
+        buckets = {}
+        # Không lọc tenant: cộng bộ đếm của mọi tenant cùng domain / bucket
+        for row in self._connect().execute(sql + ' GROUP BY domain, bucket, event', params):
+            key = (row['domain'], row['bucket'])
+            if key not in buckets:
+                buckets[key] = {
+                    'domain': row['domain'],
+                    'bucket': datetime.strptime(row['bucket'], SQLITE_TIMESTAMP_FORMAT),
+                    'counts': {},
+                }
+            buckets[key]['counts'][row['event']] = row['count']
+        return list(buckets.values())
+
+
+def get_mongodb_client(connection_string=None, timeout_ms=None, event_listeners=None):
+    """Tạo kết nối MongoDB (connection_string mặc định đọc từ biến môi trường)"""
+    client = None
+    try:
+        if connection_string is None:
+            # MONGODB_URI hoặc cluster Atlas với DB_USERNAME / DB_PASSWORD
+            connection_string = Settings.from_env(load_env=False).mongodb_uri
+
+        options = {'serverSelectionTimeoutMS': timeout_ms} if timeout_ms else {}
+        if event_listeners:
+            options['event_listeners'] = event_listeners
+        client = MongoClient(connection_string, **options)
+        # Test connection
+        client.admin.command('ping')
+        logger.info("Kết nối MongoDB thành công!")
+        return client
+    except Exception as e:
+        logger.error(f"Lỗi kết nối MongoDB: {e}")
+        if client is not None:
+            client.close()  # Dừng các thread monitor, nếu không mỗi lần thử lại sẽ rò thread
+        return None
+
+
+def create_storage(settings, mongodb_client=None, read_preference=None):
+    """
+    Tạo storage theo cấu hình STORAGE_BACKEND (mongo | sqlite) và PARTITION_SCHEME (none | day | week);
+    read_preference áp dụng cho các truy vấn danh sách / tìm kiếm của MongoDB
+    """
+    backend = (settings.storage_backend or 'mongo').lower()
+    if backend == 'sqlite':
+        path = settings.sqlite_path
+        storage = SQLiteWebhookStorage(path)
+        logger.info(f"Sử dụng SQLite storage: {path}")
+        return storage
+    if backend != 'mongo':
+        raise ValueError(f'STORAGE_BACKEND không hợp lệ: {backend}')
+    if mongodb_client is None:
+        return None
+    partition_scheme = settings.partition_scheme.lower()
+    if partition_scheme in ('day', 'week'):
+        from partitions import PartitionedMongoWebhookStorage
+        storage = PartitionedMongoWebhookStorage(mongodb_client, partition_scheme, read_preference=read_preference)
+        logger.info(f"Sử dụng MongoDB storage chia partition theo {partition_scheme}")
+    else:
+        storage = MongoWebhookStorage(mongodb_client, read_preference=read_preference)
+    try:
+        storage.ensure_indexes()
+    except Exception as e:
+        logger.warning(f"Không thể tạo index MongoDB: {e}")
+    return storage
@@ -0,0 +1,116 @@
+"""
+Category theo subject của inbound email (otp, password-reset, welcome, ...) gắn một lần khi ingest
+
+Mỗi category là một danh sách regex (không phân biệt hoa thường) trên subject. Category khớp được
+lưu vào mảng `subject_categories` của webhook (và key `<category>:<người nhận>` có index), nên
+GET /emails/inbox/<recipient>?category=otp là một truy vấn bằng trên index thay vì quét regex
+subject ở mỗi request.
+
+SUBJECT_CATEGORIES_FILE (JSON) thay thế bộ category mặc định:
+
+    {
+        "categories": {
+            "otp": ["verification code", "\\\\botp\\\\b"],
+            "invoice": ["invoice|hóa đơn"]
+        }
+    }
+
+Webhook lưu trước khi có category (hoặc trước khi đổi cấu hình) được gắn lại bằng
+`python subject_categories.py` (chỉ document chưa có category) hoặc `--retag` (tất cả).
+"""
+
+import argparse
+import json
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+CATEGORY_NAME = re.compile(r'^[a-z0-9][a-z0-9_-]*$')
+
+DEFAULT_CATEGORIES = {
+    # Trùng filter subject mặc định của GET /emails/inbox/<recipient>
+    'verification-code': [r'verification code'],
+    'otp': [
+        r'verification code|security code|login code|one[- ]time (?:code|password|passcode)',
+        r'\b(?:otp|passcode|2fa)\b',
+        r'mã (?:xác minh|xác nhận|xác thực|otp|đăng nhập)',
+    ],
+    'password-reset': [
+        r'(?:reset|forgot|forgotten|change|recover)\W+(?:\w+\W+){0,2}password',
+        r'password\W+(?:\w+\W+){0,2}(?:reset|recovery|change)',
+        r'(?:đặt lại|khôi phục|quên) mật khẩu',
+    ],
+    'verify-email': [
+        r'(?:verify|confirm|activate)\W+(?:\w+\W+){0,2}(?:email|e-mail|account|address)',
+        r'(?:xác minh|xác nhận|kích hoạt) (?:email|tài khoản)',
+    ],
+    'welcome': [r'\bwelcome\b|chào mừng'],
+}
+
+
+class SubjectCategorizer:
+    """Gắn category cho subject theo bộ regex cấu hình"""
+
+    def __init__(self, categories=None):
+        self.patterns = {}
+        for name, patterns in (categories or DEFAULT_CATEGORIES).items():
+            if not CATEGORY_NAME.match(name):
+                raise ValueError(f'Tên category không hợp lệ: {name} (chữ thường, số, "-", "_")')
+            if isinstance(patterns, str):
+                patterns = [patterns]
+            self.patterns[name] = [re.compile(pattern, re.IGNORECASE) for pattern in patterns]
+
+    @classmethod
+    def from_file(cls, path):
+        """Đọc SUBJECT_CATEGORIES_FILE; lỗi đọc file / regex sai thì raise để phát hiện khi khởi động"""
+        if not path:
+            return cls()
+        with open(path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+        logger.info(f"Đã tải subject categories từ {path}")
+        return cls(config.get('categories'))
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls.from_file(settings.subject_categories_file)
+
+    @property
+    def names(self):
+        return list(self.patterns)
+
+    def __contains__(self, name):
+        return name in self.patterns
+
+    def categorize(self, subject):
+        """Danh sách category khớp subject (theo thứ tự cấu hình)"""
+        if not subject:
+            return []
+        return [name for name, patterns in self.patterns.items()
+                if any(pattern.search(subject) for pattern in patterns)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Gắn subject category cho inbound email đã lưu')
+    parser.add_argument('--retag', action='store_true',
+                        help='Tính lại cho mọi inbound email (sau khi đổi SUBJECT_CATEGORIES_FILE)')
+    parser.add_argument('--batch-size', type=int, default=500)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    from services import open_storage
+    from settings import Settings
+
+    settings = Settings.from_env()
+    categorizer = SubjectCategorizer.from_settings(settings)
+    storage = open_storage(settings)
+    if storage is None:
+        print("[ERROR] Không thể kết nối database")
+        return
+
+    tagged = storage.tag_subject_categories(categorizer.categorize, retag=args.retag, batch_size=args.batch_size)
+    print(f"[SUCCESS] Đã gắn subject category cho {tagged} inbound emails ({', '.join(categorizer.names)})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+"""
+Tenant (khách hàng) của một deployment nhận mail cho nhiều domain
+
+Tenant của webhook được suy ra từ domain nhận (field `domain` của Mailgun, hoặc domain của
+người nhận) và lưu vào field `tenant` khi ingest; các index bắt đầu bằng `tenant` giúp truy vấn
+của một tenant chỉ quét dữ liệu của tenant đó. Request đọc có header `X-API-Key` được giới hạn
+trong tenant của key.
+
+TENANTS_FILE (JSON) gom nhiều domain vào một tenant, khai báo API key và quota riêng:
+
+    {
+        "tenants": {
+            "acme": {"domains": ["acme.com", "acme.io"], "api_keys": ["..."],
+                     "ingest_per_minute": 6000, "reads_per_minute": 600}
+        }
+    }
+
+Domain không khai báo là tenant của chính nó, dùng quota mặc định TENANT_INGEST_PER_MINUTE /
+TENANT_READS_PER_MINUTE (0 = không giới hạn). Quota và metrics tính trong từng worker process.
+"""
+
+import json
+import logging
+import threading
+import time
+
+from processors import EmailEventProcessor
+from storage import extract_recipient_addresses
+
+logger = logging.getLogger(__name__)
+
+QUOTA_KINDS = ('ingest', 'reads')
+
+
+def address_domain(address):
+    return address.rsplit('@', 1)[-1].strip().lower() if address and '@' in address else ''
+
+
+class TenantRegistry:
+    """Ánh xạ domain / API key -> tenant và quota theo tenant"""
+
+    def __init__(self, config=None, ingest_per_minute=0, reads_per_minute=0):
+        self.domains = {}
+        self.api_keys = {}
+        self.quotas = {}
+        self.default_quota = {'ingest': ingest_per_minute, 'reads': reads_per_minute}
+        for tenant, options in ((config or {}).get('tenants') or {}).items():
+            for domain in options.get('domains', []):
+                self.domains[domain.strip().lower()] = tenant
+            for key in options.get('api_keys', []):
+                self.api_keys[key] = tenant
+            self.quotas[tenant] = {
+                'ingest': options.get('ingest_per_minute', ingest_per_minute),
+                'reads': options.get('reads_per_minute', reads_per_minute),
+            }
+
+    @classmethod
+    def from_file(cls, path, ingest_per_minute=0, reads_per_minute=0):
+        """Đọc TENANTS_FILE; lỗi đọc file thì raise để phát hiện khi khởi động"""
+        config = None
+        if path:
+            with open(path, 'r', encoding='utf-8') as f:
+                config = json.load(f)
+            logger.info(f"Đã tải cấu hình tenant từ {path}")
+        return cls(config, ingest_per_minute=ingest_per_minute, reads_per_minute=reads_per_minute)
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls.from_file(
+            settings.tenants_file,
+            ingest_per_minute=settings.tenant_ingest_per_minute,
+            reads_per_minute=settings.tenant_reads_per_minute,
+        )
+
+    def tenant_for_domain(self, domain):
+        """Tenant của domain (khớp cả subdomain của domain đã khai báo), mặc định là chính domain"""
+        domain = (domain or '').strip().lower()
+        candidate = domain
+        while candidate:
+            if candidate in self.domains:
+                return self.domains[candidate]
+            if '.' not in candidate:
+                break
+            candidate = candidate.split('.', 1)[1]
+        return domain
+
+    def tenant_for_address(self, address):
+        return self.tenant_for_domain(address_domain(address))
+
+    def tenant_for_document(self, document):
+        """
+        Tenant của webhook: field domain (domain gửi của event giao nhận, domain nhận của inbound email)
+        hoặc domain của người nhận đầu tiên
+        """
+        form_data = document.get('request_form_data') or {}
+        domain = document.get('domain') or form_data.get('domain')
+        if not domain and ('event-data' in form_data or isinstance(document.get('request_json'), dict)):
+            # Event giao nhận chưa enrich (front end ở chế độ hàng đợi): domain gửi trong event-data
+            event = EmailEventProcessor.event_data(document) or {}
+            domain = event.get('domain')
+        if domain:
+            return self.tenant_for_domain(domain)
+        addresses = document.get('recipient_addresses') or extract_recipient_addresses(document)
+        address = addresses[0] if addresses else document.get('recipient', '')
+        return self.tenant_for_address(address)
+
+    def tenant_for_api_key(self, key):
+        return self.api_keys.get(key) if key else None
+
+    def quota(self, tenant, kind):
+        """Số request mỗi phút cho phép (0 = không giới hạn)"""
+        return self.quotas.get(tenant, self.default_quota)[kind]
+
+
+class TenantQuotas:
+    """Token bucket theo (tenant, loại): nạp đều `per_minute / 60` token mỗi giây, tối đa `per_minute` token"""
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, tenant, kind, per_minute):
+        """(True, 0) nếu còn quota (per_minute = 0: không giới hạn); (False, số giây cần chờ) nếu vượt"""
+        if not per_minute:
+            return True, 0
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get((tenant, kind), (per_minute, now))
+            tokens = min(per_minute, tokens + (now - updated) * per_minute / 60)
+            if tokens >= 1:
+                self._buckets[(tenant, kind)] = (tokens - 1, now)
+                return True, 0
+            self._buckets[(tenant, kind)] = (tokens, now)
+            return False, (1 - tokens) * 60 / per_minute
+
+
+def empty_counters():
+    counters = {'ingest_bytes': 0}
+    for kind in QUOTA_KINDS:
+        for field in ('requests', 'throttled', 'errors', 'total_ms'):
+            counters[f'{kind}_{field}'] = 0
+    return counters
+
+
+class TenantMetrics:
+    """Bộ đếm theo tenant trong process: số request, bị từ chối do quota, byte nhận, thời gian xử lý"""
+
+    def __init__(self):
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def record(self, tenant, kind, elapsed_ms, request_bytes=0, throttled=False, error=False):
+        with self._lock:
+            counters = self._counters.get(tenant)
+            if counters is None:
+                counters = self._counters[tenant] = empty_counters()
+            counters[f'{kind}_requests'] += 1
+            counters[f'{kind}_throttled'] += throttled
+            counters[f'{kind}_errors'] += error
+            counters[f'{kind}_total_ms'] += elapsed_ms
+            if kind == 'ingest':
+                counters['ingest_bytes'] += request_bytes or 0
+
+    def report(self):
+        with self._lock:
+            snapshot = {tenant: dict(counters) for tenant, counters in self._counters.items()}
+        for counters in snapshot.values():
+            for kind in QUOTA_KINDS:
+                served = counters[f'{kind}_requests'] - counters[f'{kind}_throttled']
+                counters[f'{kind}_avg_ms'] = round(counters[f'{kind}_total_ms'] / served, 2) if served else 0
+                counters[f'{kind}_total_ms'] = round(counters[f'{kind}_total_ms'], 2)
+        return snapshot
@@ -0,0 +1,122 @@
+"""
+Test API qua Flask test client: ETag / 304 của inbox và phạm vi tenant của X-API-Key
+"""
+
+import json
+
+import pytest
+
+from conftest import inbound_form
+
+TENANTS = {
+    'acme': {'domains': ['acme.com'], 'api_keys': ['acme-key']},
+    'other': {'domains': ['other.com'], 'api_keys': ['other-key']},
+}
+
+
+def post_email(client, recipient, subject='Hello', **fields):
+    response = client.post('/webhook/mailgun', data=inbound_form(recipient, subject, **fields))
+    assert response.status_code == 200
+    return response.get_json()['webhook_id']
+
+
+@pytest.fixture
+def client(make_app):
+    return make_app().test_client()
+
+
+@pytest.fixture
+def tenant_client(make_app):
+    client = make_app(tenants=TENANTS).test_client()
+    ids = {
+        'acme': post_email(client, 'alice@acme.com', 'Acme welcome'),
+        'other': post_email(client, 'bob@other.com', 'Other welcome'),
+    }
+    return client, ids
+
+
+def test_inbox_etag_returns_304_until_new_email(client):
+    # Không có subject / category: inbox mặc định lọc email "verification code"
+    post_email(client, 'alice@example.com', 'Your verification code')
+    first = client.get('/emails/inbox/alice@example.com')
+    assert first.status_code == 200
+    etag = first.headers['ETag']
+
+    assert client.get('/emails/inbox/alice@example.com', headers={'If-None-Match': etag}).status_code == 304
+
+    post_email(client, 'alice@example.com', 'Another verification code')
+    changed = client.get('/emails/inbox/alice@example.com', headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
+
+
+def test_email_variant_etag_returns_304(client):
+    email_id = post_email(client, 'alice@example.com', html='<p>Hi<script>x()</script></p>')
+    first = client.get(f'/emails/{email_id}/html?variant=safe')
+    assert first.status_code == 200
+    assert first.get_json()['content'] == '<p>Hi</p>'
+
+    repeat = client.get(f'/emails/{email_id}/html?variant=safe', headers={'If-None-Match': first.headers['ETag']})
+    assert repeat.status_code == 304
+
+
+def test_tenant_key_only_lists_own_webhooks(tenant_client):
+    client, _ = tenant_client
+
+    scoped = client.get('/webhooks', headers={'X-API-Key': 'acme-key'}).get_json()
+    unscoped = client.get('/webhooks').get_json()
+
+    assert {webhook['tenant'] for webhook in scoped['webhooks']} == {'acme'}
+    assert unscoped['count'] == 2
+
+
+def test_tenant_key_cannot_read_other_tenant(tenant_client):
+    client, ids = tenant_client
+    headers = {'X-API-Key': 'acme-key'}
+
+    assert client.get('/emails/inbox/alice@acme.com?subject=welcome', headers=headers).status_code == 200
+    assert client.get('/emails/inbox/bob@other.com?subject=welcome', headers=headers).status_code == 403
+    assert client.get(f"/emails/{ids['other']}/html", headers=headers).status_code == 404
+    assert client.get(f"/emails/{ids['acme']}/html", headers=headers).status_code == 200
+    assert client.get('/webhooks', headers={'X-API-Key': 'wrong'}).status_code == 401
+
+
+def test_tenant_key_batch_is_scoped(tenant_client):
+    client, ids = tenant_client
+    headers = {'X-API-Key': 'acme-key'}
+
+    rejected = client.post('/emails/inbox/batch', headers=headers,
+                           json={'recipients': ['alice@acme.com', 'bob@other.com']})
+    assert rejected.status_code == 403
+
+    batch = client.post('/emails/inbox/batch', headers=headers, json={'recipients': ['alice@acme.com']})
+    assert batch.status_code == 200
+    assert [email['_id'] for email in batch.get_json()['results']['alice@acme.com']] == [ids['acme']]
+
+
+def post_event(client, message_id, domain, event='delivered', recipient='user@gmail.com'):
+    event_data = {
+        'event': event,
+        'timestamp': 1704110400,
+        'recipient': recipient,
+        'domain': domain,
+        'message': {'headers': {'message-id': message_id}},
+    }
+    response = client.post('/webhook/mailgun', data={'event-data': json.dumps(event_data)})
+    assert response.status_code == 200
+
+
+def test_tenant_key_only_reads_own_delivery_state(tenant_client):
+    client, _ = tenant_client
+    post_event(client, 'acme-1@acme.com', 'acme.com')
+    post_event(client, 'other-1@other.com', 'other.com')
+    headers = {'X-API-Key': 'acme-key'}
+
+    assert client.get('/messages/acme-1@acme.com', headers=headers).status_code == 200
+    assert client.get('/messages/other-1@other.com', headers=headers).status_code == 404
+    assert client.get('/messages/other-1@other.com').status_code == 200
+
+    scoped = client.get('/stats/domains?hours=100000', headers=headers).get_json()
+    unscoped = client.get('/stats/domains?hours=100000').get_json()
+    assert [entry['counts'] for entry in scoped['domains']] == [{'delivered': 1}]
+    assert unscoped['domains'][0]['counts'] == {'delivered': 2}
@@ -0,0 +1,84 @@
+"""
+Test blob store: field lớn / file đính kèm tách ra blob, giới hạn body và GC blob có thời gian ân hạn
+"""
+
+import io
+import os
+import time
+from datetime import timedelta
+
+from blob_store import LocalBlobStore
+from conftest import inbound_form
+from retention import RetentionPruner
+
+
+def age(path, seconds):
+    """Lùi mtime của file để giả lập blob cũ"""
+    past = time.time() - seconds
+    os.utime(path, (past, past))
+
+
+def test_sweep_keeps_live_and_recent_blobs(tmp_path):
+    store = LocalBlobStore(str(tmp_path / 'blobs'))
+    live, _ = store.put(io.BytesIO(b'live'))
+    stale, _ = store.put(io.BytesIO(b'stale'))
+    recent, _ = store.put(io.BytesIO(b'recent'))
+    abandoned = tmp_path / 'blobs' / '.upload-abandoned'
+    abandoned.write_bytes(b'partial')
+    for path in (store.path(live), store.path(stale), str(abandoned)):
+        age(path, 7200)
+
+    assert store.sweep({live}, min_age=3600) == (2, len(b'stale') + len(b'partial'))
+
+    assert store.exists(live) and store.exists(recent)
+    assert not store.exists(stale) and not abandoned.exists()
+
+
+def test_put_existing_blob_refreshes_mtime(tmp_path):
+    store = LocalBlobStore(str(tmp_path / 'blobs'))
+    key, size = store.put(io.BytesIO(b'same content'))
+    age(store.path(key), 7200)
+
+    # Webhook mới tham chiếu lại blob cũ (chưa có trong pha mark): không bị sweep
+    assert store.put(io.BytesIO(b'same content')) == (key, size)
+    assert store.sweep(set(), min_age=3600) == (0, 0)
+
+
+def test_pruner_collects_unreferenced_blobs_after_grace(tmp_path, sqlite_storage):
+    store = LocalBlobStore(str(tmp_path / 'blobs'))
+    referenced, _ = store.put(io.BytesIO(b'attachment'))
+    orphan, _ = store.put(io.BytesIO(b'orphan'))
+    sqlite_storage.insert({
+        'webhook_type': 'inbound_email',
+        'request_form_data': {},
+        'request_files': {'attachment-1': {'filename': 'a.pdf', 'blob': referenced}},
+    })
+    pruner = RetentionPruner(sqlite_storage, {}, blob_store=store, blob_grace=timedelta(hours=1))
+
+    assert pruner.collect_blobs()['removed_blobs'] == 0
+    for key in (referenced, orphan):
+        age(store.path(key), 7200)
+    assert pruner.collect_blobs() == {'removed_blobs': 1, 'freed_bytes': len(b'orphan')}
+    assert store.exists(referenced) and not store.exists(orphan)
+
+
+def test_large_field_is_externalized_to_blob(make_app):
+    client = make_app(max_field_bytes=1024).test_client()
+    body = 'x' * 5000
+    response = client.post('/webhook/mailgun', data=inbound_form('alice@example.com', text=body))
+    assert response.status_code == 200
+
+    webhook = client.get(f"/webhook/{response.get_json()['webhook_id']}").get_json()['webhook']
+    blob = webhook['request_blobs']['body-plain']
+    assert len(webhook['request_form_data']['body-plain']) == 1024
+    assert blob['size'] == 5000
+    assert client.get(f"/blobs/{blob['blob']}").get_data(as_text=True) == body
+
+
+def test_body_over_max_content_length_is_rejected(make_app):
+    client = make_app(max_content_length=2048).test_client()
+
+    response = client.post('/webhook/mailgun', data=inbound_form('alice@example.com', text='x' * 4096))
+
+    assert response.status_code == 413
+    assert response.get_json()['status'] == 'error'
@@ -0,0 +1,95 @@
+"""
+Test tổng hợp giao nhận: trạng thái theo thứ hạng, timeline theo thời điểm event, bộ đếm domain chỉ tăng lần đầu
+"""
+
+import json
+from datetime import datetime
+
+from delivery import DeliveryAggregator, bucket_start, current_status, delivery_rates, event_name
+
+BASE = datetime(2024, 1, 1, 12, 0, 0)
+SINCE = datetime(2024, 1, 1)
+
+
+def event_document(event, seconds, message_id='<m1@acme.com>', recipient='bob@gmail.com', severity=None):
+    event_data = {'event': event, 'recipient': recipient}
+    if severity:
+        event_data['severity'] = severity
+    return {
+        '_id': f'{event}-{seconds}',
+        'processed_data': {
+            'event_type': event,
+            'message_id': message_id,
+            'recipient': recipient,
+            'event_timestamp': (BASE.timestamp() + seconds),
+            'event_data': event_data,
+        },
+    }
+
+
+def test_current_status_rank_ties_use_latest_event():
+    assert current_status({'delivered': BASE, 'failed': BASE.replace(minute=5)}) == 'failed'
+    assert current_status({'failed': BASE, 'delivered': BASE.replace(minute=5)}) == 'delivered'
+    assert current_status({'opened': BASE, 'clicked': BASE.replace(hour=1)}) == 'clicked'
+    # Event không biết có hạng 0, không che trạng thái đã biết
+    assert current_status({'delivered': BASE, 'custom': BASE.replace(hour=13)}) == 'delivered'
+    assert current_status({}) is None
+
+
+def test_event_name_and_bucket():
+    assert event_name('failed', 'temporary') == 'failed_temporary'
+    assert event_name('FAILED', 'permanent') == 'failed'
+    assert event_name('list.member') == 'list_member'
+    assert bucket_start(datetime(2024, 1, 1, 12, 59, 59)) == datetime(2024, 1, 1, 12)
+
+
+def test_out_of_order_events_keep_timeline_sorted(sqlite_storage):
+    aggregator = DeliveryAggregator(sqlite_storage)
+    for event, seconds in (('opened', 30), ('accepted', 0), ('delivered', 10)):
+        aggregator.apply(event_document(event, seconds))
+
+    state = aggregator.message('m1@acme.com')
+
+    assert state['status'] == 'opened'
+    assert [item['event'] for item in state['timeline']] == ['accepted', 'delivered', 'opened']
+    assert (state['first_event_at'], state['last_event_at']) == (BASE, datetime.fromtimestamp(BASE.timestamp() + 30))
+    assert aggregator.message('<M2@acme.com>') is None
+
+
+def test_domain_counter_only_counts_first_event_per_message(sqlite_storage):
+    aggregator = DeliveryAggregator(sqlite_storage)
+    # Mailgun gửi lại cùng event: chỉ tính một lần cho message
+    aggregator.apply(event_document('delivered', 0))
+    aggregator.apply(event_document('delivered', 5))
+    aggregator.apply(event_document('failed', 0, message_id='<m2@acme.com>', severity='temporary'))
+    aggregator.apply(event_document('failed', 60, message_id='<m2@acme.com>', severity='permanent'))
+    aggregator.apply(event_document('opened', 20))
+
+    [stats] = aggregator.domain_stats(SINCE, include_buckets=True)
+
+    assert stats['domain'] == 'gmail.com'
+    assert stats['counts'] == {'delivered': 1, 'failed_temporary': 1, 'failed': 1, 'opened': 1}
+    assert (stats['delivery_rate'], stats['bounce_rate'], stats['open_rate']) == (0.5, 0.5, 1.0)
+    assert [bucket['bucket'] for bucket in stats['buckets']] == [BASE]
+    assert aggregator.message('m1@acme.com')['counts']['delivered'] == 2
+
+
+def test_delivery_rates_without_sends():
+    assert delivery_rates({}) == {'delivery_rate': None, 'bounce_rate': None, 'open_rate': None, 'click_rate': None}
+
+
+def test_messages_endpoint_reports_status_and_timeline(make_app):
+    client = make_app().test_client()
+    for event, seconds in (('delivered', 10), ('accepted', 0)):
+        event_data = {
+            'event': event, 'timestamp': BASE.timestamp() + seconds, 'recipient': 'bob@gmail.com',
+            'message': {'headers': {'message-id': 'm1@acme.com'}},
+        }
+        assert client.post('/webhook/mailgun', data={'event-data': json.dumps(event_data)}).status_code == 200
+
+    data = client.get('/messages/<m1@acme.com>').get_json()
+
+    assert data['status'] == 'success'
+    assert data['message']['status'] == 'delivered'
+    assert [item['event'] for item in data['message']['timeline']] == ['accepted', 'delivered']
+    assert client.get('/messages/unknown@acme.com').status_code == 404
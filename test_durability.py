@@ -0,0 +1,57 @@
+"""
+Test profile độ bền khi ghi (fast | majority | spool) và read preference
+"""
+
+import pytest
+from pymongo import WriteConcern
+from pymongo.read_preferences import Primary, SecondaryPreferred
+
+from conftest import inbound_form
+from durability import DurabilityPolicy, read_preference, write_concern
+
+
+def test_parse_profiles_and_otp_precedence():
+    policy = DurabilityPolicy.parse('inbound_email=majority, otp=FAST ,email_event=spool', default='majority')
+
+    assert policy.profile_for({'webhook_type': 'inbound_email'}) == 'majority'
+    assert policy.profile_for({'webhook_type': 'inbound_email', 'otp': {'code': '123456'}}) == 'fast'
+    assert policy.profile_for({'webhook_type': 'unknown'}) == 'majority'
+    assert policy.uses_spool
+    # Webhook qua spool được worker ghi với majority
+    assert policy.flush_profile({'webhook_type': 'email_event'}) == 'majority'
+    assert not DurabilityPolicy.parse('').uses_spool
+
+
+def test_invalid_profile_is_rejected():
+    with pytest.raises(ValueError):
+        DurabilityPolicy.parse('inbound_email=w0')
+    with pytest.raises(ValueError):
+        DurabilityPolicy(default='none')
+
+
+def test_write_concern_and_read_preference():
+    assert write_concern('fast') == WriteConcern(w=1)
+    assert write_concern('majority') == WriteConcern(w='majority')
+    assert write_concern(None) is None
+
+    assert read_preference('primary') == Primary()
+    assert read_preference('secondaryPreferred', 120) == SecondaryPreferred(max_staleness=120)
+    with pytest.raises(ValueError):
+        read_preference('secondaryOnly')
+
+
+def test_ingest_uses_profile_of_webhook_type(make_app, tmp_path):
+    app = make_app(durability_profiles='inbound_email=fast,json_webhook=spool', ingest_spool_dir=str(tmp_path / 'spool'))
+    client = app.test_client()
+
+    stored = client.post('/webhook/mailgun', data=inbound_form('alice@example.com'))
+    assert (stored.status_code, stored.get_json()['durability']) == (200, 'fast')
+
+    queued = client.post('/webhook/mailgun', json={'order': 1})
+    assert queued.status_code == 202
+    assert sum(app.extensions['webhook_services'].get().ingest_spool.sizes()) == 1
+
+
+def test_invalid_durability_profile_fails_at_startup(make_app):
+    with pytest.raises(ValueError):
+        make_app(durability_profiles='inbound_email=fastest')
@@ -0,0 +1,69 @@
+"""
+Test fan-out: kiểm tra subscription, lọc theo tenant / người nhận, gửi qua queue trong process
+"""
+
+import queue
+
+import pytest
+
+from fanout import OutboundDispatcher, build_subscription, matches
+
+
+@pytest.mark.parametrize('data', [
+    {'url': 123},
+    {'queue': ['a']},
+    {'queue': 'q', 'name': 5},
+    {'queue': 'q', 'recipients': [None]},
+    {'queue': 'q', 'webhook_types': {'inbound_email': 1}},
+    {'queue': 'q', 'batch_size': None},
+    {'queue': 'q', 'max_retries': -1},
+    {'url': 'ftp://example.com'},
+    {'url': 'https://example.com', 'queue': 'q'},
+    ['https://example.com'],
+])
+def test_build_subscription_rejects_invalid_input(data):
+    with pytest.raises(ValueError):
+        build_subscription(data)
+
+
+def test_build_subscription_normalizes_recipients():
+    subscription = build_subscription({'queue': 'q', 'recipients': ' Alice@Example.com ', 'batch_size': '5'})
+
+    assert subscription['recipients'] == ['alice@example.com']
+    assert subscription['batch_size'] == 5
+    assert subscription['name'] == 'q'
+
+
+def test_matches_tenant_type_and_recipient_domain():
+    subscription = build_subscription({'queue': 'q', 'recipients': ['@example.com']}, tenant='acme')
+    document = {'webhook_type': 'inbound_email', 'tenant': 'acme', 'recipient_addresses': ['bob@example.com']}
+
+    assert matches(subscription, document)
+    assert not matches(subscription, {**document, 'tenant': 'other'})
+    assert not matches(subscription, {**document, 'webhook_type': 'email_event'})
+    assert not matches(subscription, {**document, 'recipient_addresses': ['bob@other.com']})
+
+
+def test_publish_delivers_to_local_queue(sqlite_storage):
+    dispatcher = OutboundDispatcher(sqlite_storage, batch_wait=0)
+    target = queue.Queue()
+    dispatcher.register_queue('local', target)
+    dispatcher.subscribe(build_subscription({'queue': 'local', 'recipients': ['alice@example.com']}))
+    try:
+        dispatcher.publish({'_id': '1', 'webhook_type': 'inbound_email', 'recipient_addresses': ['alice@example.com']})
+        dispatcher.publish({'_id': '2', 'webhook_type': 'inbound_email', 'recipient_addresses': ['bob@example.com']})
+        batch = target.get(timeout=5)
+    finally:
+        dispatcher.shutdown(timeout=5)
+
+    assert [payload['_id'] for payload in batch] == ['1']
+    assert target.empty()
+
+
+def test_create_subscription_rejects_non_string_url(make_app):
+    client = make_app().test_client()
+
+    response = client.post('/subscriptions', json={'url': 123})
+    assert response.status_code == 400
+    assert response.get_json()['status'] == 'error'
+    assert client.post('/subscriptions', json={'queue': 'local'}).status_code == 201
@@ -0,0 +1,45 @@
+"""
+Test sanitizer và các variant render của html_render
+"""
+
+from html_render import RenderCache, html_to_text, render_etag, sanitize_html
+
+
+def test_sanitize_drops_scripts_handlers_and_unsafe_urls():
+    result = sanitize_html(
+        '<div onclick="steal()">Hi<script>alert(1)</script>'
+        '<a href="javascript:alert(1)">bad</a><a href="https://example.com/?utm_source=x&id=7">ok</a>'
+        '<p style="background:url(https://t.example/p)">styled</p></div>'
+    )
+
+    assert 'script' not in result and 'alert' not in result and 'onclick' not in result
+    assert '<a target="_blank" rel="noopener noreferrer nofollow">bad</a>' in result
+    assert 'href="https://example.com/?id=7"' in result
+    assert '<p>styled</p>' in result
+
+
+def test_sanitize_never_keeps_image_sources():
+    result = sanitize_html(
+        '<img src="https://cdn.example.com/logo.png" alt="Logo">'
+        '<img src="cid:part1@example.com">'
+        '<img src="https://t.example/open.gif" width="1" height="1" alt="pixel">'
+    )
+
+    assert result == '[Logo][image]'
+
+
+def test_sanitize_balances_unclosed_tags():
+    assert sanitize_html('<div><b>bold<i>both</div>after') == '<div><b>bold<i>both</i></b></div>after'
+
+
+def test_html_to_text_keeps_block_breaks():
+    assert html_to_text('<p>Line one</p><ul><li>first</li><li>second</li></ul>') == 'Line one\n\n- first\n- second'
+
+
+def test_render_cache_etag_matches_precomputed():
+    cache = RenderCache()
+    content, etag = cache.get('<p>Hello</p>', 'text')
+
+    assert content == 'Hello'
+    assert etag == render_etag('<p>Hello</p>', 'text')
+    assert cache.get('<p>Hello</p>', 'text') == (content, etag)
@@ -0,0 +1,58 @@
+"""
+Test trích xuất OTP khi ingest và GET /emails/inbox/<recipient>/code
+"""
+
+import json
+
+from conftest import inbound_form
+from otp_extractor import OTPExtractor
+from settings import Settings
+
+
+def post_email(client, recipient, subject, html):
+    response = client.post('/webhook/mailgun', data=inbound_form(recipient, subject, html=html, text=''))
+    assert response.status_code == 200
+    return response.get_json()['webhook_id']
+
+
+def test_extract_code_and_link_from_subject_text_and_html():
+    extractor = OTPExtractor()
+
+    assert extractor.extract(subject='Your verification code is 482913')['code'] == '482913'
+    assert extractor.extract(text='123456 là mã xác minh của bạn')['code'] == '123456'
+
+    result = extractor.extract(body_html='<p>Mã OTP: <b>7788</b></p><a href="https://app.example.com/verify?t=abc">Xác minh</a>')
+    assert result == {'code': '7788', 'codes': ['7788'], 'link': 'https://app.example.com/verify?t=abc', 'source': 'html'}
+    assert extractor.extract(subject='Hello', text='No numbers here') is None
+
+
+def test_sender_and_domain_patterns_override_default(tmp_path):
+    path = tmp_path / 'otp.json'
+    path.write_text(json.dumps({
+        'senders': {'login@bank.com': {'code': [r'PIN (?P<code>\d{3})']}},
+        'domains': {'shop.com': {'code': [r'#(\d{5})']}},
+    }))
+    extractor = OTPExtractor.from_settings(Settings(otp_patterns_file=str(path)))
+
+    assert extractor.extract(sender='login@bank.com', text='PIN 123 code 999999')['code'] == '123'
+    # Domain cha khớp cả subdomain
+    assert extractor.extract(sender='no-reply@mail.shop.com', text='Order #54321')['code'] == '54321'
+    assert extractor.extract(sender='a@other.com', text='code 999999')['code'] == '999999'
+
+
+def test_code_endpoint_returns_latest_code(make_app):
+    client = make_app().test_client()
+    assert client.get('/emails/inbox/alice@example.com/code').status_code == 404
+
+    post_email(client, 'alice@example.com', 'Your code', '<p>Your code is 111111</p>')
+    latest_id = post_email(client, 'alice@example.com', 'Your code', '<p>Your code is 222222</p>')
+    post_email(client, 'alice@example.com', 'Newsletter', '<p>No code</p>')
+
+    response = client.get('/emails/inbox/alice@example.com/code')
+    data = response.get_json()
+    assert response.status_code == 200
+    assert (data['code'], data['email_id']) == ('222222', latest_id)
+    assert len(response.get_data()) < 300
+
+    assert client.get('/emails/inbox/alice@example.com/code', headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+    assert client.get('/emails/inbox/bob@example.com/code').status_code == 404
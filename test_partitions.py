@@ -0,0 +1,36 @@
+"""
+Test PartitionScheme: tên, khoảng thời gian và partition kế tiếp theo ngày / tuần
+"""
+
+from datetime import datetime
+
+import pytest
+
+from partitions import PartitionScheme
+
+
+def test_day_scheme_names_and_bounds():
+    scheme = PartitionScheme('day')
+
+    assert scheme.name_for(datetime(2024, 1, 31, 23, 59)) == 'webhooks_20240131'
+    assert scheme.bounds('webhooks_20240131') == (datetime(2024, 1, 31), datetime(2024, 2, 1))
+    assert scheme.next_name(datetime(2024, 1, 31, 23, 59)) == 'webhooks_20240201'
+
+
+def test_week_scheme_crosses_iso_year():
+    scheme = PartitionScheme('week')
+
+    # 2024-12-30 thuộc tuần ISO 1 của 2025
+    assert scheme.name_for(datetime(2024, 12, 30)) == 'webhooks_2025w01'
+    assert scheme.bounds('webhooks_2025w01') == (datetime(2024, 12, 30), datetime(2025, 1, 6))
+    assert scheme.next_name(datetime(2024, 12, 29)) == 'webhooks_2025w01'
+
+
+def test_bounds_ignores_other_collections():
+    scheme = PartitionScheme('day')
+
+    assert scheme.bounds('webhooks') is None
+    assert scheme.bounds('other_20240101') is None
+    assert scheme.bounds('webhooks_2024w01') is None
+    with pytest.raises(ValueError):
+        PartitionScheme('month')
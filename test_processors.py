@@ -0,0 +1,67 @@
+"""
+Test phân loại webhook theo processor, collection riêng của từng loại và worker pool sau khi lưu
+"""
+
+import json
+from datetime import datetime
+
+from conftest import inbound_form
+from processors import create_dispatcher
+
+EVENT = {
+    'event': 'failed',
+    'timestamp': 1704110400.5,
+    'recipient': 'Bob@Gmail.com',
+    'domain': 'acme.com',
+    'severity': 'permanent',
+    'delivery-status': {'code': 550},
+    'message': {'headers': {'message-id': 'abc@acme.com'}},
+}
+
+
+def test_webhook_type_routing(make_app):
+    client = make_app().test_client()
+
+    def webhook_type(**kwargs):
+        response = client.post('/webhook/mailgun', **kwargs)
+        assert response.status_code == 200
+        return response.get_json()['webhook_type']
+
+    assert webhook_type(data=inbound_form('alice@example.com')) == 'inbound_email'
+    assert webhook_type(data={'event-data': json.dumps(EVENT)}) == 'email_event'
+    assert webhook_type(json={'event-data': EVENT}) == 'email_event'
+    assert webhook_type(json={'order': 1}) == 'json_webhook'
+    assert webhook_type(data={'foo': 'bar'}) == 'unknown'
+    # event-data hỏng không làm request lỗi
+    assert webhook_type(data={'event-data': '{not json'}) == 'unknown'
+
+
+def test_email_event_fields_and_record(make_app):
+    app = make_app()
+    client = app.test_client()
+    webhook_id = client.post('/webhook/mailgun', data={'event-data': json.dumps(EVENT)}).get_json()['webhook_id']
+
+    webhook = client.get(f'/webhook/{webhook_id}').get_json()['webhook']
+    assert (webhook['event_type'], webhook['message_id'], webhook['recipient']) == ('failed', 'abc@acme.com', 'bob@gmail.com')
+
+    storage = app.extensions['webhook_services'].get().storage
+    [record] = storage.find_records('email_events', 'message_id', 'abc@acme.com')
+    assert (record['webhook_id'], record['severity'], record['delivery_code']) == (webhook_id, 'permanent', 550)
+
+
+def test_worker_pool_runs_after_store_off_request_path(sqlite_storage):
+    dispatcher = create_dispatcher(sqlite_storage, workers=2)
+    seen = []
+    dispatcher.add_listener('email_event', lambda document: seen.append(document['message_id']))
+    dispatcher.add_listener('inbound_email', lambda document: seen.append('inbound'))
+
+    document = {'timestamp': datetime.now(), 'request_form_data': {'event-data': json.dumps(EVENT)}}
+    processor = dispatcher.classify(document)
+    processor.enrich(document)
+    document['webhook_type'] = processor.webhook_type
+    sqlite_storage.insert(document)
+    dispatcher.after_store(processor, document)
+    dispatcher.shutdown(wait=True)
+
+    assert seen == ['abc@acme.com']
+    assert len(sqlite_storage.find_records('email_events', 'message_id', 'abc@acme.com')) == 1
@@ -0,0 +1,69 @@
+"""
+Test response_utils: chọn coding theo q của Accept-Encoding, tham số max_body_bytes, JSON default
+"""
+
+import json
+from datetime import datetime
+
+import pytest
+from bson import ObjectId
+
+import response_utils
+from response_utils import _choose_encoding, truncate_text
+from storage import json_default
+
+
+@pytest.fixture
+def without_brotli(monkeypatch):
+    monkeypatch.setattr(response_utils, 'brotli', None)
+
+
+def test_choose_encoding_skips_q_zero(without_brotli):
+    assert _choose_encoding('gzip, deflate') == 'gzip'
+    assert _choose_encoding('gzip;q=0, deflate') is None
+    assert _choose_encoding('GZIP ; Q=0.5') == 'gzip'
+    assert _choose_encoding('*') == 'gzip'
+    assert _choose_encoding('*, gzip;q=0') is None
+    assert _choose_encoding('identity') is None
+    assert _choose_encoding('') is None
+
+
+def test_choose_encoding_prefers_higher_q(monkeypatch):
+    monkeypatch.setattr(response_utils, 'brotli', object())
+
+    assert _choose_encoding('gzip, br') == 'br'
+    assert _choose_encoding('gzip;q=1, br;q=0.5') == 'gzip'
+    assert _choose_encoding('gzip, br;q=0') == 'gzip'
+
+
+def test_truncate_text_keeps_utf8_characters():
+    assert truncate_text('xin chào', 7) == ('xin ch', True)
+    assert truncate_text('abc', 10) == ('abc', False)
+
+
+def test_json_default_shared_by_storage_and_responses():
+    webhook_id = ObjectId()
+    document = {'_id': webhook_id, 'timestamp': datetime(2024, 1, 1), 'raw': b'body'}
+
+    assert json.loads(json.dumps(document, default=json_default)) == {
+        '_id': str(webhook_id), 'timestamp': '2024-01-01T00:00:00', 'raw': 'body'
+    }
+    assert response_utils.FastJSONProvider.default is json_default
+
+
+def test_invalid_max_body_bytes_returns_400(make_app, without_brotli):
+    client = make_app().test_client()
+
+    response = client.get('/webhooks?max_body_bytes=abc')
+    assert response.status_code == 400
+    assert response.get_json()['status'] == 'error'
+    assert client.get('/webhooks?max_body_bytes=10').status_code == 200
+
+
+def test_gzip_only_when_accepted(make_app, without_brotli):
+    client = make_app().test_client()
+    for index in range(20):
+        client.post('/webhook/mailgun', data={'recipient': f'user{index}@example.com', 'Subject': 'x' * 100})
+
+    assert client.get('/webhooks', headers={'Accept-Encoding': 'gzip'}).headers['Content-Encoding'] == 'gzip'
+    assert 'Content-Encoding' not in client.get('/webhooks', headers={'Accept-Encoding': 'gzip;q=0'}).headers
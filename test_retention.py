@@ -0,0 +1,71 @@
+"""
+Test retention: parse thời gian / policy, dry-run report, archive NDJSON theo ngày rồi xóa theo batch
+"""
+
+import gzip
+from datetime import datetime, timedelta
+
+import pytest
+from bson import json_util
+
+from retention import RetentionPruner, load_policies, parse_duration
+
+NOW = datetime(2024, 1, 10, 12, 0, 0)
+
+
+def webhook(webhook_type, age, subject='Mail'):
+    return {
+        'timestamp': NOW - age,
+        'webhook_type': webhook_type,
+        'request_form_data': {'Subject': subject},
+        'recipient_addresses': ['a@example.com'],
+    }
+
+
+def test_parse_duration_and_policies():
+    assert parse_duration('15m') == timedelta(minutes=15)
+    assert parse_duration('2w') == timedelta(weeks=2)
+    assert parse_duration('90') == parse_duration(90) == timedelta(seconds=90)
+    with pytest.raises(ValueError):
+        parse_duration('1y')
+
+    assert load_policies('{"inbound_email": "1h", "unknown": "30d"}') == {
+        'inbound_email': timedelta(hours=1), 'unknown': timedelta(days=30)
+    }
+    assert load_policies('  ') == {}
+
+
+def test_report_counts_only_expired_documents(sqlite_storage):
+    sqlite_storage.insert_many([
+        webhook('inbound_email', timedelta(hours=2)),
+        webhook('inbound_email', timedelta(minutes=5)),
+        webhook('unknown', timedelta(days=2)),
+    ])
+    pruner = RetentionPruner(sqlite_storage, {'inbound_email': timedelta(hours=1)})
+
+    [report] = pruner.report(now=NOW)
+
+    assert (report['webhook_type'], report['documents'], report['max_age_seconds']) == ('inbound_email', 1, 3600)
+    assert report['bytes'] > 0
+    assert len(sqlite_storage.list_changes()) == 3
+
+
+def test_run_once_archives_by_day_then_deletes(tmp_path, sqlite_storage):
+    sqlite_storage.insert_many(
+        [webhook('inbound_email', timedelta(days=2, minutes=index), f'Old {index}') for index in range(5)]
+        + [webhook('inbound_email', timedelta(days=3), 'Older'), webhook('inbound_email', timedelta(minutes=1), 'New')]
+    )
+    pruner = RetentionPruner(
+        sqlite_storage, {'inbound_email': timedelta(days=1)}, archive_dir=str(tmp_path / 'archive'), batch_size=2
+    )
+
+    [summary] = pruner.run_once(now=NOW)
+
+    assert summary['deleted'] == 6 and summary['archived_bytes'] > 0
+    assert [change['request_form_data']['Subject'] for change in sqlite_storage.list_changes()] == ['New']
+    archived = {}
+    for day in ('2024-01-07', '2024-01-08'):
+        with gzip.open(tmp_path / 'archive' / 'inbound_email' / f'{day}.ndjson.gz', 'rt', encoding='utf-8') as f:
+            archived[day] = [json_util.loads(line)['request_form_data']['Subject'] for line in f]
+    assert archived['2024-01-07'] == ['Older']
+    assert sorted(archived['2024-01-08']) == [f'Old {index}' for index in range(5)]
@@ -0,0 +1,55 @@
+"""
+Test Settings: đọc biến môi trường một lần và truyền vào các factory thay cho os.getenv
+"""
+
+from datetime import timedelta
+
+from fanout import create_outbound_dispatcher
+from otp_extractor import OTPExtractor
+from retention import create_pruner
+from settings import Settings
+from storage import SQLiteWebhookStorage, create_storage
+
+
+def test_from_env_reads_retention_fanout_otp_and_ingest(monkeypatch):
+    monkeypatch.setenv('RETENTION_POLICIES', '{"inbound_email": "1h"}')
+    monkeypatch.setenv('BLOB_GC_GRACE', '2h')
+    monkeypatch.setenv('FANOUT_POOL_SIZE', '3')
+    monkeypatch.setenv('OTP_PATTERNS_FILE', 'otp.json')
+    monkeypatch.setenv('INGEST_BATCH_SIZE', '50')
+
+    settings = Settings.from_env(load_env=False)
+
+    assert settings.retention_policies == '{"inbound_email": "1h"}'
+    assert settings.blob_gc_grace == '2h'
+    assert settings.fanout_pool_size == 3
+    assert settings.otp_patterns_file == 'otp.json'
+    assert settings.ingest_batch_size == 50
+
+
+def test_factories_use_settings(tmp_path, monkeypatch):
+    # Biến môi trường không còn được đọc trực tiếp trong các factory
+    monkeypatch.setenv('RETENTION_POLICIES', '{"unknown": "1d"}')
+    monkeypatch.setenv('SQLITE_PATH', str(tmp_path / 'env.db'))
+    settings = Settings(
+        storage_backend='sqlite', sqlite_path=str(tmp_path / 'settings.db'), blob_dir='',
+        retention_policies='{"inbound_email": "1h"}', blob_gc_grace='2h', retention_batch_size=10,
+        fanout_queue_size=5, otp_patterns_file=str(tmp_path / 'missing.json'),
+    )
+
+    storage = create_storage(settings)
+    assert isinstance(storage, SQLiteWebhookStorage) and storage.path == str(tmp_path / 'settings.db')
+
+    pruner = create_pruner(storage, settings)
+    assert pruner.policies == {'inbound_email': timedelta(hours=1)}
+    assert (pruner.blob_grace, pruner.batch_size) == (timedelta(hours=2), 10)
+    assert create_pruner(storage, Settings()) is None
+
+    dispatcher = create_outbound_dispatcher(storage, settings)
+    try:
+        assert dispatcher.queue_size == 5
+    finally:
+        dispatcher.shutdown(timeout=1)
+
+    # File pattern không đọc được: dùng pattern mặc định
+    assert OTPExtractor.from_settings(settings).senders == {}
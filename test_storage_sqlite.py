@@ -0,0 +1,117 @@
+"""
+Test SQLiteWebhookStorage: bảng index phụ, full-text search, inbox theo lô
+"""
+
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+from storage import SQLiteWebhookStorage
+
+SIDE_TABLES = ('webhook_recipients', 'webhook_codes', 'webhook_categories', 'webhook_blobs', 'webhooks_fts')
+BASE_TIME = datetime(2024, 1, 1, 12, 0, 0)
+
+
+def inbound_document(recipient, subject, minutes=0, tenant='', **extra):
+    document = {
+        'timestamp': BASE_TIME + timedelta(minutes=minutes),
+        'webhook_type': 'inbound_email',
+        'request_form_data': {
+            'sender': 'sender@example.net',
+            'Subject': subject,
+            'stripped-text': f'{subject} body',
+        },
+        'recipient_addresses': [recipient],
+        'tenant': tenant,
+    }
+    document.update(extra)
+    return document
+
+
+def count(storage, table):
+    return storage._connect().execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+
+
+def test_fts_backfill_indexes_existing_emails(tmp_path, sqlite_storage):
+    sqlite_storage.insert(inbound_document('a@example.com', 'Quarterly invoice'))
+    # Database tạo trước khi có bảng FTS: bảng rỗng, mở lại thì được backfill
+    sqlite_storage._connect().execute('DELETE FROM webhooks_fts')
+
+    reopened = SQLiteWebhookStorage(str(tmp_path / 'webhooks.db'))
+    reopened.ensure_indexes()
+
+    results, _ = reopened.search_text('invoice')
+    assert [result['subject'] for result in results] == ['Quarterly invoice']
+
+
+def test_delete_by_ids_removes_side_table_rows(sqlite_storage):
+    kept = sqlite_storage.insert(inbound_document('b@example.com', 'Keep me'))
+    deleted = sqlite_storage.insert(inbound_document(
+        'a@example.com', 'Your code', otp={'code': '123456'}, subject_categories=['otp'],
+        request_files={'attachment-1': {'filename': 'a.pdf', 'blob': 'ab' * 32}},
+    ))
+    for table in SIDE_TABLES:
+        assert count(sqlite_storage, table) >= 1, table
+
+    assert sqlite_storage.delete_by_ids([deleted]) == 1
+
+    for table in ('webhook_codes', 'webhook_categories', 'webhook_blobs'):
+        assert count(sqlite_storage, table) == 0, table
+    assert count(sqlite_storage, 'webhook_recipients') == 1
+    assert count(sqlite_storage, 'webhooks_fts') == 1
+    assert sqlite_storage.find_by_id(kept) is not None
+    assert sqlite_storage.live_blob_keys() == set()
+
+
+def test_find_inbox_batch_returns_newest_per_recipient(sqlite_storage):
+    sqlite_storage.insert_many([
+        inbound_document('a@example.com', f'A{index}', minutes=index) for index in range(3)
+    ] + [inbound_document('b@example.com', 'B0', minutes=10)])
+
+    results = sqlite_storage.find_inbox_batch(['a@example.com', 'b@example.com', 'c@example.com'], limit=2)
+
+    assert [email['subject'] for email in results['a@example.com']] == ['A2', 'A1']
+    assert [email['subject'] for email in results['b@example.com']] == ['B0']
+    assert results['c@example.com'] == []
+
+
+def test_find_inbox_batch_filters_by_tenant(sqlite_storage):
+    sqlite_storage.insert_many([
+        inbound_document('shared@example.com', 'Acme mail', tenant='acme'),
+        inbound_document('shared@example.com', 'Other mail', minutes=1, tenant='other'),
+    ])
+
+    results = sqlite_storage.find_inbox_batch(['shared@example.com'], tenant='acme')
+
+    assert [email['subject'] for email in results['shared@example.com']] == ['Acme mail']
+
+
+def test_list_changes_filters_by_tenant(sqlite_storage):
+    acme_id = sqlite_storage.insert(inbound_document('a@acme.com', 'Acme', tenant='acme'))
+    sqlite_storage.insert(inbound_document('b@other.com', 'Other', minutes=1, tenant='other'))
+
+    assert [str(change['_id']) for change in sqlite_storage.list_changes(tenant='acme')] == [acme_id]
+    assert len(sqlite_storage.list_changes()) == 2
+
+
+def test_insert_many_skips_existing_ids(sqlite_storage):
+    documents = [inbound_document('a@example.com', f'Retry {index}', minutes=index) for index in range(2)]
+    webhook_id = ObjectId()
+    documents[0]['_id'] = webhook_id
+    sqlite_storage.insert_many([dict(documents[0])])
+
+    ids = sqlite_storage.insert_many(documents)
+
+    assert ids == [str(documents[1]['_id'])]
+    assert count(sqlite_storage, 'webhooks') == 2
+    assert count(sqlite_storage, 'webhook_recipients') == 2
+    assert count(sqlite_storage, 'webhooks_fts') == 2
+
+
+def test_insert_many_skips_existing_ingest_id(sqlite_storage):
+    ingest_id = ObjectId()
+    first = sqlite_storage.insert_many([inbound_document('a@example.com', 'Spooled', ingest_id=ingest_id)])
+
+    # Lần ghi lại có _id mới (gán lúc ghi) nhưng cùng ingest_id
+    assert sqlite_storage.insert_many([inbound_document('a@example.com', 'Spooled', ingest_id=ingest_id)]) == []
+    assert [str(change['_id']) for change in sqlite_storage.list_changes()] == first
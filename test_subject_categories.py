@@ -0,0 +1,72 @@
+"""
+Test subject category: gắn khi ingest, lọc inbox theo ?category=, category mặc định và gắn lại
+"""
+
+import json
+
+import pytest
+
+from conftest import inbound_form
+from subject_categories import SubjectCategorizer
+
+
+def post_email(client, recipient, subject):
+    response = client.post('/webhook/mailgun', data=inbound_form(recipient, subject, html=f'<p>{subject}</p>'))
+    assert response.status_code == 200
+
+
+def test_categorize_default_categories():
+    categorizer = SubjectCategorizer()
+
+    assert categorizer.categorize('Your verification code') == ['verification-code', 'otp']
+    assert categorizer.categorize('Reset your password') == ['password-reset']
+    assert categorizer.categorize('Chào mừng bạn') == ['welcome']
+    assert categorizer.categorize('Monthly newsletter') == []
+    assert categorizer.categorize(None) == []
+
+
+def test_categories_file_replaces_defaults(tmp_path):
+    path = tmp_path / 'categories.json'
+    path.write_text(json.dumps({'categories': {'invoice': 'invoice|hóa đơn'}}))
+
+    categorizer = SubjectCategorizer.from_file(str(path))
+
+    assert categorizer.names == ['invoice']
+    assert categorizer.categorize('Hóa đơn tháng 1') == ['invoice']
+    with pytest.raises(ValueError):
+        SubjectCategorizer({'Bad Name': ['x']})
+
+
+def test_inbox_category_filter(make_app):
+    client = make_app().test_client()
+    post_email(client, 'alice@example.com', 'Reset your password')
+    post_email(client, 'alice@example.com', 'Welcome aboard')
+
+    response = client.get('/emails/inbox/alice@example.com?category=password-reset')
+    assert response.status_code == 200
+    assert response.get_data(as_text=True) == '<p>Reset your password</p>'
+
+    assert client.get('/emails/inbox/alice@example.com?category=invoice').status_code == 400
+    assert client.get('/emails/inbox/bob@example.com?category=welcome').status_code == 404
+
+
+def test_inbox_default_category(make_app):
+    client = make_app(inbox_default_category='welcome').test_client()
+    post_email(client, 'alice@example.com', 'Your verification code')
+    post_email(client, 'alice@example.com', 'Welcome aboard')
+
+    # Không truyền subject / category: dùng INBOX_DEFAULT_CATEGORY thay cho regex "verification code"
+    assert client.get('/emails/inbox/alice@example.com').get_data(as_text=True) == '<p>Welcome aboard</p>'
+
+
+def test_tag_subject_categories_tags_old_emails(make_app):
+    app = make_app()
+    client = app.test_client()
+    post_email(client, 'alice@example.com', 'Welcome aboard')
+    storage = app.extensions['webhook_services'].get().storage
+    # Email lưu trước khi có category
+    storage._connect().execute('DELETE FROM webhook_categories')
+    assert client.get('/emails/inbox/alice@example.com?category=welcome').status_code == 404
+
+    assert storage.tag_subject_categories(SubjectCategorizer().categorize, retag=True) == 1
+    assert client.get('/emails/inbox/alice@example.com?category=welcome').status_code == 200
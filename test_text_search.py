@@ -0,0 +1,77 @@
+"""
+Test full-text search: xếp hạng, phân trang bằng cursor, snippet và phạm vi tenant của /emails/search?q=
+"""
+
+import pytest
+
+from conftest import inbound_form
+from text_search import build_fts_query, decode_cursor, encode_cursor, make_snippet
+
+
+def post_email(client, recipient, subject, text):
+    response = client.post('/webhook/mailgun', data=inbound_form(recipient, subject, text=text, **{'stripped-text': text}))
+    assert response.status_code == 200
+    return response.get_json()['webhook_id']
+
+
+def search(client, query, **params):
+    response = client.get('/emails/search', query_string={'q': query, **params})
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_build_fts_query_quotes_tokens():
+    assert build_fts_query('Invoice "OR" -2024*') == '"invoice" "or" "2024"'
+    assert build_fts_query('  ') == ''
+
+
+def test_cursor_round_trip_and_invalid_cursor():
+    assert decode_cursor(encode_cursor(1.5, 'abc')) == (1.5, 'abc')
+    with pytest.raises(ValueError):
+        decode_cursor('not-a-cursor')
+
+
+def test_make_snippet_marks_terms():
+    snippet = make_snippet('Please pay the invoice today', ['invoice'])
+    assert '<mark>invoice</mark>' in snippet
+
+
+def test_search_ranks_subject_match_and_returns_snippets(make_app):
+    client = make_app().test_client()
+    subject_id = post_email(client, 'a@example.com', 'Invoice 42', 'Payment is due')
+    body_id = post_email(client, 'b@example.com', 'Monthly update', 'The invoice is attached')
+    post_email(client, 'c@example.com', 'Newsletter', 'Nothing to see')
+
+    data = search(client, 'invoice')
+
+    assert [result['_id'] for result in data['results']] == [subject_id, body_id]
+    assert all('<mark>' in result['snippet'].lower() for result in data['results'])
+    assert 'request_form_data' not in data['results'][0]
+    assert data['next_cursor'] is None
+
+
+def test_search_paginates_with_cursor(make_app):
+    client = make_app().test_client()
+    ids = {post_email(client, f'user{index}@example.com', f'Report {index}', 'quarterly report') for index in range(5)}
+
+    seen, cursor = [], None
+    while True:
+        data = search(client, 'report', limit=2, **({'cursor': cursor} if cursor else {}))
+        seen.extend(result['_id'] for result in data['results'])
+        cursor = data['next_cursor']
+        if not cursor:
+            break
+
+    assert len(seen) == len(ids) and set(seen) == ids
+    assert client.get('/emails/search?q=report&cursor=bad').status_code == 400
+
+
+def test_search_is_scoped_to_tenant(make_app):
+    client = make_app(tenants={'acme': {'domains': ['acme.com'], 'api_keys': ['acme-key']}}).test_client()
+    acme_id = post_email(client, 'alice@acme.com', 'Invoice acme', 'invoice')
+    post_email(client, 'bob@other.com', 'Invoice other', 'invoice')
+
+    scoped = client.get('/emails/search?q=invoice', headers={'X-API-Key': 'acme-key'}).get_json()
+
+    assert [result['_id'] for result in scoped['results']] == [acme_id]
+    assert search(client, 'invoice')['count'] == 2
@@ -0,0 +1,64 @@
+"""
+Tiện ích cho full-text search: chuẩn hóa query, cursor phân trang và snippet
+"""
+
+import base64
+import json
+import re
+
+# Ký tự bao quanh từ khóa khớp trong snippet
+SNIPPET_START = '<mark>'
+SNIPPET_END = '</mark>'
+SNIPPET_WIDTH = 160
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(query):
+    """Tách query thành các từ khóa (chữ thường)"""
+    return [token.lower() for token in _TOKEN_RE.findall(query or '')]
+
+
+def build_fts_query(query):
+    """
+    Chuyển query người dùng thành cú pháp MATCH của SQLite FTS5.
+    Mỗi từ được quote để tránh lỗi cú pháp, các từ kết hợp bằng AND.
+    """
+    tokens = tokenize(query)
+    return ' '.join(f'"{token}"' for token in tokens)
+
+
+def encode_cursor(score, webhook_id):
+    """Mã hóa vị trí cuối trang (score, id) thành cursor dạng chuỗi"""
+    raw = json.dumps([score, str(webhook_id)], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Giải mã cursor, raise ValueError nếu cursor không hợp lệ"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        score, webhook_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return float(score), str(webhook_id)
+    except Exception:
+        raise ValueError('Cursor không hợp lệ')
+
+
+def make_snippet(text, terms, width=SNIPPET_WIDTH):
+    """Cắt đoạn văn bản quanh từ khóa khớp đầu tiên và đánh dấu các từ khóa"""
+    if not text:
+        return ''
+    text = ' '.join(text.split())
+    lowered = text.lower()
+    positions = [lowered.find(term) for term in terms if term and lowered.find(term) >= 0]
+    first = min(positions) if positions else 0
+
+    start = max(0, first - width // 3)
+    end = min(len(text), start + width)
+    snippet = text[start:end]
+    if terms:
+        pattern = re.compile('|'.join(re.escape(term) for term in terms if term), re.IGNORECASE)
+        snippet = pattern.sub(lambda m: f'{SNIPPET_START}{m.group(0)}{SNIPPET_END}', snippet)
+    return ('…' if start > 0 else '') + snippet + ('…' if end < len(text) else '')